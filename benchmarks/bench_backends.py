@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Compare the per-job overhead of the yt-dlp executable with the yt_dlp worker pool, using the fakes.
+
+The executable backend starts a process for every download, which then
+loads yt-dlp (FAKE_YTDLP_STARTUP_DELAY) and opens its first connection
+(FAKE_YTDLP_CONNECT_DELAY). The worker pool pays both once per worker: the
+fake yt_dlp package sleeps as long on import and on a YoutubeDL's first
+download. The downloads themselves are kept short, so what is measured is
+mostly what each backend adds to a job. Reports the median and 90th
+percentile time per job one at a time, and the throughput of --workers
+downloads at once.
+
+Usage:
+    python benchmarks/bench_backends.py [--jobs 20] [--workers 3] [--startup 0.4] [--connect 0.1]
+"""
+
+import argparse
+import importlib.util
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_YT_DLP = os.path.join(HERE, "fake_yt_dlp.py")
+FAKE_YT_DLP_PACKAGE = os.path.join(HERE, "fake_yt_dlp_package")
+
+def load_app():
+    path = os.path.join(HERE, os.pardir, "youtube-downloader.py")
+    spec = importlib.util.spec_from_file_location("youtube_downloader", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def wait_until_finished(engine, count):
+    while sum(1 for job in engine.jobs() if job.finished) < count:
+        time.sleep(0.005)
+
+def close(engine):
+    """Let the worker pool, if any, exit before the next engine starts its own"""
+    pool = engine.worker_pool
+    if pool is not None:
+        pool.close()
+        while pool.worker_count():
+            time.sleep(0.01)
+
+def warm_up(engine):
+    """Wait for the worker pool, if any, to have its workers ready"""
+    pool = engine.worker_pool
+    while pool is not None and pool.available is None:
+        time.sleep(0.01)
+
+def one_at_a_time(app, backend, count):
+    engine = app.DownloadEngine(max_workers=1, backend=backend)
+    engine.ffmpeg_path = None
+    warm_up(engine)
+    times = []
+    with tempfile.TemporaryDirectory() as save_dir:
+        for i in range(count):
+            start = time.perf_counter()
+            engine.add(f"https://www.youtube.com/watch?v=seq{backend[:3]}{i:05d}", save_dir)
+            wait_until_finished(engine, i + 1)
+            times.append(time.perf_counter() - start)
+    failed = sum(1 for job in engine.jobs() if job.state != app.JOB_DONE)
+    close(engine)
+    return times, failed
+
+def concurrent(app, backend, count, workers):
+    done = threading.Event()
+    remaining = [count]
+    lock = threading.Lock()
+
+    def on_update(job):
+        if job.finished:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    done.set()
+
+    engine = app.DownloadEngine(max_workers=workers, on_update=on_update, backend=backend)
+    engine.ffmpeg_path = None
+    warm_up(engine)
+    with tempfile.TemporaryDirectory() as save_dir:
+        start = time.perf_counter()
+        for i in range(count):
+            engine.add(f"https://www.youtube.com/watch?v=par{backend[:3]}{i:05d}", save_dir)
+        done.wait()
+        elapsed = time.perf_counter() - start
+    close(engine)
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=3, help="parallel downloads")
+    parser.add_argument("--startup", type=float, default=0.4,
+                        help="seconds loading yt-dlp takes (default 0.4)")
+    parser.add_argument("--connect", type=float, default=0.1,
+                        help="seconds opening the first connection takes (default 0.1)")
+    args = parser.parse_args()
+
+    os.environ["YT_DLP_PATH"] = FAKE_YT_DLP
+    os.environ["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [FAKE_YT_DLP_PACKAGE, os.environ.get("PYTHONPATH")]))
+    os.environ["FAKE_YTDLP_STARTUP_DELAY"] = str(args.startup)
+    os.environ["FAKE_YTDLP_CONNECT_DELAY"] = str(args.connect)
+    os.environ.setdefault("FAKE_YTDLP_EXTRACT_DELAY", "0.05")
+    os.environ.setdefault("FAKE_YTDLP_PROGRESS_LINES", "20")
+    os.environ.setdefault("FAKE_YTDLP_LINE_DELAY", "0")
+    app = load_app()
+
+    print(f"{args.jobs} jobs, startup {args.startup:.2f} s, first connection {args.connect:.2f} s,"
+          f" extraction {float(os.environ['FAKE_YTDLP_EXTRACT_DELAY']):.2f} s")
+    for backend in (app.BACKEND_EXECUTABLE, app.BACKEND_MODULE):
+        times, failed = one_at_a_time(app, backend, args.jobs)
+        elapsed = concurrent(app, backend, args.jobs, args.workers)
+        times.sort()
+        print(f"  {backend:<11} one at a time: median {statistics.median(times) * 1000:7.1f} ms"
+              f"  p90 {times[int(len(times) * 0.9) - 1] * 1000:7.1f} ms"
+              f"   {args.workers} at once: {args.jobs / elapsed:5.2f} jobs/s"
+              + (f"  ({failed} failed)" if failed else ""))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
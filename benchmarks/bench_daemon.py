@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Exercise the daemon's HTTP API with many jobs and event subscribers, using the fake yt-dlp.
+
+Starts youtube-downloader.py --daemon on a free port, connects the event
+stream subscribers, submits the jobs one request at a time, cancels one
+and waits until every subscriber has seen every job finish. Reports the
+request latency, the time until all subscribers were up to date and the
+number of threads the daemon used.
+
+Usage:
+    python benchmarks/bench_daemon.py [--jobs 300] [--subscribers 50] [--workers 8]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_YT_DLP = os.path.join(HERE, "fake_yt_dlp.py")
+APP = os.path.join(HERE, os.pardir, "youtube-downloader.py")
+
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+async def http_request(port, token, method, path, payload=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode() if payload is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost:{port}\r\n"
+                 f"Authorization: Bearer {token}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    response = await reader.read()
+    writer.close()
+    head, _, data = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(data)
+
+async def subscribe(port, total, ready, finished_at):
+    """Follow the event stream until all total jobs have finished"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET /events HTTP/1.1\r\nHost: localhost:{port}\r\n\r\n".encode())
+    await reader.readuntil(b"\r\n\r\n")
+    ready.set_result(None)
+    states = {}
+    events = 0
+    kind = None
+    while True:
+        line = (await reader.readline()).decode().rstrip("\n")
+        if not line and reader.at_eof():
+            break
+        if line.startswith("event:"):
+            kind = line[6:].strip()
+        elif line.startswith("data:") and kind == "job":
+            events += 1
+            data = json.loads(line[5:])
+            states[data["job"]] = data["state"]
+            if (len(states) == total
+                    and all(state in FINISHED_STATES for state in states.values())):
+                break
+    finished_at.append(time.perf_counter())
+    writer.close()
+    return events
+
+def daemon_threads(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+async def run(args, port, token, pid):
+    loop = asyncio.get_running_loop()
+    finished_at = []
+    readies = [loop.create_future() for _ in range(args.subscribers)]
+    subscribers = [asyncio.ensure_future(subscribe(port, args.jobs, ready, finished_at))
+                   for ready in readies]
+    await asyncio.gather(*readies)
+
+    max_threads = daemon_threads(pid) or 0
+
+    async def sample_threads():
+        nonlocal max_threads
+        while True:
+            await asyncio.sleep(0.2)
+            max_threads = max(max_threads, daemon_threads(pid) or 0)
+
+    sampler = asyncio.ensure_future(sample_threads())
+
+    start = time.perf_counter()
+    latencies = []
+    job_ids = []
+    for i in range(args.jobs):
+        sent = time.perf_counter()
+        status, result = await http_request(port, token, "POST", "/jobs", {
+            "url": f"https://www.youtube.com/watch?v=daemon{i:05d}"
+        })
+        latencies.append(time.perf_counter() - sent)
+        assert status == 201, result
+        job_ids.append(result["jobs"][0]["job"])
+    submitted = time.perf_counter() - start
+
+    # The last job is still waiting in the queue; cancel it through the API
+    status, cancelled = await http_request(port, token, "DELETE", f"/jobs/{job_ids[-1]}")
+    assert status == 200 and cancelled["state"] == "cancelled", cancelled
+    status, listing = await http_request(port, token, "GET", "/jobs")
+    assert status == 200 and len(listing["jobs"]) == args.jobs
+
+    events = await asyncio.gather(*subscribers)
+    elapsed = max(finished_at) - start
+    sampler.cancel()
+
+    status, listing = await http_request(port, token, "GET", "/jobs")
+    states = [job["state"] for job in listing["jobs"]]
+    latencies.sort()
+    print(f"{args.jobs} jobs, {args.subscribers} subscribers, {args.workers} workers")
+    print(f"  submit: {submitted:6.2f} s  median {latencies[len(latencies) // 2] * 1000:5.1f} ms"
+          f"  p99 {latencies[int(len(latencies) * 0.99)] * 1000:5.1f} ms per request")
+    print(f"  all subscribers up to date after {elapsed:6.2f} s"
+          f"  ({sum(events) / len(events):.0f} job events each)")
+    print(f"  done {states.count('done')}, cancelled {states.count('cancelled')},"
+          f" failed {states.count('failed')}")
+    print(f"  daemon threads: at most {max_threads}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=300)
+    parser.add_argument("--subscribers", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, YT_DLP_PATH=FAKE_YT_DLP, YTDL_CONFIG_DIR=tmp)
+        env.setdefault("FAKE_YTDLP_EXTRACT_DELAY", "0.05")
+        env.setdefault("FAKE_YTDLP_LINE_DELAY", "0.01")
+        daemon = subprocess.Popen(
+            [sys.executable, APP, "--daemon", "--port", "0", "--jobs", str(args.workers),
+             "--output", os.path.join(tmp, "downloads")],
+            stdout=subprocess.PIPE, env=env, text=True
+        )
+        try:
+            listening = json.loads(daemon.stdout.readline())
+            port = int(listening["url"].rsplit(":", 1)[1])
+            with open(os.path.join(tmp, "daemon-token")) as f:
+                token = f.read().strip()
+            asyncio.run(run(args, port, token, daemon.pid))
+        finally:
+            daemon.terminate()
+            daemon.wait()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
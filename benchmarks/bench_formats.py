@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Compare the planned formats of each preset with yt-dlp's default pick converted afterwards, using the fakes.
+
+Without a plan, yt-dlp downloads the best video and audio (bv,ba), and
+turning that into what a preset asks for means ffmpeg re-encodes whatever
+does not fit: a lower resolution, or codecs the container cannot hold. The
+planner picks formats that already fit. For every preset this reports the
+bytes downloaded for the fake yt-dlp's format list and the post-processing
+each way needs, then runs that post-processing with the fake ffmpeg in busy
+mode (FAKE_FFMPEG_DELAY for a copy, FAKE_FFMPEG_TRANSCODE_DELAY for a
+re-encode) and measures the CPU time it took.
+
+Usage:
+    python benchmarks/bench_formats.py [--copy 0.2] [--transcode 1.0]
+"""
+
+import argparse
+import importlib.util
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_FFMPEG = os.path.join(HERE, "fake_ffmpeg.py")
+sys.path.insert(0, HERE)
+
+import fake_yt_dlp
+
+def load_app():
+    path = os.path.join(HERE, os.pardir, "youtube-downloader.py")
+    spec = importlib.util.spec_from_file_location("youtube_downloader", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def default_pick(formats):
+    """What yt-dlp's bv,ba picks from the fake format list: av01 > vp9 > avc1, opus > mp4a"""
+    vrank = ("avc1", "vp9", "av01")
+    arank = ("mp4a", "opus")
+    videos = [fmt for fmt in formats if fmt["acodec"] == "none"]
+    audios = [fmt for fmt in formats if fmt["vcodec"] == "none"]
+    video = max(videos, key=lambda fmt: (fmt["height"], vrank.index(fmt["vcodec"].split(".")[0])))
+    audio = max(audios, key=lambda fmt: arank.index(fmt["acodec"].split(".")[0]))
+    return video, audio
+
+def naive_plan(app, formats, preset, duration):
+    """The default pick, and the ffmpeg work that makes it fit the preset"""
+    video, audio = default_pick(formats)
+    streams = [audio] if preset.audio_only else [video, audio]
+    plan = app.plan_streams(streams, preset.container, duration)
+    transcode = set(plan.transcode)
+    if not preset.audio_only and (
+            (preset.max_height and plan.height > preset.max_height)
+            or (preset.max_tbr and plan.tbr > preset.max_tbr)
+            or (preset.max_filesize and plan.size > preset.max_filesize)):
+        # Only a re-encode makes it smaller
+        transcode.add("v")
+    if transcode:
+        plan = plan._replace(postprocess="transcode",
+                             transcode=tuple(kind for kind in ("v", "a") if kind in transcode))
+    return plan
+
+def postprocess_cpu(app, plan, work_dir):
+    """CPU seconds the fake ffmpeg spends on a plan's post-processing"""
+    if plan.postprocess == "none":
+        return 0.0
+    inputs = []
+    for i, format_id in enumerate(plan.format_ids):
+        path = os.path.join(work_dir, f"stream{i}.{format_id}")
+        with open(path, "wb") as f:
+            f.write(b"\0" * 1024)
+        inputs.append(path)
+    output = app.merged_output_path(inputs, plan.container)
+    cmd = app.build_merge_command(FAKE_FFMPEG, inputs, output, plan.transcode)
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    subprocess.run([sys.executable] + cmd, stdout=subprocess.DEVNULL, check=True)
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--copy", type=float, default=0.2,
+                        help="seconds a merge that copies the streams takes (default 0.2)")
+    parser.add_argument("--transcode", type=float, default=1.0,
+                        help="seconds a merge that re-encodes takes (default 1.0)")
+    args = parser.parse_args()
+
+    os.environ["FAKE_FFMPEG_BUSY"] = "1"
+    os.environ["FAKE_FFMPEG_DELAY"] = str(args.copy)
+    os.environ["FAKE_FFMPEG_TRANSCODE_DELAY"] = str(args.transcode)
+    app = load_app()
+
+    duration = 42
+    formats = fake_yt_dlp.fake_formats(duration)
+    print(f"{duration} s video, copy {args.copy:.2f} s, re-encode {args.transcode:.2f} s")
+    totals = {"default pick": [0, 0.0], "planned": [0, 0.0]}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, preset in app.FORMAT_PRESETS.items():
+            print(f"  {name} ({preset.label})")
+            plans = (("default pick", naive_plan(app, formats, preset, duration)),
+                     ("planned", app.plan_formats(formats, preset, duration)))
+            for way, plan in plans:
+                cpu = postprocess_cpu(app, plan, work_dir)
+                totals[way][0] += plan.size
+                totals[way][1] += cpu
+                print(f"    {way:<13} {'+'.join(plan.format_ids):<8} {plan.size / 1048576:6.1f} MiB"
+                      f"  {plan.postprocess:<9}  cpu {cpu:5.2f} s")
+    print("  total")
+    for way, (size, cpu) in totals.items():
+        print(f"    {way:<13} {'':<8} {size / 1048576:6.1f} MiB  {'':<9}  cpu {cpu:5.2f} s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
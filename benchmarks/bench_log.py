@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Measure the output a long playlist leaves in memory, with and without the output limits, using the fake yt-dlp.
+
+Every entry of a playlist of --entries videos prints --chatter lines of
+extractor output besides its progress; --fail of them fail. The playlist
+runs twice: with the engine's limits (JOB_OUTPUT_LINES per running job,
+JOB_OUTPUT_TAIL per failed one, OUTPUT_LOG_LINES for the log window) and
+with every line kept, as a log of the output would without them. Every
+tenth of the playlist this prints the lines and bytes of output still
+held and the process's resident memory; with the limits both level off
+instead of growing with the number of downloads.
+
+Usage:
+    python benchmarks/bench_log.py [--entries 1000] [--chatter 20] [--fail 50] [--workers 8]
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_YT_DLP = os.path.join(HERE, "fake_yt_dlp.py")
+
+def load_app():
+    path = os.path.join(HERE, os.pardir, "youtube-downloader.py")
+    spec = importlib.util.spec_from_file_location("youtube_downloader", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def rss():
+    """Resident memory of this process in MiB"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576
+
+def held(engine):
+    """Lines and bytes of output the jobs and the log window hold; they share the strings"""
+    lines = {id(line): line for _, line in engine.output.lines()}
+    for job in engine.jobs():
+        lines.update((id(line), line) for line in job.output)
+    return len(lines), sum(len(line) for line in lines.values())
+
+def run(app, name, entries, workers):
+    print(f"  {name}")
+    engine = app.DownloadEngine(max_workers=workers)
+    engine.ffmpeg_path = None
+    if name == "unbounded":
+        engine.output = app.OutputLog(size=None)
+    with tempfile.TemporaryDirectory() as save_dir:
+        start = time.perf_counter()
+        group = engine.add_playlist("https://www.youtube.com/playlist?list=logbench", save_dir)
+        reported = 0
+        # finished is briefly true between the expansion and the jobs being queued
+        while not (group.jobs and group.finished):
+            time.sleep(0.05)
+            done = sum(job.finished for job in group.jobs)
+            if done >= reported + entries // 10 or (group.finished and done > reported):
+                reported = done
+                count, size = held(engine)
+                print(f"    {done:5d} done  {count:7d} lines  {size / 1024:8.0f} KiB held"
+                      f"  rss {rss():6.1f} MiB  {time.perf_counter() - start:6.1f} s")
+        failed = [job for job in group.jobs if job.state == app.JOB_FAILED]
+        if failed:
+            print(f"    {len(failed)} failed, e.g. {failed[0].message}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=1000, help="videos in the playlist (default 1000)")
+    parser.add_argument("--chatter", type=int, default=20,
+                        help="lines of output per download besides progress (default 20)")
+    parser.add_argument("--fail", type=int, default=50, help="downloads that fail (default 50)")
+    parser.add_argument("--workers", type=int, default=8, help="parallel downloads (default 8)")
+    args = parser.parse_args()
+
+    os.environ["YT_DLP_PATH"] = FAKE_YT_DLP
+    os.environ["FAKE_YTDLP_PLAYLIST_SIZE"] = str(args.entries)
+    os.environ["FAKE_YTDLP_CHATTER"] = str(args.chatter)
+    os.environ.setdefault("FAKE_YTDLP_EXTRACT_DELAY", "0")
+    os.environ.setdefault("FAKE_YTDLP_SIZE", "1024")
+    os.environ.setdefault("FAKE_YTDLP_PROGRESS_LINES", "5")
+    os.environ["YTDL_CONFIG_DIR"] = tempfile.mkdtemp()
+    # The fake's playlist entries are named after the first five characters of its id
+    step = max(1, args.entries // max(1, args.fail))
+    os.environ["FAKE_YTDLP_FAIL_IDS"] = ",".join(
+        f"logbe{i:06d}" for i in range(0, args.entries, step)[:args.fail])
+    app = load_app()
+
+    print(f"{args.entries} entries, {args.chatter} lines of output each, {args.fail} failing,"
+          f" {args.workers} workers")
+    for name in ("bounded", "unbounded"):
+        if name == "unbounded":
+            app.JOB_OUTPUT_LINES = None
+            app.DownloadJob.trim_output = lambda job: None
+        run(app, name, args.entries, args.workers)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the progress parser: lines per second for the JSON
+--progress-template path, the regex fallback for older yt-dlp builds, and
+the original uncompiled parse_progress for reference.
+
+Usage:
+    python benchmarks/bench_parser.py [--lines 200000]
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import re
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def load_app():
+    path = os.path.join(HERE, os.pardir, "youtube-downloader.py")
+    spec = importlib.util.spec_from_file_location("youtube_downloader", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def original_parse_progress(line):
+    """parse_progress as it was before the structured progress protocol"""
+    match = re.search(r'(\d+\.?\d*)%', line)
+    if match:
+        try:
+            return float(match.group(1))
+        except:
+            return None
+    if '[download]' in line.lower():
+        match = re.search(r'(\d+\.?\d*)%', line)
+        if match:
+            try:
+                return float(match.group(1))
+            except:
+                return None
+    return None
+
+def json_lines(app, count):
+    size = 50 * 1024 * 1024
+    lines = []
+    for i in range(count):
+        progress = {
+            "status": "downloading",
+            "downloaded_bytes": size * i // count,
+            "total_bytes": size,
+            "total_bytes_estimate": None,
+            "speed": 5242880.0,
+            "eta": count - i,
+            "fragment_index": i // 10,
+            "fragment_count": count // 10,
+        }
+        lines.append(app.PROGRESS_PREFIX + json.dumps(progress))
+    return lines
+
+def legacy_lines(count):
+    return [f"[download] {100.0 * i / count:5.1f}% of ~  50.00MiB at    5.00MiB/s "
+            f"ETA 00:{i % 60:02d} (frag {i // 10}/{count // 10})" for i in range(count)]
+
+def rate(parse, lines):
+    start = time.perf_counter()
+    for line in lines:
+        parse(line)
+    return len(lines) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=200000)
+    args = parser.parse_args()
+
+    app = load_app()
+    json_sample = json_lines(app, args.lines)
+    legacy_sample = legacy_lines(args.lines)
+
+    results = [
+        ("JSON template (full record)", rate(app.parse_progress_line, json_sample)),
+        ("regex fallback (full record)", rate(app.parse_progress_line, legacy_sample)),
+        ("original parse_progress (percent only)", rate(original_parse_progress, legacy_sample)),
+    ]
+    print(f"{args.lines} lines per path")
+    for name, lines_per_sec in results:
+        print(f"  {name:<40} {lines_per_sec:12,.0f} lines/s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Compare merging in the download slot with the separate post-processing stage, using the fake yt-dlp and ffmpeg.
+
+In the old model yt-dlp merges the streams itself, so a download slot is
+held until the merge has finished (FAKE_YTDLP_MERGE_DELAY). In the new one
+the streams are downloaded separately and merged by the fake ffmpeg in the
+post-processing stage (FAKE_FFMPEG_DELAY), while the slot already runs the
+next download. Reports wall time and the engine's stage stats.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--jobs 20] [--workers 2] [--merge 1.0]
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_YT_DLP = os.path.join(HERE, "fake_yt_dlp.py")
+FAKE_FFMPEG = os.path.join(HERE, "fake_ffmpeg.py")
+
+def load_app():
+    path = os.path.join(HERE, os.pardir, "youtube-downloader.py")
+    spec = importlib.util.spec_from_file_location("youtube_downloader", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run(app, count, workers, postprocess_workers, separate):
+    done = threading.Event()
+    remaining = [count]
+    lock = threading.Lock()
+
+    def on_update(job):
+        if job.finished:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    done.set()
+
+    engine = app.DownloadEngine(max_workers=workers, on_update=on_update,
+                                postprocess_workers=postprocess_workers)
+    engine.ffmpeg_path = FAKE_FFMPEG if separate else None
+    with tempfile.TemporaryDirectory() as save_dir:
+        start = time.perf_counter()
+        for i in range(count):
+            engine.add(f"https://www.youtube.com/watch?v=pipe{i:07d}", save_dir)
+        done.wait()
+        elapsed = time.perf_counter() - start
+    failed = sum(1 for job in engine.jobs() if job.state != app.JOB_DONE)
+    return elapsed, failed, engine.stage_stats()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=2, help="parallel downloads")
+    parser.add_argument("--merge-workers", type=int, default=None,
+                        help="parallel merges (default: one per core)")
+    parser.add_argument("--merge", type=float, default=1.0, help="seconds each merge takes")
+    args = parser.parse_args()
+
+    os.environ["YT_DLP_PATH"] = FAKE_YT_DLP
+    os.environ.setdefault("FAKE_YTDLP_EXTRACT_DELAY", "0.2")
+    os.environ.setdefault("FAKE_YTDLP_LINE_DELAY", "0.05")
+    os.environ["FAKE_YTDLP_MERGE_DELAY"] = str(args.merge)
+    os.environ["FAKE_FFMPEG_DELAY"] = str(args.merge)
+    app = load_app()
+    merge_workers = args.merge_workers or app.POSTPROCESS_WORKERS
+
+    print(f"{args.jobs} jobs, {args.workers} download slots, {merge_workers} merge slots,"
+          f" {args.merge:.1f} s per merge")
+    for name, separate in (("merge in download slot", False), ("separate merge stage", True)):
+        elapsed, failed, stats = run(app, args.jobs, args.workers, merge_workers, separate)
+        print(f"  {name:<24} {elapsed:6.2f} s  {args.jobs / elapsed:5.2f} jobs/s"
+              + (f"  ({failed} failed)" if failed else ""))
+        for stage in ("download", "postprocess"):
+            totals = stats[stage]
+            if totals["completed"]:
+                print(f"    {stage:<12} {totals['completed']:>4} jobs"
+                      f"  avg queued {totals['wait_time'] / totals['completed']:6.2f} s"
+                      f"  avg busy {totals['busy_time'] / totals['completed']:6.2f} s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Time from clicking Download to the first progress update, with and without a prefetch, using the fake yt-dlp.
+
+Without a prefetch the download starts by extracting the video page
+(FAKE_YTDLP_EXTRACT_DELAY). With one, the page was extracted while the
+user was still looking at the pasted URL (--think seconds), and the
+download loads the saved info instead.
+
+Usage:
+    python benchmarks/bench_prefetch.py [--runs 10] [--extract 1.5] [--think 2.0]
+"""
+
+import argparse
+import importlib.util
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_YT_DLP = os.path.join(HERE, "fake_yt_dlp.py")
+
+def load_app():
+    path = os.path.join(HERE, os.pardir, "youtube-downloader.py")
+    spec = importlib.util.spec_from_file_location("youtube_downloader", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def time_to_progress(app, engine, url, save_dir):
+    """Seconds from adding url until its download reports progress"""
+    start = time.perf_counter()
+    job = engine.add(url, save_dir)
+    while job.progress == 0 and not job.finished:
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - start
+    while not job.finished:
+        time.sleep(0.01)
+    return elapsed if job.state == app.JOB_DONE else None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--extract", type=float, default=1.5,
+                        help="seconds extracting the video page takes (default 1.5)")
+    parser.add_argument("--think", type=float, default=2.0,
+                        help="seconds between pasting the URL and clicking Download (default 2.0)")
+    args = parser.parse_args()
+
+    os.environ["YT_DLP_PATH"] = FAKE_YT_DLP
+    os.environ["FAKE_YTDLP_EXTRACT_DELAY"] = str(args.extract)
+    os.environ.setdefault("FAKE_YTDLP_LINE_DELAY", "0.01")
+    app = load_app()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        engine = app.DownloadEngine(max_workers=1, prefetch_dir=os.path.join(work_dir, "prefetch"))
+        engine.ffmpeg_path = None
+        results = {"no prefetch": [], "prefetch": []}
+        for i in range(args.runs):
+            url = f"https://www.youtube.com/watch?v=cold{i:07d}"
+            results["no prefetch"].append(time_to_progress(app, engine, url, work_dir))
+
+            url = f"https://www.youtube.com/watch?v=warm{i:07d}"
+            looked_up = threading.Event()
+            engine.prefetch(url, lambda metadata: looked_up.set())
+            time.sleep(args.think)
+            prefetched = looked_up.is_set()
+            results["prefetch"].append(time_to_progress(app, engine, url, work_dir)
+                                       if prefetched else None)
+
+    print(f"{args.runs} runs, extraction {args.extract:.2f} s, {args.think:.2f} s before the click")
+    for name, times in results.items():
+        failed = times.count(None)
+        times = [t for t in times if t is not None]
+        print(f"  {name:<12} click to first progress: median {statistics.median(times) * 1000:7.1f} ms"
+              + (f"  ({failed} failed)" if failed else ""))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
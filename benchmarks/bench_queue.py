@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Measure how batch throughput scales with the number of parallel downloads,
+using the fake yt-dlp.
+
+Usage:
+    python benchmarks/bench_queue.py [--jobs 50] [--workers 1 2 4 8]
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_YT_DLP = os.path.join(HERE, "fake_yt_dlp.py")
+
+def load_app():
+    path = os.path.join(HERE, os.pardir, "youtube-downloader.py")
+    spec = importlib.util.spec_from_file_location("youtube_downloader", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def video_urls(count):
+    return [f"https://www.youtube.com/watch?v=bench{i:06d}" for i in range(count)]
+
+def run_batch(app, urls, workers):
+    done = threading.Event()
+    remaining = [len(urls)]
+    lock = threading.Lock()
+
+    def on_update(job):
+        if job.finished:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    done.set()
+
+    engine = app.DownloadEngine(max_workers=workers, on_update=on_update)
+    with tempfile.TemporaryDirectory() as save_dir:
+        start = time.perf_counter()
+        for url in urls:
+            engine.add(url, save_dir)
+        done.wait()
+        elapsed = time.perf_counter() - start
+    failed = [job for job in engine.jobs() if job.state != app.JOB_DONE]
+    return elapsed, len(failed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    os.environ["YT_DLP_PATH"] = FAKE_YT_DLP
+    os.environ.setdefault("FAKE_YTDLP_EXTRACT_DELAY", "0.2")
+    os.environ.setdefault("FAKE_YTDLP_LINE_DELAY", "0.01")
+    app = load_app()
+    urls = video_urls(args.jobs)
+
+    print(f"{args.jobs} jobs against the fake yt-dlp")
+    baseline = None
+    for workers in args.workers:
+        elapsed, failed = run_batch(app, urls, workers)
+        baseline = baseline or elapsed
+        print(f"  {workers:>2} workers: {elapsed:6.2f} s  "
+              f"{args.jobs / elapsed:6.1f} jobs/s  speedup x{baseline / elapsed:4.1f}"
+              + (f"  ({failed} failed)" if failed else ""))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Compare the old two-process download flow (a --get-title probe followed by
+the download) with the single yt-dlp invocation, using the fake yt-dlp.
+
+Usage:
+    python benchmarks/bench_single_invocation.py [--runs N]
+"""
+
+import argparse
+import importlib.util
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_YT_DLP = os.path.join(HERE, "fake_yt_dlp.py")
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+def load_app():
+    path = os.path.join(HERE, os.pardir, "youtube-downloader.py")
+    spec = importlib.util.spec_from_file_location("youtube_downloader", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def drain(cmd):
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               universal_newlines=True, bufsize=1)
+    lines = [line.strip() for line in iter(process.stdout.readline, '')]
+    process.wait()
+    return lines
+
+def two_process_flow(save_dir):
+    """The flow used before: title probe, download, then guess the file"""
+    subprocess.run([FAKE_YT_DLP, URL, "--get-title", "--no-warnings"],
+                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=10)
+    drain([FAKE_YT_DLP, URL, "-o", os.path.join(save_dir, "%(title)s.%(ext)s"),
+           "--newline", "--progress"])
+    files = [os.path.join(save_dir, f) for f in os.listdir(save_dir)
+             if os.path.isfile(os.path.join(save_dir, f))]
+    return max(files, key=os.path.getmtime)
+
+def single_process_flow(app, save_dir):
+    filepath = None
+    for line in drain(app.build_download_command(FAKE_YT_DLP, URL, save_dir)):
+        printed = app.parse_print_line(line)
+        if printed and printed[0] == "filepath":
+            filepath = printed[1]
+    return filepath
+
+def measure(runs, flow):
+    timings = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as save_dir:
+            start = time.perf_counter()
+            flow(save_dir)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    app = load_app()
+    os.environ.setdefault("FAKE_YTDLP_EXTRACT_DELAY", "0.3")
+
+    results = {
+        "two processes": measure(args.runs, two_process_flow),
+        "single process": measure(args.runs, lambda d: single_process_flow(app, d)),
+    }
+    print(f"{args.runs} runs, fake extraction delay "
+          f"{os.environ['FAKE_YTDLP_EXTRACT_DELAY']}s")
+    for name, timings in results.items():
+        print(f"  {name:<15} median {statistics.median(timings) * 1000:7.1f} ms"
+              f"  mean {statistics.mean(timings) * 1000:7.1f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Compare the asyncio process supervisor with one reader thread per download, using the fake yt-dlp.
+
+Both models start the same number of fake downloads at once and parse
+every output line with parse_progress_line. The thread model is the
+downloader's previous one: a thread per process looping over
+iter(stdout.readline, '') on a line-buffered text pipe. Reports wall time,
+CPU time spent in this process and the most threads alive at once.
+
+Usage:
+    python benchmarks/bench_supervisor.py [--concurrency 1 10 50] [--lines 2000]
+"""
+
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_YT_DLP = os.path.join(HERE, "fake_yt_dlp.py")
+
+def load_app():
+    path = os.path.join(HERE, os.pardir, "youtube-downloader.py")
+    spec = importlib.util.spec_from_file_location("youtube_downloader", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def commands(app, count, save_dir):
+    return [app.build_download_command(FAKE_YT_DLP, f"https://www.youtube.com/watch?v=super{i:06d}",
+                                       save_dir)
+            for i in range(count)]
+
+def cpu_time():
+    times = os.times()
+    return times.user + times.system
+
+class ThreadSampler:
+    """Records the most threads alive at once while running"""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(0.01):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+def run_threads(app, cmds):
+    lines = [0]
+    lock = threading.Lock()
+
+    def reader(cmd):
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   universal_newlines=True, bufsize=1)
+        count = 0
+        for line in iter(process.stdout.readline, ''):
+            app.parse_progress_line(line.strip())
+            count += 1
+        process.wait()
+        with lock:
+            lines[0] += count
+
+    threads = [threading.Thread(target=reader, args=(cmd,)) for cmd in cmds]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return lines[0]
+
+def run_supervisor(app, cmds):
+    supervisor = app.ProcessSupervisor()
+    remaining = [len(cmds)]
+    lines = [0]
+    done = threading.Event()
+
+    def on_line(line):
+        app.parse_progress_line(line.strip())
+        lines[0] += 1
+
+    def on_exit(returncode, error):
+        # Callbacks all run on the supervisor's thread; no lock needed
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            done.set()
+
+    for cmd in cmds:
+        supervisor.start(cmd, on_line, on_exit)
+    done.wait()
+    return lines[0]
+
+def measure(run, app, cmds):
+    with ThreadSampler() as sampler:
+        start, cpu_start = time.perf_counter(), cpu_time()
+        lines = run(app, cmds)
+        elapsed, cpu = time.perf_counter() - start, cpu_time() - cpu_start
+    return elapsed, cpu, sampler.peak, lines
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--lines", type=int, default=2000,
+                        help="progress lines printed by each fake download")
+    args = parser.parse_args()
+
+    os.environ["FAKE_YTDLP_PROGRESS_LINES"] = str(args.lines)
+    os.environ.setdefault("FAKE_YTDLP_EXTRACT_DELAY", "0.05")
+    os.environ.setdefault("FAKE_YTDLP_LINE_DELAY", "0")
+    app = load_app()
+
+    print(f"Each fake download prints {args.lines} progress lines")
+    print(f"{'jobs':>5}  {'model':<11} {'wall':>8} {'cpu':>8} {'threads':>8} {'lines/s':>10}")
+    with tempfile.TemporaryDirectory() as save_dir:
+        for count in args.concurrency:
+            cmds = commands(app, count, save_dir)
+            for name, run in (("threads", run_threads), ("supervisor", run_supervisor)):
+                elapsed, cpu, threads, lines = measure(run, app, cmds)
+                print(f"{count:>5}  {name:<11} {elapsed:7.2f}s {cpu:7.2f}s {threads:>8}"
+                      f" {lines / elapsed:>10.0f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Time a throttled download with and without restarting it on a new connection, using the fake yt-dlp.
+
+The fake yt-dlp's "server" throttles every connection to --throttled bytes
+per second (per -N fragment) once it has been open for --after seconds
+(FAKE_YTDLP_THROTTLE_AFTER). Without throttle detection the download
+crawls at that speed to the end; with it, the engine restarts the download
+when its throughput falls below THROTTLE_RATIO of its baseline, and yt-dlp
+continues from the .part file at full speed until it is throttled again.
+The throttle windows and backoff are scaled down (--scale) so a run takes
+seconds. Prints the time per download and the logged restarts.
+
+Usage:
+    python benchmarks/bench_throttle.py [--size 20] [--after 1.0] [--throttled 256] [--fragments 4]
+"""
+
+import argparse
+import importlib.util
+import logging
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_YT_DLP = os.path.join(HERE, "fake_yt_dlp.py")
+
+def load_app():
+    path = os.path.join(HERE, os.pardir, "youtube-downloader.py")
+    spec = importlib.util.spec_from_file_location("youtube_downloader", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run(app, run_id, ratio, fragments):
+    engine = app.DownloadEngine(max_workers=1, throttle_ratio=ratio, throttle_fragments=fragments)
+    engine.ffmpeg_path = None
+    with tempfile.TemporaryDirectory() as save_dir:
+        start = time.perf_counter()
+        job = engine.add(f"https://www.youtube.com/watch?v=throttle{run_id:03d}", save_dir)
+        while not job.finished:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+    return elapsed, job
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=float, default=20, help="MiB to download (default 20)")
+    parser.add_argument("--after", type=float, default=1.0,
+                        help="seconds before a connection is throttled (default 1.0)")
+    parser.add_argument("--throttled", type=float, default=256,
+                        help="KiB/s of a throttled connection (default 256)")
+    parser.add_argument("--fragments", type=int, default=4,
+                        help="-N for the runs that raise fragment concurrency (default 4)")
+    parser.add_argument("--scale", type=float, default=0.1,
+                        help="factor for the throttle windows and backoff (default 0.1)")
+    args = parser.parse_args()
+
+    os.environ["YT_DLP_PATH"] = FAKE_YT_DLP
+    os.environ["FAKE_YTDLP_SIZE"] = str(int(args.size * 1024 * 1024))
+    os.environ.setdefault("FAKE_YTDLP_PROGRESS_LINES", str(int(args.size * 20)))
+    os.environ.setdefault("FAKE_YTDLP_LINE_DELAY", "0.01")
+    os.environ.setdefault("FAKE_YTDLP_EXTRACT_DELAY", "0.2")
+    os.environ["FAKE_YTDLP_THROTTLE_AFTER"] = str(args.after)
+    os.environ["FAKE_YTDLP_THROTTLE_SPEED"] = str(int(args.throttled * 1024))
+    app = load_app()
+    app.THROTTLE_WINDOW *= args.scale
+    app.THROTTLE_BACKOFF *= args.scale
+    logging.basicConfig(level=logging.INFO, format="      %(message)s")
+
+    print(f"{args.size:.0f} MiB, throttled to {args.throttled:.0f} KiB/s after {args.after:.1f} s,"
+          f" window {app.THROTTLE_WINDOW:.1f} s, backoff {app.THROTTLE_BACKOFF:.1f} s")
+    runs = (("no detection", 0, None),
+            ("restart", app.THROTTLE_RATIO, None),
+            (f"restart -N {args.fragments}", app.THROTTLE_RATIO, args.fragments))
+    for run_id, (name, ratio, fragments) in enumerate(runs):
+        print(f"  {name}")
+        elapsed, job = run(app, run_id, ratio, fragments)
+        print(f"    {elapsed:6.2f} s  {args.size / elapsed:5.2f} MiB/s  {job.state}"
+              f"  {len(job.throttle_restarts)} restart(s)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Fake ffmpeg
+===========
+
+A stand-in for ffmpeg used by the benchmarks. It accepts the merge command
+the downloader builds (build_merge_command), prints -progress output for a
+42 second video, as the fake yt-dlp reports, with the keys real ffmpeg
+prints, and writes the inputs one after the other to the output file.
+
+Behaviour is tuned with environment variables:
+    FAKE_FFMPEG_DELAY          seconds the merge takes (default 0.5)
+    FAKE_FFMPEG_TRANSCODE_DELAY  seconds it takes when -c:v or -c:a re-encodes a stream
+                               (default 4 times FAKE_FFMPEG_DELAY)
+    FAKE_FFMPEG_BUSY           set to 1 to spend the delay computing instead of sleeping
+    FAKE_FFMPEG_FAIL           set to 1 to fail the merge once its progress is printed
+"""
+
+import os
+import sys
+import time
+
+# Duration of the fake yt-dlp's videos
+DURATION = 42
+STEPS = 10
+
+def env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def wait(seconds, busy):
+    if not busy:
+        time.sleep(seconds)
+        return
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(i * i for i in range(1000))
+
+def emit(line):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+def emit_progress(step):
+    """One block of -progress output, with the keys ffmpeg prints for a stream copy"""
+    out_time_us = DURATION * 1000000 * step // STEPS
+    seconds, micros = divmod(out_time_us, 1000000)
+    emit(f"frame={step * 100}")
+    emit("fps=0.00")
+    emit("stream_0_0_q=-1.0")
+    emit("bitrate=N/A")
+    emit(f"total_size={step * 4096}")
+    emit(f"out_time_us={out_time_us}")
+    emit(f"out_time_ms={out_time_us}")
+    emit(f"out_time=00:00:{seconds:02d}.{micros:06d}")
+    emit("dup_frames=0")
+    emit("drop_frames=0")
+    emit("speed=N/A")
+    emit("progress=" + ("end" if step == STEPS else "continue"))
+
+def main():
+    args = sys.argv[1:]
+    inputs = [args[i + 1] for i, arg in enumerate(args[:-1]) if arg == "-i"]
+    output = args[-1]
+    progress = "-progress" in args
+    for path in inputs:
+        if not os.path.exists(path):
+            emit(f"{path}: No such file or directory")
+            return 1
+    delay = env_float("FAKE_FFMPEG_DELAY", 0.5)
+    transcode = any(arg in ("-c:v", "-c:a") and args[i + 1] != "copy"
+                    for i, arg in enumerate(args[:-1]))
+    if transcode:
+        delay = env_float("FAKE_FFMPEG_TRANSCODE_DELAY", delay * 4)
+    busy = os.environ.get("FAKE_FFMPEG_BUSY") == "1"
+    for step in range(1, STEPS + 1):
+        wait(delay / STEPS, busy)
+        if progress:
+            emit_progress(step)
+    if os.environ.get("FAKE_FFMPEG_FAIL") == "1":
+        emit("Error while muxing: Invalid argument")
+        return 1
+
+    with open(output, "wb") as out:
+        for path in inputs:
+            with open(path, "rb") as f:
+                out.write(f.read())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
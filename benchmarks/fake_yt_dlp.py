@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Fake yt-dlp
+===========
+
+A stand-in for the yt-dlp executable used by the benchmarks. It accepts the
+subset of yt-dlp options the downloader passes, pretends to extract the video
+page, prints yt-dlp style progress lines and writes a dummy output file.
+
+Behaviour is tuned with environment variables:
+    FAKE_YTDLP_STARTUP_DELAY   seconds spent starting up, as loading yt-dlp takes (default 0)
+    FAKE_YTDLP_CONNECT_DELAY   seconds spent opening the first connection (default 0)
+    FAKE_YTDLP_EXTRACT_DELAY   seconds spent "extracting" the page (default 0.3)
+    FAKE_YTDLP_SIZE            size of the dummy file in bytes (default 1 MiB)
+    FAKE_YTDLP_PROGRESS_LINES  number of progress lines to print (default 20)
+    FAKE_YTDLP_LINE_DELAY      seconds between progress lines (default 0)
+    FAKE_YTDLP_PLAYLIST_SIZE   number of entries in a playlist (default 10)
+    FAKE_YTDLP_FAIL_IDS        comma separated video IDs whose download fails
+    FAKE_YTDLP_FAIL_AT         percentage at which every download fails with an HTTP error
+    FAKE_YTDLP_FRAGMENTS       report progress as this many fragments (default 0)
+    FAKE_YTDLP_LEGACY          set to 1 to reject --progress-template like old builds
+    FAKE_YTDLP_CALL_LOG        append each invocation's arguments to this file
+    FAKE_YTDLP_THROTTLE_AFTER  seconds after which the "server" throttles the connection
+    FAKE_YTDLP_THROTTLE_SPEED  bytes per second of a throttled connection, per -N fragment
+                               (default 64 KiB)
+    FAKE_YTDLP_MERGE_DELAY     seconds a child "ffmpeg" process runs after the download (default 0)
+    FAKE_YTDLP_CHATTER         lines of extractor chatter to print before downloading (default 0)
+    FAKE_YTDLP_REPLAY          replay this file of recorded yt-dlp output instead; a line may
+                               start with "<seconds>\t" to wait that long before printing it
+
+With --load-info-json, the video comes from the info file -J printed and
+no time is spent extracting. With -f "bv,ba/b" the video and audio streams are downloaded as two files
+and not merged, like yt-dlp does for a format list separated by commas.
+Format ids from the -J format list, such as -f "135,140" or -f "18", get
+files as large as those formats are.
+
+The fake yt_dlp package in fake_yt_dlp_package runs the same downloads
+through yt-dlp's Python API (see download).
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+def env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def playlist_id_from_url(url):
+    match = re.search(r'list=([a-zA-Z0-9_-]+)', url)
+    return match.group(1) if match else None
+
+def video_id_from_url(url):
+    match = re.search(r'(?:v=|youtu\.be/)([a-zA-Z0-9_-]{11})', url)
+    return match.group(1) if match else "fakevideo01"
+
+def render_template(template, info):
+    """Render the small subset of yt-dlp's output template syntax we use"""
+    def replace(match):
+        field, conversion = match.group(1), match.group(2)
+        base, _, keys = field.partition(".{")
+        if keys:
+            source = info.get(base, {}) if base else info
+            value = {key: source.get(key) for key in keys.rstrip("}").split(",")}
+        else:
+            value = info.get(field)
+        if conversion == "j":
+            return json.dumps(value)
+        return "NA" if value is None else str(value)
+    return re.sub(r'%\(([^)]+)\)([sdj])', replace, template)
+
+def format_size(size):
+    return f"{size / (1024 * 1024):.2f}MiB"
+
+def download_stream(size, lines, line_delay, fragments, templates, part_path, rate_limit=None,
+                    fail_at=None, hooks=None, throttle=None):
+    """Print progress for one stream the way yt-dlp does, writing it to part_path.
+
+    Like yt-dlp, an existing part file is continued rather than started over,
+    and with rate_limit (bytes per second) the download is slowed down to it.
+    With fail_at, the download stops with an error at that percentage;
+    returns False if it did. With hooks, progress goes to them instead.
+    throttle is (time.monotonic() when the connection gets throttled,
+    bytes per second it is throttled to), if it does.
+    """
+    speed = min(5 * 1024 * 1024, rate_limit) if rate_limit else 5 * 1024 * 1024
+    written = 0
+    if os.path.exists(part_path):
+        written = min(os.path.getsize(part_path), size)
+        emit(f"[download] Resuming download at byte {written}")
+    part = open(part_path, "ab")
+    for i in range(1, lines + 1):
+        downloaded = size * i // lines
+        if downloaded <= written and i < lines:
+            continue
+        if fail_at is not None and 100.0 * i / lines >= fail_at:
+            part.close()
+            emit("ERROR: unable to download video data: HTTP Error 403: Forbidden")
+            return False
+        part.write(b"\0" * (downloaded - written))
+        part.flush()
+        delay = line_delay
+        if rate_limit:
+            delay = max(delay, (downloaded - written) / rate_limit)
+        if throttle and time.monotonic() >= throttle[0]:
+            delay = max(delay, (downloaded - written) / throttle[1])
+            speed = min(speed, throttle[1])
+        written = downloaded
+        progress = {
+            "status": "downloading",
+            "downloaded_bytes": downloaded,
+            "total_bytes": size,
+            "speed": speed,
+            "eta": (lines - i) * delay,
+        }
+        frag = ""
+        if fragments:
+            progress["fragment_index"] = max(1, fragments * i // lines)
+            progress["fragment_count"] = fragments
+            frag = f" (frag {progress['fragment_index']}/{fragments})"
+        if hooks:
+            for hook in hooks:
+                hook(progress)
+        elif templates:
+            for template in templates:
+                emit(render_template(template, {"progress": progress}))
+        else:
+            emit(f"[download] {100.0 * i / lines:5.1f}% of {format_size(size):>10} "
+                 f"at {format_size(speed):>10}/s ETA 00:00{frag}")
+        if delay:
+            time.sleep(delay)
+    finished = {"status": "finished", "downloaded_bytes": size, "total_bytes": size}
+    if hooks:
+        for hook in hooks:
+            hook(finished)
+    elif templates:
+        for template in templates:
+            emit(render_template(template, {"progress": finished}))
+    else:
+        emit(f"[download] 100% of {format_size(size):>10} in 00:00:01 at  5.00MiB/s")
+    part.close()
+    return True
+
+def replay_output(path, filepath, size, line_delay):
+    """Print recorded yt-dlp output and write a dummy file; fails if it contains an error"""
+    failed = False
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            delay, tab, text = line.partition("\t")
+            try:
+                delay = float(delay) if tab else line_delay
+            except ValueError:
+                delay, text = line_delay, line
+            if not tab:
+                text = line
+            if delay:
+                time.sleep(delay)
+            emit(text)
+            failed = failed or text.startswith("ERROR:")
+    if not failed:
+        os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+        with open(filepath, "wb") as f:
+            f.write(b"\0" * size)
+    return 1 if failed else 0
+
+def fake_formats(duration):
+    """A YouTube-like format list: video-only, audio-only and one muxed format"""
+    formats = []
+    audio = [("140", "m4a", "mp4a.40.2", 129), ("251", "webm", "opus", 135)]
+    for format_id, ext, acodec, abr in audio:
+        formats.append({
+            "format_id": format_id, "ext": ext, "vcodec": "none", "acodec": acodec,
+            "abr": abr, "tbr": abr, "filesize": int(abr * 1000 / 8 * duration),
+            "protocol": "https",
+        })
+    video = [
+        ("160", "mp4", "avc1.4d400c", 144, 80), ("133", "mp4", "avc1.4d4015", 240, 150),
+        ("134", "mp4", "avc1.4d401e", 360, 300), ("135", "mp4", "avc1.4d401f", 480, 600),
+        ("136", "mp4", "avc1.4d401f", 720, 1200), ("137", "mp4", "avc1.640028", 1080, 2500),
+        ("243", "webm", "vp9", 360, 250), ("244", "webm", "vp9", 480, 500),
+        ("247", "webm", "vp9", 720, 1000), ("248", "webm", "vp9", 1080, 2000),
+        ("399", "mp4", "av01.0.08M.08", 1080, 1800),
+    ]
+    for format_id, ext, vcodec, height, vbr in video:
+        formats.append({
+            "format_id": format_id, "ext": ext, "vcodec": vcodec, "acodec": "none",
+            "height": height, "width": height * 16 // 9, "fps": 30, "vbr": vbr, "tbr": vbr,
+            "filesize": int(vbr * 1000 / 8 * duration), "protocol": "https",
+        })
+    formats.append({
+        "format_id": "18", "ext": "mp4", "vcodec": "avc1.42001E", "acodec": "mp4a.40.2",
+        "height": 360, "width": 640, "fps": 30, "tbr": 500,
+        "filesize_approx": int(500 * 1000 / 8 * duration), "protocol": "https",
+    })
+    return formats
+
+def requested_streams(spec, duration):
+    """The (format_id, ext, share) of each file -f spec downloads.
+
+    A spec naming format ids ("137,140" or "135+140") gets files sized by
+    those formats, relative to 137+140 taking FAKE_YTDLP_SIZE; any other
+    spec gets 137 and 140, separately if it lists formats with commas.
+    """
+    by_id = {fmt["format_id"]: fmt for fmt in fake_formats(duration)}
+    size_of = lambda fmt: fmt.get("filesize") or fmt.get("filesize_approx")
+    full = size_of(by_id["137"]) + size_of(by_id["140"])
+    if spec and re.fullmatch(r"\d+([,+]\d+)*", spec):
+        if "," in spec:
+            return [(i, by_id[i]["ext"], size_of(by_id[i]) / full) for i in spec.split(",")]
+        ids = spec.split("+")
+        ext = by_id[ids[0]]["ext"]
+        if len(ids) > 1 and by_id[ids[1]]["ext"] != ("m4a" if ext == "mp4" else ext):
+            ext = "mkv"
+        return [(spec, ext, sum(size_of(by_id[i]) for i in ids) / full)]
+    if spec and "," in spec:
+        # One download per format, each with its own file and no merge
+        return [("137", "mp4", 0.8), ("140", "m4a", 0.2)]
+    return [("137+140", "mp4", 1.0)]
+
+def emit(line):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+def build_parser():
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("url", nargs="?")
+    parser.add_argument("--load-info-json", dest="load_info_filename")
+    parser.add_argument("-o", dest="output", default="%(title)s.%(ext)s")
+    parser.add_argument("-P", "--paths", dest="paths", action="append", default=[])
+    parser.add_argument("--get-title", action="store_true")
+    parser.add_argument("--print", dest="prints", action="append", default=[])
+    parser.add_argument("--flat-playlist", action="store_true")
+    parser.add_argument("-J", "--dump-single-json", dest="dump_json", action="store_true")
+    parser.add_argument("--progress-template", dest="progress_templates", action="append",
+                        default=[])
+    parser.add_argument("--download-archive", dest="download_archive")
+    parser.add_argument("--limit-rate", dest="limit_rate", type=int)
+    parser.add_argument("-f", dest="format")
+    parser.add_argument("-N", dest="concurrent_fragments", type=int, default=1)
+    return parser
+
+def main():
+    args, _ = build_parser().parse_known_args()
+
+    call_log = os.environ.get("FAKE_YTDLP_CALL_LOG")
+    if call_log:
+        with open(call_log, "a") as f:
+            f.write(json.dumps(sys.argv[1:]) + "\n")
+
+    if args.progress_templates and os.environ.get("FAKE_YTDLP_LEGACY") == "1":
+        emit("Usage: yt-dlp [OPTIONS] URL [URL...]")
+        emit("")
+        emit("yt-dlp: error: no such option: --progress-template")
+        return 2
+
+    time.sleep(env_float("FAKE_YTDLP_STARTUP_DELAY", 0))
+    time.sleep(env_float("FAKE_YTDLP_CONNECT_DELAY", 0))
+    return download(args)
+
+def download(args, progress_hooks=None, postprocessor_hooks=None):
+    """Run one invocation with the parsed arguments; returns the exit code.
+
+    With progress_hooks or postprocessor_hooks, progress is passed to them,
+    as yt-dlp's Python API does, instead of being printed.
+    """
+    if args.load_info_filename:
+        with open(args.load_info_filename, encoding="utf-8") as f:
+            args.url = json.load(f)["webpage_url"]
+    else:
+        time.sleep(env_float("FAKE_YTDLP_EXTRACT_DELAY", 0.3))
+
+    playlist_id = playlist_id_from_url(args.url)
+    if playlist_id and "watch?v=" not in args.url:
+        count = int(env_float("FAKE_YTDLP_PLAYLIST_SIZE", 10))
+        entries = []
+        for i in range(count):
+            entry_id = f"{playlist_id[:5]}{i:06d}"[-11:].rjust(11, "x")
+            entries.append({
+                "_type": "url",
+                "id": entry_id,
+                "url": f"https://www.youtube.com/watch?v={entry_id}",
+                "title": f"Fake Video {entry_id}",
+                "duration": 42,
+            })
+        emit(json.dumps({"_type": "playlist", "id": playlist_id,
+                         "title": f"Fake Playlist {playlist_id}", "entries": entries}))
+        return 0
+
+    video_id = video_id_from_url(args.url)
+    info = {
+        "id": video_id,
+        "title": f"Fake Video {video_id}",
+        "duration": 42,
+        "ext": "mp4",
+        "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+    }
+
+    if args.get_title:
+        emit(info["title"])
+        return 0
+
+    if args.dump_json:
+        formats = fake_formats(info["duration"])
+        by_id = {fmt["format_id"]: fmt for fmt in formats}
+        emit(json.dumps(dict(info, formats=formats,
+                             requested_formats=[by_id["137"], by_id["140"]])))
+        return 0
+
+    if video_id in os.environ.get("FAKE_YTDLP_FAIL_IDS", "").split(","):
+        emit(f"ERROR: [youtube] {video_id}: Video unavailable")
+        return 1
+
+    prints = {}
+    for spec in args.prints:
+        when, _, template = spec.partition(":")
+        prints.setdefault(when, []).append(template)
+    # Like yt-dlp, --print implies --quiet
+    quiet = bool(prints)
+
+    if args.download_archive and os.path.exists(args.download_archive):
+        with open(args.download_archive) as f:
+            if f"youtube {video_id}" in f.read().splitlines():
+                if not quiet:
+                    emit(f"[download] {video_id}: has already been recorded in the archive")
+                return 0
+
+    size = int(env_float("FAKE_YTDLP_SIZE", 1024 * 1024))
+    line_delay = env_float("FAKE_YTDLP_LINE_DELAY", 0)
+    replay = os.environ.get("FAKE_YTDLP_REPLAY")
+    if replay:
+        return replay_output(replay, render_template(args.output, info), size, line_delay)
+
+    streams = requested_streams(args.format, info["duration"])
+
+    for i in range(int(env_float("FAKE_YTDLP_CHATTER", 0))):
+        emit(f"[youtube] {video_id}: Downloading webpage part {i} " + "." * 160)
+
+    lines = max(1, int(env_float("FAKE_YTDLP_PROGRESS_LINES", 20)))
+    fragments = int(env_float("FAKE_YTDLP_FRAGMENTS", 0))
+    fail_at = os.environ.get("FAKE_YTDLP_FAIL_AT")
+    fail_at = float(fail_at) if fail_at else None
+    throttle = None
+    if os.environ.get("FAKE_YTDLP_THROTTLE_AFTER"):
+        # Each new connection gets throttled after a while; fragments downloaded
+        # in parallel are throttled one by one
+        throttle = (time.monotonic() + env_float("FAKE_YTDLP_THROTTLE_AFTER", 0),
+                    env_float("FAKE_YTDLP_THROTTLE_SPEED", 64 * 1024) * args.concurrent_fragments)
+    progress_templates = {}
+    for spec in args.progress_templates:
+        when, _, template = spec.partition(":")
+        progress_templates.setdefault(when, []).append(template)
+
+    # Like yt-dlp, a relative output template is put in the home path, and
+    # the file is downloaded in the temp path and moved home once complete
+    paths = dict(spec.partition(":")[::2] for spec in args.paths)
+    for format_id, ext, share in streams:
+        info.update(format_id=format_id, ext=ext)
+        filename = render_template(args.output, info)
+        filepath = os.path.join(paths.get("home", ""), filename)
+        temp_path = os.path.join(paths["temp"], filename) if "temp" in paths else filepath
+        info["filepath"] = filepath
+        for template in prints.get("before_dl", []):
+            emit(render_template(template, info))
+        if os.path.exists(filepath):
+            emit(f"[download] {filepath} has already been downloaded")
+        else:
+            if not quiet:
+                emit(f"[download] Destination: {filepath}")
+            os.makedirs(os.path.dirname(os.path.abspath(temp_path)), exist_ok=True)
+            # The streams share the time a single file would take
+            if not download_stream(int(size * share), max(1, int(lines * share)), line_delay,
+                                   fragments, progress_templates.get("download"),
+                                   temp_path + ".part", args.limit_rate, fail_at, progress_hooks,
+                                   throttle):
+                return 1
+            os.replace(temp_path + ".part", temp_path)
+            if temp_path != filepath:
+                os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+                shutil.move(temp_path, filepath)
+
+        for template in prints.get("post_process", []):
+            emit(render_template(template, info))
+        move = {"status": "started", "postprocessor": "MoveFiles"}
+        if postprocessor_hooks:
+            for hook in postprocessor_hooks:
+                hook(move)
+        else:
+            for template in progress_templates.get("postprocess", []):
+                emit(render_template(template, {"progress": move}))
+        merge_delay = env_float("FAKE_YTDLP_MERGE_DELAY", 0)
+        if merge_delay and "+" in format_id:
+            # Like yt-dlp running ffmpeg to merge the streams
+            emit(f'[Merger] Merging formats into "{filepath}"')
+            subprocess.run([sys.executable, "-c", f"import time; time.sleep({merge_delay})"])
+        for template in prints.get("after_move", []):
+            emit(render_template(template, info))
+    if args.download_archive:
+        with open(args.download_archive, "a") as f:
+            f.write(f"youtube {video_id}\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
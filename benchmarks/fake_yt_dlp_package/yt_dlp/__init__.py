@@ -0,0 +1,65 @@
+"""
+Fake yt_dlp package
+===================
+
+The fake yt-dlp (benchmarks/fake_yt_dlp.py) behind the part of yt-dlp's
+Python API that the downloader's --yt-dlp-worker uses: parse_options,
+YoutubeDL (download and download_with_info_file) with progress and
+postprocessor hooks, utils.DownloadError and
+version.__version__. Put this directory's parent on PYTHONPATH to use it.
+
+Importing the package takes FAKE_YTDLP_STARTUP_DELAY seconds, as loading
+the real one does, and a YoutubeDL's first download takes
+FAKE_YTDLP_CONNECT_DELAY seconds longer, as opening its first connection
+does; the executable pays both on every run.
+"""
+
+import collections
+import copy
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+import fake_yt_dlp as fake
+
+from . import utils, version
+
+time.sleep(fake.env_float("FAKE_YTDLP_STARTUP_DELAY", 0))
+
+ParsedOptions = collections.namedtuple("ParsedOptions", "parser options urls ydl_opts")
+
+def parse_options(argv):
+    parser = fake.build_parser()
+    options, _ = parser.parse_known_args(argv)
+    urls = [options.url] if options.url else []
+    return ParsedOptions(parser, options, urls, {"fake_options": options})
+
+class YoutubeDL:
+    def __init__(self, params):
+        self.params = params
+        self.connected = False
+        # Like yt-dlp's, set by any failed download and never cleared
+        self._download_retcode = 0
+
+    def download(self, urls):
+        for url in urls:
+            self._download(url=url, load_info_filename=None)
+        return self._download_retcode
+
+    def download_with_info_file(self, info_filename):
+        self._download(url=None, load_info_filename=info_filename)
+        return self._download_retcode
+
+    def _download(self, **arguments):
+        if not self.connected:
+            time.sleep(fake.env_float("FAKE_YTDLP_CONNECT_DELAY", 0))
+            self.connected = True
+        options = copy.copy(self.params["fake_options"])
+        vars(options).update(arguments)
+        if fake.download(options, self.params.get("progress_hooks"),
+                         self.params.get("postprocessor_hooks")):
+            self._download_retcode = 1
+
+    def close(self):
+        pass
@@ -0,0 +1 @@
+__version__ = "0000.00.00-fake"
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Run the benchmark suite against the fake yt-dlp and write the results as JSON.
+
+Benchmarks (pick some with --only):
+    parser    progress lines per second: JSON template and regex fallback
+    overhead  end-to-end time per job on top of what the fake yt-dlp itself takes,
+              with the executable and with the yt_dlp worker pool (fake package)
+    ui        latency from a job update in the engine to its redraw on the Tk main loop
+    memory    resident memory of this process over a long batch
+    scaling   throughput with 1, 2, 4 and 8 parallel downloads
+
+Everything runs offline. The ui benchmark redraws the real window when Tk
+has a display (e.g. under xvfb-run) and otherwise times the update channel
+alone on a headless main loop; the results say which.
+
+The JSON goes to standard output or --output, progress to standard error.
+With --compare, every metric is set against an earlier results file and
+the exit code is 1 if any got worse by more than --threshold.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--only parser ui] [--quick] [--output results.json]
+    python benchmarks/run_benchmarks.py --compare baseline.json
+    xvfb-run python benchmarks/run_benchmarks.py --only ui
+"""
+
+import argparse
+import heapq
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import bench_parser
+import bench_queue
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FAKE_YT_DLP = os.path.join(HERE, "fake_yt_dlp.py")
+FAKE_YT_DLP_PACKAGE = os.path.join(HERE, "fake_yt_dlp_package")
+
+BENCHMARKS = ("parser", "overhead", "ui", "memory", "scaling")
+
+# These measure the machine rather than the downloader; they are compared
+# but never count as regressions
+REFERENCE_METRICS = {"direct_ms", "rss_start_bytes"}
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+def fake_env(**values):
+    """Set the fake yt-dlp's tuning variables for the benchmarks that follow"""
+    for name, value in values.items():
+        os.environ["FAKE_YTDLP_" + name] = str(value)
+
+def wait_until_finished(engine, count):
+    """Block until count jobs of engine have finished"""
+    while sum(1 for job in engine.jobs() if job.finished) < count or not engine.idle():
+        time.sleep(0.01)
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def bench_parser_throughput(app, quick):
+    count = 20000 if quick else 200000
+    return {
+        "lines": count,
+        "json_lines_per_s": bench_parser.rate(app.parse_progress_line,
+                                              bench_parser.json_lines(app, count)),
+        "legacy_lines_per_s": bench_parser.rate(app.parse_progress_line,
+                                                bench_parser.legacy_lines(count)),
+    }
+
+def run_one_at_a_time(app, runs, prefix, backend):
+    """Seconds each of runs downloads takes through an engine with one slot"""
+    engine = app.DownloadEngine(max_workers=1, backend=backend)
+    engine.ffmpeg_path = None
+    times = []
+    with tempfile.TemporaryDirectory() as save_dir:
+        for i in range(runs):
+            start = time.perf_counter()
+            engine.add(f"https://www.youtube.com/watch?v={prefix}{i:07d}", save_dir)
+            wait_until_finished(engine, i + 1)
+            times.append(time.perf_counter() - start)
+    failed = sum(1 for job in engine.jobs() if job.state != app.JOB_DONE)
+    if engine.worker_pool is not None:
+        # Its workers would otherwise outlive the benchmark
+        engine.worker_pool.close()
+        while engine.worker_pool.worker_count():
+            time.sleep(0.01)
+    return times, failed
+
+def bench_overhead(app, quick):
+    """Run the same downloads directly, through the engine and through its worker pool"""
+    runs = 5 if quick else 20
+    fake_env(EXTRACT_DELAY=0, LINE_DELAY=0, PROGRESS_LINES=100)
+    direct = []
+    with tempfile.TemporaryDirectory() as save_dir:
+        for i in range(runs):
+            cmd = app.build_download_command(FAKE_YT_DLP,
+                                             f"https://www.youtube.com/watch?v=dire{i:07d}", save_dir)
+            start = time.perf_counter()
+            subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            direct.append(time.perf_counter() - start)
+
+    through_engine, failed = run_one_at_a_time(app, runs, "engi", app.BACKEND_EXECUTABLE)
+    # The workers are started by the engine and inherit the path to the fake package
+    os.environ["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [FAKE_YT_DLP_PACKAGE, os.environ.get("PYTHONPATH")]))
+    through_pool, pool_failed = run_one_at_a_time(app, runs, "pool", app.BACKEND_MODULE)
+    return {
+        "runs": runs,
+        "failed": failed + pool_failed,
+        "direct_ms": statistics.median(direct) * 1000,
+        "engine_ms": statistics.median(through_engine) * 1000,
+        "overhead_ms": (statistics.median(through_engine) - statistics.median(direct)) * 1000,
+        "module_ms": statistics.median(through_pool) * 1000,
+    }
+
+class HeadlessRoot:
+    """Just enough of a Tk root for UIUpdateChannel: after() timers on the calling thread"""
+
+    def __init__(self):
+        self._timers = []
+        self._order = 0
+        self._running = False
+
+    def after(self, ms, callback):
+        self._order += 1
+        heapq.heappush(self._timers, (time.monotonic() + ms / 1000, self._order, callback))
+
+    def mainloop(self):
+        self._running = True
+        while self._running and self._timers:
+            due, _, callback = heapq.heappop(self._timers)
+            time.sleep(max(0, due - time.monotonic()))
+            callback()
+
+    def quit(self):
+        self._running = False
+
+    def destroy(self):
+        pass
+
+def open_window(app, config_dir):
+    """A real downloader window, or None if Tk has no display"""
+    try:
+        app.load_tk()
+        root = app.tk.Tk()
+    except Exception:
+        return None
+    # Keep the window's cache, archive and journal out of the real config folder
+    previous = os.environ.get("YTDL_CONFIG_DIR")
+    os.environ["YTDL_CONFIG_DIR"] = config_dir
+    try:
+        return app.YouTubeDownloader(root)
+    finally:
+        if previous is None:
+            del os.environ["YTDL_CONFIG_DIR"]
+        else:
+            os.environ["YTDL_CONFIG_DIR"] = previous
+
+def bench_ui_latency(app, quick):
+    """Time from an engine update to the end of the redraw that shows it"""
+    count = 10 if quick else 40
+    fake_env(EXTRACT_DELAY=0.05, LINE_DELAY=0.005, PROGRESS_LINES=200)
+    pushed = {}
+    latencies = []
+    redraws = [0]
+    lock = threading.Lock()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        window = open_window(app, tmp)
+        if window is not None:
+            root, channel, engine = window.root, window.updates, window.engine
+            engine.ffmpeg_path = None
+            redraw = channel.handler
+            mode = "tk"
+        else:
+            root = HeadlessRoot()
+            redraw = lambda items: None
+            channel = app.UIUpdateChannel(root, redraw)
+            engine = app.DownloadEngine(max_workers=app.DEFAULT_MAX_WORKERS)
+            engine.ffmpeg_path = None
+            mode = "headless"
+
+        def on_update(job):
+            with lock:
+                pushed.setdefault(("job", job.id), time.perf_counter())
+            channel.push(("job", job.id), job)
+
+        def timed_redraw(items):
+            # Updates pushed while the redraw runs belong to the next one
+            with lock:
+                starts = [pushed.pop(("job", getattr(item, "id", None)), None) for item in items]
+            redraw(items)
+            now = time.perf_counter()
+            redraws[0] += 1
+            latencies.extend(now - start for start in starts if start is not None)
+
+        engine.on_update = on_update
+        channel.handler = timed_redraw
+        if mode == "headless":
+            channel.start()
+
+        def check_done():
+            if engine.idle() and not pushed:
+                root.quit()
+            else:
+                root.after(50, check_done)
+
+        start = time.perf_counter()
+        for i in range(count):
+            engine.add(f"https://www.youtube.com/watch?v=uila{i:07d}", tmp)
+        root.after(50, check_done)
+        root.mainloop()
+        elapsed = time.perf_counter() - start
+        root.destroy()
+
+    return {
+        "mode": mode,
+        "jobs": count,
+        "seconds": elapsed,
+        "redraws": redraws[0],
+        "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+        "latency_p95_ms": percentile(latencies, 0.95) * 1000,
+        "latency_max_ms": max(latencies) * 1000,
+    }
+
+def resident_memory():
+    """Resident memory of this process in bytes"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def bench_memory(app, quick):
+    """Queue a long batch and sample memory while it runs"""
+    count = 60 if quick else 500
+    fake_env(EXTRACT_DELAY=0, LINE_DELAY=0, PROGRESS_LINES=50)
+    engine = app.DownloadEngine(max_workers=8)
+    engine.ffmpeg_path = None
+    samples = []
+    with tempfile.TemporaryDirectory() as save_dir:
+        before = resident_memory()
+        for i in range(count):
+            engine.add(f"https://www.youtube.com/watch?v=memo{i:07d}", save_dir)
+        while not engine.idle():
+            samples.append(resident_memory())
+            time.sleep(0.1)
+        after = resident_memory()
+    return {
+        "jobs": count,
+        "rss_start_bytes": before,
+        "rss_peak_bytes": max(samples + [after]),
+        "rss_end_bytes": after,
+        "rss_growth_per_100_jobs_bytes": (after - before) * 100 / count,
+    }
+
+def bench_scaling(app, quick):
+    count = 16 if quick else 50
+    fake_env(EXTRACT_DELAY=0.2, LINE_DELAY=0.01, PROGRESS_LINES=20)
+    os.environ["YT_DLP_PATH"] = FAKE_YT_DLP
+    urls = bench_queue.video_urls(count)
+    results = {"jobs": count}
+    for workers in (1, 2, 4, 8):
+        elapsed, failed = bench_queue.run_batch(app, urls, workers)
+        results[f"workers_{workers}_jobs_per_s"] = count / elapsed
+        if failed:
+            results[f"workers_{workers}_failed"] = failed
+    return results
+
+RUNNERS = {
+    "parser": bench_parser_throughput,
+    "overhead": bench_overhead,
+    "ui": bench_ui_latency,
+    "memory": bench_memory,
+    "scaling": bench_scaling,
+}
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "-C", HERE, "rev-parse", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "-C", HERE, "status", "--porcelain", "--", ".."],
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+def higher_is_better(metric):
+    return metric.endswith("_per_s")
+
+def compare(results, baseline, threshold):
+    """Print each metric against the baseline; returns the names of regressions"""
+    regressions = []
+    for name, metrics in results["benchmarks"].items():
+        old_metrics = baseline.get("benchmarks", {}).get(name, {})
+        for metric, value in metrics.items():
+            old = old_metrics.get(metric)
+            if (not isinstance(value, (int, float)) or not isinstance(old, (int, float))
+                    or isinstance(value, bool) or not old):
+                continue
+            change = (value - old) / abs(old)
+            worse = -change if higher_is_better(metric) else change
+            flag = ""
+            if (metric.endswith(("_per_s", "_ms", "_bytes")) and metric not in REFERENCE_METRICS
+                    and worse > threshold):
+                flag = "  REGRESSION"
+                regressions.append(f"{name}.{metric}")
+            log(f"  {name}.{metric:<34} {old:14.2f} -> {value:14.2f}  {change:+7.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument("--quick", action="store_true", help="smaller runs, e.g. for CI")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE", help="earlier results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative change that counts as a regression (default 0.10)")
+    args = parser.parse_args()
+
+    os.environ["YT_DLP_PATH"] = FAKE_YT_DLP
+    app = bench_queue.load_app()
+    commit, dirty = git_revision()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "quick": args.quick,
+        "benchmarks": {},
+    }
+    for name in args.only:
+        log(f"running {name}...")
+        results["benchmarks"][name] = RUNNERS[name](app, args.quick)
+        log("  " + json.dumps(results["benchmarks"][name]))
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        log(f"compared with {baseline.get('commit')} ({baseline.get('date')}):")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            log(f"{len(regressions)} regressions: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
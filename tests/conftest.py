@@ -0,0 +1,30 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+SCRIPT = os.path.join(ROOT, "youtube-downloader.py")
+BENCHMARKS = os.path.join(ROOT, "benchmarks")
+FAKE_YT_DLP = os.path.join(BENCHMARKS, "fake_yt_dlp.py")
+FAKE_YT_DLP_PACKAGE = os.path.join(BENCHMARKS, "fake_yt_dlp_package")
+FAKE_FFMPEG = os.path.join(BENCHMARKS, "fake_ffmpeg.py")
+
+@pytest.fixture(scope="session")
+def app():
+    """The downloader script, imported as a module"""
+    spec = importlib.util.spec_from_file_location("youtube_downloader", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture
+def fake_env(monkeypatch, tmp_path):
+    """Point the downloader at the fake yt-dlp, with its own config folder"""
+    monkeypatch.setenv("YT_DLP_PATH", FAKE_YT_DLP)
+    monkeypatch.setenv("YTDL_CONFIG_DIR", str(tmp_path / "config"))
+    monkeypatch.setenv("FAKE_YTDLP_EXTRACT_DELAY", "0")
+    monkeypatch.setenv("FAKE_YTDLP_SIZE", "1024")
+    monkeypatch.setenv("FAKE_YTDLP_PROGRESS_LINES", "2")
+    return tmp_path
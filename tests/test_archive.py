@@ -0,0 +1,21 @@
+import os
+
+def test_yt_dlp_archive_is_replaced_whole(app, tmp_path):
+    archive = app.DownloadArchive(str(tmp_path / "archive.sqlite3"))
+    video = tmp_path / "video.mp4"
+    video.write_text("video")
+    archive.add("aaaaaaaaaaa", str(video))
+    archive.add("bbbbbbbbbbb", str(tmp_path / "deleted.mp4"))
+    path = str(tmp_path / "archive.txt")
+    with open(path, "w") as f:
+        f.write("youtube ccccccccccc\n")
+    # A yt-dlp process still appending to the file it opened
+    appending = open(path, "a")
+    assert archive.write_yt_dlp_archive(path) == path
+    appending.write("youtube ddddddddddd\n")
+    appending.close()
+    # Its line went to the file that was replaced; the database gets it when the job is done
+    with open(path) as f:
+        assert f.read() == "youtube aaaaaaaaaaa\n"
+    assert sorted(os.listdir(tmp_path)) == ["archive.sqlite3", "archive.txt", "video.mp4"]
+    archive.close()
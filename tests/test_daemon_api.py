@@ -0,0 +1,177 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+TOKEN = "secret-token"
+URL = "https://www.youtube.com/watch?v=aaaaaaaaaaa"
+
+class StubEngine:
+    """Records what the API asks of a DownloadEngine"""
+
+    def __init__(self, app):
+        self.app = app
+        self.added = []
+        self.max_workers = 3
+        self.bandwidth = app.BandwidthScheduler()
+        self.format_preset = app.DEFAULT_FORMAT_PRESET
+
+    def jobs(self):
+        return []
+
+    def groups(self):
+        return []
+
+    def stage_stats(self):
+        return {}
+
+    def add_url(self, url, save_dir, refresh=False, priority=None):
+        self.added.append((url, save_dir))
+        return self.app.DownloadJob(url, save_dir)
+
+    def set_max_workers(self, max_workers):
+        self.max_workers = max_workers
+
+@pytest.fixture
+def server(app, tmp_path):
+    save_dir = tmp_path / "downloads"
+    save_dir.mkdir()
+    return app.JobServer(StubEngine(app), str(save_dir), port=0, token=TOKEN)
+
+def exchange(server, *requests):
+    """Send raw requests to the server, each on its own connection; returns (status, body) of each"""
+    async def run():
+        ready = asyncio.get_running_loop().create_future()
+        serving = asyncio.ensure_future(server.serve(on_ready=lambda s: ready.set_result(None)))
+        await ready
+        responses = []
+        for raw in requests:
+            if callable(raw):
+                raw = raw(server.port)
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(raw)
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            head, _, body = response.partition(b"\r\n\r\n")
+            responses.append((int(head.split()[1]), json.loads(body) if body else None))
+        serving.cancel()
+        return responses
+
+    return asyncio.run(run())
+
+def post(path, payload, content_type="application/json", token=TOKEN,
+         host="127.0.0.1:{port}", origin=None):
+    """A raw POST request; {port} in host and origin is the port the server listens on"""
+    def build(port):
+        body = json.dumps(payload).encode()
+        headers = [f"Host: {host.format(port=port)}", f"Content-Length: {len(body)}"]
+        if content_type:
+            headers.append(f"Content-Type: {content_type}")
+        if token:
+            headers.append(f"Authorization: Bearer {token}")
+        if origin:
+            headers.append(f"Origin: {origin.format(port=port)}")
+        head = "".join(header + "\r\n" for header in headers)
+        return f"POST {path} HTTP/1.1\r\n{head}\r\n".encode() + body
+    return build
+
+def test_accepts_api_client(server):
+    [(status, _)] = exchange(server, post("/jobs", {"url": URL}))
+    assert status == 201
+    assert server.engine.added == [(URL, server.save_dir)]
+
+def test_accepts_page_served_by_the_api_itself(server):
+    [(status, _)] = exchange(server, post("/jobs", {"url": URL}, origin="http://localhost:{port}"))
+    assert status == 201
+
+@pytest.mark.parametrize("request_args, expected", [
+    ({"content_type": "text/plain"}, 415),
+    ({"content_type": None}, 415),
+    ({"origin": "http://evil.example"}, 403),
+    ({"origin": "http://localhost"}, 403),
+    ({"host": "evil.example:{port}"}, 403),
+    ({"host": "localhost"}, 403),
+    ({"token": None}, 401),
+    ({"token": "wrong"}, 401),
+])
+def test_rejects_requests_a_web_page_could_send(server, request_args, expected):
+    [(status, _)] = exchange(server, post("/jobs", {"url": URL}, **request_args))
+    assert status == expected
+    assert server.engine.added == []
+
+def test_save_dir_must_be_inside_the_save_location(server, tmp_path):
+    inside = os.path.join(server.save_dir, "music")
+    responses = exchange(
+        server,
+        post("/jobs", {"url": URL, "save_dir": str(tmp_path / "elsewhere")}),
+        post("/jobs", {"url": URL, "save_dir": os.path.join(server.save_dir, os.pardir)}),
+        post("/jobs", {"url": URL, "save_dir": "music"}),
+    )
+    assert [status for status, _ in responses] == [403, 403, 201]
+    assert server.engine.added == [(URL, os.path.realpath(inside))]
+
+def test_get_needs_no_token(server):
+    [(status, body)] = exchange(
+        server, lambda port: f"GET /jobs HTTP/1.1\r\nHost: localhost:{port}\r\n\r\n".encode())
+    assert status == 200
+    assert body["jobs"] == []
+
+def test_answers_oversized_request_heads_and_closes(app, server):
+    long_target = "/" + "x" * app.MAX_REQUEST_LINE
+    responses = exchange(
+        server,
+        lambda port: f"GET {long_target} HTTP/1.1\r\n\r\n".encode(),
+        lambda port: f"GET /jobs HTTP/1.1\r\nX-Long: {'x' * app.MAX_REQUEST_LINE}\r\n\r\n".encode(),
+        lambda port: ("GET /jobs HTTP/1.1\r\n"
+                      + "X-Many: 1\r\n" * (app.MAX_REQUEST_HEADERS + 1) + "\r\n").encode(),
+        lambda port: f"GET /jobs HTTP/1.1\r\nHost: localhost:{port}\r\n\r\n".encode(),
+    )
+    assert [status for status, _ in responses] == [400, 431, 431, 200]
+
+def test_max_workers_must_be_a_number(server):
+    responses = exchange(
+        server,
+        post("/settings", {"max_workers": True}),
+        post("/settings", {"max_workers": 0}),
+        post("/settings", {"max_workers": 5}),
+    )
+    assert [status for status, _ in responses] == [400, 400, 200]
+    assert server.engine.max_workers == 5
+
+def test_interrupt_leaves_jobs_and_supervised_children_alone(app, server):
+    supervisor = app.ProcessSupervisor()
+    exited = threading.Event()
+    sleeper = supervisor.start([sys.executable, "-c", "import time; time.sleep(0.5)"],
+                               lambda line: None, lambda returncode, error: exited.set())
+
+    def interrupt(server):
+        raise KeyboardInterrupt
+
+    server.engine.cancel_all = lambda: pytest.fail("cancel_all called")
+    server.run(on_ready=interrupt)
+    # The supervisor's loop still learns that its children have exited
+    assert exited.wait(5)
+    assert sleeper.returncode == 0
+    supervisor.close()
+
+def test_remote_commands_are_sent_in_order_off_the_calling_thread(app):
+    # Nothing listens here; the event stream just keeps reconnecting
+    engine = app.RemoteEngine("http://127.0.0.1:9")
+    release = threading.Event()
+    results = []
+
+    def fail():
+        raise ValueError("not accepted")
+
+    engine.submit(release.wait)
+    engine.submit(lambda: "second", lambda result, error: results.append((result, error)))
+    engine.submit(fail, lambda result, error: results.append((result, str(error))))
+    assert results == []
+    assert not engine.shutdown(timeout=0.1)
+    release.set()
+    assert engine.shutdown(timeout=5)
+    assert results == [("second", None), (None, "not accepted")]
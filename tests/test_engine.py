@@ -0,0 +1,192 @@
+import os
+import subprocess
+import time
+
+import pytest
+
+from conftest import FAKE_FFMPEG
+
+class EagerSupervisor:
+    """Runs a process to the end inside start(), so every callback comes before start returns.
+
+    That is the worst case of the race with ProcessSupervisor, whose thread
+    may call back before the caller has the process.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def start(self, cmd, on_line, on_exit, timeout=None, stdin=False, idle=True, on_start=None):
+        process = self.app.SupervisedProcess(self, cmd)
+        if on_start is not None:
+            on_start(process)
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        for line in result.stdout.splitlines():
+            on_line(line)
+        process.returncode = result.returncode
+        on_exit(result.returncode, None)
+        return process
+
+    def call_soon(self, callback, *args):
+        callback(*args)
+
+class UnavailablePool:
+    """A worker pool that finds out yt_dlp cannot be imported before run() returns"""
+
+    available = None
+
+    def __init__(self, app):
+        self.app = app
+
+    def run(self, args, on_line, on_exit, on_start=None):
+        download = self.app.PooledDownload(self, args, on_line, on_exit)
+        if on_start is not None:
+            on_start(download)
+        self.available = False
+        download.stopped = self.app.PROCESS_UNAVAILABLE
+        on_exit(None, None)
+        return download
+
+def wait_finished(job, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not job.finished:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+@pytest.fixture
+def engine(app, fake_env):
+    engine = app.DownloadEngine(max_workers=1)
+    engine.ffmpeg_path = None
+    engine.supervisor = EagerSupervisor(app)
+    return engine
+
+def test_callbacks_before_start_returns(app, engine, fake_env):
+    job = engine.add("https://www.youtube.com/watch?v=aaaaaaaaaaa", str(fake_env))
+    assert job.state == app.JOB_DONE, job.message
+    assert job.process is None
+    assert (fake_env / "Fake Video aaaaaaaaaaa.mp4").exists()
+
+def test_unavailable_pool_before_run_returns_falls_back_to_executable(app, engine, fake_env):
+    engine.worker_pool = UnavailablePool(app)
+    job = engine.add("https://www.youtube.com/watch?v=aaaaaaaaaaa", str(fake_env))
+    assert job.state == app.JOB_DONE, job.message
+    assert (fake_env / "Fake Video aaaaaaaaaaa.mp4").exists()
+
+def test_failed_download_reports_the_error(app, engine, fake_env, monkeypatch):
+    monkeypatch.setenv("FAKE_YTDLP_FAIL_IDS", "bbbbbbbbbbb")
+    job = engine.add("https://www.youtube.com/watch?v=bbbbbbbbbbb", str(fake_env))
+    assert job.state == app.JOB_FAILED
+    assert job.message == "Download failed: [youtube] bbbbbbbbbbb: Video unavailable"
+
+def test_shutdown_stops_downloads_and_keeps_them_for_resume(app, fake_env, monkeypatch):
+    monkeypatch.setenv("FAKE_YTDLP_PROGRESS_LINES", "100")
+    monkeypatch.setenv("FAKE_YTDLP_LINE_DELAY", "0.1")
+    journal_path = str(fake_env / "journal.jsonl")
+    engine = app.DownloadEngine(max_workers=1, journal=app.JobJournal(journal_path))
+    engine.ffmpeg_path = None
+    running = engine.add("https://www.youtube.com/watch?v=aaaaaaaaaaa", str(fake_env))
+    waiting = engine.add("https://www.youtube.com/watch?v=bbbbbbbbbbb", str(fake_env))
+    deadline = time.monotonic() + 10
+    while running.process is None or running.progress == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert engine.shutdown(timeout=10)
+    assert running.process is None
+    assert waiting.state == app.JOB_QUEUED
+
+    records = app.JobJournal(journal_path).records()
+    assert {record["key"]: record["state"] for record in records} == {
+        running.key: app.JOB_RUNNING, waiting.key: app.JOB_QUEUED}
+
+def test_cancel_during_move_ends_cancelled(app, engine, fake_env, monkeypatch):
+    engine.scratch_dir = str(fake_env / "scratch")
+    move_into_place = app.move_into_place
+
+    def cancel_while_moving(path, directory, name=None):
+        target = move_into_place(path, directory, name)
+        engine.cancel(job)
+        return target
+
+    monkeypatch.setattr(app, "move_into_place", cancel_while_moving)
+    job = engine.add("https://www.youtube.com/watch?v=aaaaaaaaaaa", str(fake_env))
+    wait_finished(job)
+    assert job.state == app.JOB_CANCELLED
+    assert not (fake_env / "Fake Video aaaaaaaaaaa.mp4").exists()
+    assert not os.path.exists(os.path.join(engine.scratch_dir, job.key))
+
+def test_merge_keeps_existing_file(app, engine, fake_env, monkeypatch):
+    monkeypatch.setenv("FAKE_FFMPEG_DELAY", "0")
+    engine.ffmpeg_path = FAKE_FFMPEG
+    (fake_env / "Fake Video aaaaaaaaaaa.mp4").write_text("old")
+    job = engine.add("https://www.youtube.com/watch?v=aaaaaaaaaaa", str(fake_env))
+    wait_finished(job)
+    assert job.state == app.JOB_DONE, job.message
+    assert job.downloaded_file_path == str(fake_env / "Fake Video aaaaaaaaaaa (1).mp4")
+    assert (fake_env / "Fake Video aaaaaaaaaaa.mp4").read_text() == "old"
+    assert sorted(path.name for path in fake_env.glob("Fake Video*")) == [
+        "Fake Video aaaaaaaaaaa (1).mp4", "Fake Video aaaaaaaaaaa.mp4"]
+
+def test_failed_merge_reports_the_error_not_progress(app, engine, fake_env, monkeypatch):
+    monkeypatch.setenv("FAKE_FFMPEG_DELAY", "0")
+    monkeypatch.setenv("FAKE_FFMPEG_FAIL", "1")
+    engine.ffmpeg_path = FAKE_FFMPEG
+    job = engine.add("https://www.youtube.com/watch?v=aaaaaaaaaaa", str(fake_env))
+    wait_finished(job)
+    assert job.state == app.JOB_FAILED
+    assert job.message == "Merging failed: Error while muxing: Invalid argument"
+    assert not any("stream_0_0_q" in line for line in job.output)
+
+class FakeProcess:
+    terminated = False
+
+    def terminate(self):
+        self.terminated = True
+
+def running_job(app, engine, url):
+    job = app.DownloadJob(url, "downloads")
+    job.set_state(app.JOB_RUNNING, "Downloading...")
+    job.process = FakeProcess()
+    engine._running.append(job)
+    return job
+
+def download(engine, job, rates, start=0):
+    """Feed the job's throughput bytes per second for a second each, from second start"""
+    downloaded = job.downloaded_bytes
+    for second, rate in enumerate(rates, start):
+        downloaded += rate
+        job.downloaded_bytes = downloaded
+        job.throughput.add(downloaded, now=second)
+        engine._check_throttle(job)
+    return start + len(rates)
+
+@pytest.mark.parametrize("second_job", [False, True])
+def test_throttle_baseline_follows_parallel_downloads(app, engine, second_job):
+    job = running_job(app, engine, "https://www.youtube.com/watch?v=aaaaaaaaaaa")
+    now = download(engine, job, [1000000] * 60)
+    if second_job:
+        running_job(app, engine, "https://www.youtube.com/watch?v=bbbbbbbbbbb")
+    # Down to a fifth, below THROTTLE_RATIO of the rate it had alone
+    download(engine, job, [200000] * 60, now)
+    assert job.process.terminated is not second_job
+    assert bool(job.throttle_restarts) is not second_job
+
+def test_throttle_baseline_is_not_above_the_rate_limit(app, engine):
+    job = running_job(app, engine, "https://www.youtube.com/watch?v=aaaaaaaaaaa")
+    job.rate_limit = 100000
+    # Faster than its limit at first, as yt-dlp's limit takes a moment
+    now = download(engine, job, [1000000] * 5 + [100000] * 55)
+    download(engine, job, [50000] * 60, now)
+    assert not job.process.terminated
+
+def test_archive_skip_is_noticed_without_a_log_line(app, engine, fake_env):
+    archive = fake_env / "archive.txt"
+    archive.write_text("youtube aaaaaaaaaaa\n")
+    job = app.DownloadJob("https://www.youtube.com/watch?v=aaaaaaaaaaa", str(fake_env))
+    job.download_archive = str(archive)
+    with engine._lock:
+        engine._pending.append(job)
+    engine._dispatch()
+    assert job.state == app.JOB_DONE, job.message
+    assert job.already_downloaded
+    assert not any("archive" in line for line in job.output)
+    assert not (fake_env / "Fake Video aaaaaaaaaaa.mp4").exists()
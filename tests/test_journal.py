@@ -0,0 +1,91 @@
+import json
+import threading
+
+import pytest
+
+def job(key, state="queued", playlist=None):
+    return {"type": "job", "key": key, "state": state, "playlist": playlist}
+
+def playlist(key, expanding=False):
+    return {"type": "playlist", "key": key, "expanding": expanding}
+
+def lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "journal.jsonl")
+
+def test_replay_keeps_last_record_per_entry(app, path):
+    journal = app.JobJournal(path)
+    journal.write(job("a"))
+    journal.write(job("b"))
+    journal.write(job("a", "running"))
+    journal.write(job("c"))
+    journal.forget("c")
+    journal.close()
+    assert len(lines(path)) == 5
+    assert app.JobJournal(path).records() == [job("a", "running"), job("b")]
+
+def test_unchanged_record_is_not_written_again(app, path):
+    journal = app.JobJournal(path)
+    journal.write(job("a"))
+    journal.write(job("a"))
+    journal.close()
+    assert lines(path) == [job("a")]
+
+def test_torn_last_line_is_skipped(app, path):
+    with open(path, "w") as f:
+        f.write(json.dumps(job("a")) + "\n" + json.dumps(job("b"))[:10])
+    journal = app.JobJournal(path)
+    assert journal.records() == [job("a")]
+    journal.close()
+    assert lines(path) == [job("a")]
+
+def test_opening_compacts(app, path):
+    journal = app.JobJournal(path)
+    journal.write(playlist("p1"))
+    journal.write(job("a", "done", playlist="p1"))
+    journal.write(playlist("p2"))
+    journal.write(job("b", "failed", playlist="p2"))
+    journal.write(playlist("p3", expanding=True))
+    journal.write(job("c"))
+    journal.write(job("c", "done"))
+    journal.close()
+    app.JobJournal(path).close()
+    # Finished downloads and playlists left without jobs go
+    assert lines(path) == [playlist("p2"), job("b", "failed", playlist="p2"),
+                           playlist("p3", expanding=True)]
+
+def test_compacts_after_compact_after_lines(app, path):
+    journal = app.JobJournal(path, compact_after=10)
+    for i in range(25):
+        journal.write(job("a", f"running {i}"))
+    journal.close()
+    assert len(lines(path)) < 25
+    assert lines(path)[-1] == job("a", "running 24")
+    assert app.JobJournal(path).records() == [job("a", "running 24")]
+
+def test_close_writes_queued_lines(app, path):
+    journal = app.JobJournal(path)
+    for i in range(100):
+        journal.write(job(f"job{i}"))
+    journal.close()
+    assert [record["key"] for record in lines(path)] == [f"job{i}" for i in range(100)]
+
+def test_write_does_not_wait_for_the_disk(app, path, monkeypatch):
+    journal = app.JobJournal(path)
+    fsync = app.os.fsync
+    fsync_threads = []
+
+    def recording_fsync(fd):
+        fsync_threads.append(threading.current_thread())
+        fsync(fd)
+
+    monkeypatch.setattr(app.os, "fsync", recording_fsync)
+    for i in range(10):
+        journal.write(job("a", f"running {i}"))
+    journal.close()
+    assert fsync_threads
+    assert threading.current_thread() not in fsync_threads
@@ -0,0 +1,114 @@
+import errno
+import os
+import threading
+
+import pytest
+
+def write(path, data):
+    with open(path, "w") as f:
+        f.write(data)
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+@pytest.fixture
+def dirs(tmp_path):
+    scratch = tmp_path / "scratch"
+    save = tmp_path / "save"
+    scratch.mkdir()
+    save.mkdir()
+    return str(scratch), str(save)
+
+def test_moves_file(app, dirs):
+    scratch, save = dirs
+    write(os.path.join(scratch, "video.mp4"), "new")
+    assert app.move_into_place(os.path.join(scratch, "video.mp4"), save) == os.path.join(save, "video.mp4")
+    assert read(os.path.join(save, "video.mp4")) == "new"
+    assert os.listdir(scratch) == []
+
+def test_keeps_existing_file(app, dirs):
+    scratch, save = dirs
+    write(os.path.join(save, "video.mp4"), "old")
+    write(os.path.join(save, "video (1).mp4"), "older")
+    write(os.path.join(scratch, "video.mp4"), "new")
+    target = app.move_into_place(os.path.join(scratch, "video.mp4"), save)
+    assert target == os.path.join(save, "video (2).mp4")
+    assert read(os.path.join(save, "video.mp4")) == "old"
+    assert read(os.path.join(save, "video (1).mp4")) == "older"
+    assert read(target) == "new"
+    assert os.listdir(scratch) == []
+
+def test_keeps_existing_file_across_disks(app, dirs, monkeypatch):
+    scratch, save = dirs
+    write(os.path.join(save, "video.mp4"), "old")
+    write(os.path.join(scratch, "video.mp4"), "new")
+    link = os.link
+
+    def cross_device_link(source, target):
+        if os.path.dirname(source) != os.path.dirname(target):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        link(source, target)
+
+    monkeypatch.setattr(os, "link", cross_device_link)
+    target = app.move_into_place(os.path.join(scratch, "video.mp4"), save)
+    assert target == os.path.join(save, "video (1).mp4")
+    assert read(os.path.join(save, "video.mp4")) == "old"
+    assert read(target) == "new"
+    assert sorted(os.listdir(save)) == ["video (1).mp4", "video.mp4"]
+    assert os.listdir(scratch) == []
+
+def test_concurrent_moves_across_disks_of_the_same_name(app, tmp_path, monkeypatch):
+    save = str(tmp_path / "save")
+    os.mkdir(save)
+    sources = []
+    for i in range(2):
+        os.mkdir(tmp_path / f"scratch{i}")
+        sources.append(str(tmp_path / f"scratch{i}" / "video.mp4"))
+        write(sources[-1], str(i) * 100000)
+    link = os.link
+    copyfile = app.shutil.copyfile
+    both_copying = threading.Barrier(2)
+
+    def cross_device_link(source, target):
+        if os.path.dirname(source) != os.path.dirname(target):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        link(source, target)
+
+    def copy_together(source, target):
+        both_copying.wait(5)
+        copyfile(source, target)
+        both_copying.wait(5)
+
+    monkeypatch.setattr(os, "link", cross_device_link)
+    monkeypatch.setattr(app.shutil, "copyfile", copy_together)
+    targets, errors = [], []
+
+    def move(source):
+        try:
+            targets.append(app.move_into_place(source, save))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=move, args=(source,)) for source in sources]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert sorted(os.listdir(save)) == ["video (1).mp4", "video.mp4"]
+    assert sorted(read(target) for target in targets) == ["0" * 100000, "1" * 100000]
+
+def test_keeps_existing_file_without_hard_links(app, dirs, monkeypatch):
+    scratch, save = dirs
+    write(os.path.join(save, "video.mp4"), "old")
+    write(os.path.join(scratch, "video.mp4"), "new")
+
+    def unsupported_link(source, target):
+        raise OSError(errno.EPERM, "Operation not permitted")
+
+    monkeypatch.setattr(os, "link", unsupported_link)
+    target = app.move_into_place(os.path.join(scratch, "video.mp4"), save)
+    assert target == os.path.join(save, "video (1).mp4")
+    assert read(os.path.join(save, "video.mp4")) == "old"
+    assert read(target) == "new"
@@ -0,0 +1,22 @@
+import json
+import os
+import subprocess
+import sys
+
+from conftest import FAKE_YT_DLP_PACKAGE, SCRIPT
+
+def run_worker(requests, env):
+    """Send requests to a --yt-dlp-worker and return the exit code it reported for each"""
+    stdin = "".join(json.dumps({"args": args}) + "\n" for args in requests)
+    result = subprocess.run([sys.executable, SCRIPT, "--yt-dlp-worker"], input=stdin,
+                            capture_output=True, text=True, env=env, timeout=60)
+    return [json.loads(line.split(" ", 2)[2])["returncode"]
+            for line in result.stdout.splitlines() if line.startswith("__ytdl__ done ")]
+
+def test_failed_job_does_not_fail_later_jobs_with_the_same_options(fake_env):
+    env = dict(os.environ, PYTHONPATH=FAKE_YT_DLP_PACKAGE, FAKE_YTDLP_FAIL_IDS="bbbbbbbbbbb")
+    options = ["-o", "%(title)s.%(ext)s", "-P", f"home:{fake_env}"]
+    requests = [options + [f"https://www.youtube.com/watch?v={video_id}"]
+                for video_id in ("aaaaaaaaaaa", "bbbbbbbbbbb", "ccccccccccc")]
+    assert run_worker(requests, env) == [0, 1, 0]
+    assert os.path.exists(fake_env / "Fake Video ccccccccccc.mp4")
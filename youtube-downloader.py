@@ -19,45 +19,5118 @@ License: Open Source
 
 Usage:
     python youtube-downloader.py
+    python youtube-downloader.py --batch urls.txt --jobs 4 --output ~/Videos
+    python youtube-downloader.py --daemon
+    python youtube-downloader.py --connect
 
 Features:
     - Simple GUI interface for YouTube video downloads
-    - Real-time download progress tracking
+    - Download queue with several downloads running at once
+    - Real-time progress tracking for every download
     - Custom save location selection
     - Automatic video title and filename detection
     - Clickable folder icon to open download location
     - "Stand by - finishing up..." message during post-processing
     - Success message with video details
+    - Headless batch mode with JSON-lines progress, no display needed
+    - Daemon mode with a local HTTP API, which the GUI can connect to
 
 """
 
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
 import subprocess
 import threading
+import itertools
 import os
 import re
 import sys
+import json
+import time
+import errno
+import signal
+import shutil
+import tempfile
+import sqlite3
+import argparse
+import uuid
+import secrets
+import asyncio
+import concurrent.futures
+import logging
+import logging.handlers
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import namedtuple, deque
+
+# tkinter is only imported when the GUI starts (see load_tk), so batch mode
+# works without a display and starts quickly
+tk = ttk = tkfont = filedialog = messagebox = None
+
+# Notable events of the downloads, such as restarts of throttled ones; batch
+# and daemon mode write them to stderr. The output of yt-dlp and ffmpeg goes
+# to output_log, at debug level, which only the log file records
+log = logging.getLogger("youtube-downloader")
+output_log = logging.getLogger("youtube-downloader.output")
+
+# Prefix for the lines we ask yt-dlp to emit with --print, so they can be told
+# apart from its regular output on the same pipe
+PRINT_MARKER = "__ytdl__"
+
+# Number of downloads that run at the same time unless the user changes it
+DEFAULT_MAX_WORKERS = 3
+
+# How downloads run: the yt-dlp executable, started for every download, or
+# worker processes that import the yt_dlp Python package once and are kept
+# for the next download (see YtDlpWorkerPool)
+BACKEND_EXECUTABLE = "executable"
+BACKEND_MODULE = "module"
+DEFAULT_BACKEND = BACKEND_EXECUTABLE
+# A worker keeps a YoutubeDL, and its open connections, for this many
+# different sets of options
+WORKER_INSTANCES = 4
+
+# Number of ffmpeg merges that run at the same time. They have slots of their
+# own, separate from the downloads, and are CPU bound: one per core
+POSTPROCESS_WORKERS = os.cpu_count() or 1
+
+# Maximum number of times per second the GUI redraws download progress
+DEFAULT_REFRESH_RATE = 15
+# Milliseconds between refreshes of the statistics window and of the log window
+STATS_REFRESH_INTERVAL = 2000
+LOG_REFRESH_INTERVAL = 500
+
+# Minimum number of seconds between two progress lines for the same job in
+# batch mode; state changes are always reported
+BATCH_PROGRESS_INTERVAL = 0.5
+
+# Child processes: output is read in chunks of this size, lines longer than
+# this are split, a download with no output for this many seconds counts as
+# stalled, and a stopped process tree gets this many seconds to exit before
+# it is killed
+READ_CHUNK_SIZE = 64 * 1024
+MAX_LINE_LENGTH = 64 * 1024
+PROCESS_IDLE_TIMEOUT = 15 * 60
+KILL_GRACE_PERIOD = 5
+
+# Seconds the window waits, when it is closed, for the running downloads
+# and merges to stop
+SHUTDOWN_TIMEOUT = 5
+
+# Daemon mode: the HTTP API only listens on this machine by default. Requests
+# that change anything must carry the token from DAEMON_TOKEN_FILE in the
+# config directory, so web pages cannot send them
+DEFAULT_DAEMON_HOST = "127.0.0.1"
+DEFAULT_DAEMON_PORT = 8765
+DAEMON_TOKEN_FILE = "daemon-token"
+# Largest request body the daemon accepts, longest request or header line,
+# and most header lines
+MAX_REQUEST_BODY = 1024 * 1024
+MAX_REQUEST_LINE = 8 * 1024
+MAX_REQUEST_HEADERS = 100
+# Event stream subscribers this many bytes behind are disconnected; they
+# get a fresh snapshot when they reconnect
+MAX_SUBSCRIBER_BACKLOG = 1024 * 1024
+# Seconds between keep-alive comments on an idle event stream
+EVENT_KEEPALIVE = 15
+# Seconds a daemon client waits before reconnecting to the event stream
+DAEMON_RECONNECT_DELAY = 2
+
+# Metadata cache: entries expire after a week, and only the most recently
+# used ones are kept
+DEFAULT_CACHE_TTL = 7 * 24 * 60 * 60
+DEFAULT_CACHE_SIZE = 1000
+
+# A pasted URL is looked up this many milliseconds after the entry last
+# changed. What yt-dlp extracted for it is reused by a download started
+# within PREFETCH_TTL seconds; YouTube's stream URLs expire after a few hours
+PREFETCH_DELAY = 400
+PREFETCH_TTL = 30 * 60
+
+# With a scratch directory, each download is written to a directory of its
+# own in it (named after the job's key) and moved to the save directory once
+# complete. Directories of jobs no longer known are removed once nothing in
+# them has changed for SCRATCH_MAX_AGE seconds
+SCRATCH_MAX_AGE = 24 * 60 * 60
+# A download starts only if the disks it is written to have its expected
+# size free (twice that where streams are merged), plus this much
+DISK_SPACE_MARGIN = 64 * 1024 * 1024
+
+# Output of yt-dlp and ffmpeg, progress lines aside: each line is cut to
+# OUTPUT_LINE_LENGTH characters, each job keeps its last JOB_OUTPUT_LINES
+# lines and the log window the last OUTPUT_LOG_LINES of all jobs. A finished
+# job keeps only its last JOB_OUTPUT_TAIL lines, and only if it failed or was
+# cancelled. All of it also goes to a log file in the config directory, which
+# is rotated at LOG_FILE_SIZE bytes with LOG_FILE_BACKUPS old files kept
+OUTPUT_LINE_LENGTH = 500
+JOB_OUTPUT_LINES = 200
+JOB_OUTPUT_TAIL = 20
+OUTPUT_LOG_LINES = 5000
+LOG_FILE_SIZE = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
+def load_tk():
+    """Import tkinter on first use"""
+    global tk, ttk, tkfont, filedialog, messagebox
+    if tk is None:
+        import tkinter
+        from tkinter import ttk as _ttk, font as _font, filedialog as _filedialog, messagebox as _messagebox
+        tk, ttk, tkfont, filedialog, messagebox = tkinter, _ttk, _font, _filedialog, _messagebox
+
+def get_config_dir():
+    """Return the per-user directory for the downloader's own files.
+
+    The YTDL_CONFIG_DIR environment variable overrides the default location.
+    """
+    override = os.environ.get("YTDL_CONFIG_DIR")
+    if override:
+        return override
+    if sys.platform == "win32":
+        base = os.environ.get("APPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, "youtube-downloader")
+
+def find_yt_dlp():
+    """Return the path to the yt-dlp executable next to this script.
+
+    The YT_DLP_PATH environment variable overrides the default location.
+    """
+    override = os.environ.get("YT_DLP_PATH")
+    if override:
+        return override
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(script_dir, "yt-dlp.exe")
+
+def find_ffmpeg():
+    """Return the path to the ffmpeg executable, or None if there is none.
+
+    The FFMPEG_PATH environment variable overrides the search; otherwise
+    ffmpeg.exe next to this script is used, then ffmpeg on the PATH.
+    """
+    override = os.environ.get("FFMPEG_PATH")
+    if override:
+        return override
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    local = os.path.join(script_dir, "ffmpeg.exe")
+    if os.path.exists(local):
+        return local
+    return shutil.which("ffmpeg")
+
+# Progress fields yt-dlp reports through --progress-template
+PROGRESS_FIELDS = (
+    "status,downloaded_bytes,total_bytes,total_bytes_estimate,speed,eta,fragment_index,fragment_count"
+)
+
+def build_download_command(yt_dlp_path, url, save_dir, progress_template=True,
+                           download_archive=None, rate_limit=None, separate_streams=False,
+                           info_json=None, format_spec=None, concurrent_fragments=None,
+                           temp_dir=None):
+    """Build the single yt-dlp invocation used for a download.
+
+    Besides downloading, yt-dlp reports the video info before the download
+    starts, marks the start of post-processing and reports the final file
+    path once it has been moved into place. Each of these is a JSON value on
+    a line starting with PRINT_MARKER (see parse_print_line).
+
+    With progress_template, download and post-processing progress come as
+    JSON lines too (see parse_progress_line). Builds of yt-dlp that predate
+    --progress-template need it turned off.
+
+    download_archive is passed on as yt-dlp's --download-archive file, and
+    rate_limit (bytes per second) as --limit-rate.
+
+    With separate_streams, the best video and the best audio stream are
+    downloaded one after the other as "<title>.f<format id>.<ext>" and
+    yt-dlp does not merge them; that is left to the post-processing stage
+    (see build_merge_command), so the download slot is free sooner.
+
+    With info_json, yt-dlp loads the video info a prefetch saved to that
+    file (--load-info-json) instead of extracting url's page again.
+
+    format_spec is passed on as -f (see plan_formats and format_selector);
+    with separate_streams it must list the streams separated by commas.
+    concurrent_fragments, if given, is yt-dlp's -N.
+
+    With temp_dir, yt-dlp keeps .part files, fragments and other
+    intermediate files there (-P temp:) until they are complete.
+    """
+    if separate_streams:
+        output_template = "%(title)s.f%(format_id)s.%(ext)s"
+    else:
+        output_template = "%(title)s.%(ext)s"
+    if temp_dir:
+        # yt-dlp only applies its temp path to a relative output template
+        paths = ["-P", f"home:{save_dir}", "-P", f"temp:{temp_dir}"]
+    else:
+        paths = []
+        output_template = os.path.join(save_dir, output_template)
+    cmd = [yt_dlp_path] + (["--load-info-json", info_json] if info_json else [url]) + paths + [
+        "-o", output_template,
+        "--newline",  # Force newline output for progress parsing
+        "--continue",  # Resume from .part files left by an interrupted run
+        "--progress",  # Show progress (--print would otherwise silence it)
+        "--print", f"before_dl:{PRINT_MARKER} info %(.{{id,title,duration,format_id}})j",
+        "--print", f"post_process:{PRINT_MARKER} postprocess %(id)j",
+        "--print", f"after_move:{PRINT_MARKER} filepath %(filepath)j",
+    ]
+    if format_spec:
+        cmd += ["-f", format_spec]
+    elif separate_streams:
+        # The best video-only and audio-only streams, each in a file of its own.
+        # bv* could pick a format that has audio too, which would then be
+        # downloaded twice; the "/b" belongs to the audio selector, so a video
+        # without separate streams comes as one file
+        cmd += ["-f", "bv,ba/b"]
+    if download_archive:
+        cmd += ["--download-archive", download_archive]
+    if rate_limit:
+        cmd += ["--limit-rate", str(int(rate_limit))]
+    if concurrent_fragments:
+        cmd += ["-N", str(concurrent_fragments)]
+    if progress_template:
+        cmd += [
+            "--progress-template",
+            f"download:{PRINT_MARKER} progress %(progress.{{{PROGRESS_FIELDS}}})j",
+            "--progress-template",
+            f"postprocess:{PRINT_MARKER} postprocessor %(progress.{{status,postprocessor}})j",
+        ]
+    return cmd
+
+def parse_print_line(line):
+    """Parse a line produced by one of our --print templates.
+
+    Returns a (kind, value) tuple, or None for any other output line.
+    """
+    if not line.startswith(PRINT_MARKER + " "):
+        return None
+    parts = line.split(" ", 2)
+    if len(parts) != 3:
+        return None
+    try:
+        return parts[1], json.loads(parts[2])
+    except ValueError:
+        return None
+
+# Format ID suffix of a stream downloaded with separate_streams
+STREAM_FILE_RE = re.compile(r'\.f[^.]+\.[^.]+$')
+# Lines of ffmpeg's -progress output
+MERGE_PROGRESS_RE = re.compile(r'^[a-z0-9_]+=')
+
+def merged_output_path(stream_files, container=None):
+    """Final path of the streams a download with separate_streams left behind.
+
+    "<title>.f137.mp4" and "<title>.f140.m4a" become "<title>.mp4". Unless
+    a container is given (see FormatPlan), it is chosen like yt-dlp's own
+    merger does: mp4 for MP4 video and M4A audio, webm if all streams are
+    WebM and mkv otherwise.
+    """
+    first = stream_files[0]
+    base = STREAM_FILE_RE.sub("", first)
+    if base == first:
+        base = os.path.splitext(first)[0]
+    exts = {os.path.splitext(path)[1][1:].lower() for path in stream_files}
+    if container:
+        ext = container
+    elif len(stream_files) == 1:
+        ext = exts.pop()
+    elif exts <= {"mp4", "m4a"}:
+        ext = "mp4"
+    elif exts == {"webm"}:
+        ext = "webm"
+    else:
+        ext = "mkv"
+    return f"{base}.{ext}"
+
+def link_unused_name(path, directory, name):
+    """Give the file at path the name name in directory, or "name (1).ext" and so on if that is taken.
+
+    The new name is a hard link, which cannot replace an existing file;
+    path itself is removed once it is made. Where hard links are not
+    supported the file is renamed to the first name that does not exist.
+    Raises OSError with errno EXDEV if directory is on another disk.
+    Returns the new path.
+    """
+    stem, ext = os.path.splitext(name)
+    number = 0
+    while True:
+        target = os.path.join(directory, f"{stem} ({number}){ext}" if number else name)
+        try:
+            os.link(path, target)
+        except FileExistsError:
+            number += 1
+            continue
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                raise
+            if os.path.lexists(target):
+                number += 1
+                continue
+            os.replace(path, target)
+            return target
+        os.remove(path)
+        return target
+
+def move_into_place(path, directory, name=None):
+    """Move a finished file into directory, where it appears complete or not at all.
+
+    The file is named name there, or keeps its own name without one. On
+    the same disk this is a rename. Across disks the file is copied to a
+    hidden temporary name in directory first and renamed once complete.
+    An existing file of the same name is kept and the file gets the next
+    free name, "name (1).ext" and so on. Returns the new path.
+    """
+    name = name or os.path.basename(path)
+    try:
+        return link_unused_name(path, directory, name)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    # A name of its own, as downloads with the same title may finish together
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        shutil.copyfile(path, temp_path)
+        # mkstemp makes the file readable by its owner only
+        shutil.copymode(path, temp_path)
+        target = link_unused_name(temp_path, directory, name)
+    finally:
+        # Already gone once it has its name
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+    os.remove(path)
+    return target
+
+def clean_scratch_dir(scratch_dir, keep=(), max_age=SCRATCH_MAX_AGE):
+    """Remove the job directories in scratch_dir not named in keep that have not changed for max_age seconds.
+
+    Returns the number removed.
+    """
+    try:
+        names = os.listdir(scratch_dir)
+    except OSError:
+        return 0
+    now = time.time()
+    removed = 0
+    for name in names:
+        path = os.path.join(scratch_dir, name)
+        if name in keep or not os.path.isdir(path):
+            continue
+        try:
+            changed = max([os.path.getmtime(os.path.join(root, entry))
+                           for root, dirs, files in os.walk(path) for entry in dirs + files]
+                          + [os.path.getmtime(path)])
+        except OSError:
+            continue
+        if now - changed >= max_age:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+def open_log_file(name):
+    """Also write the log, and the output of the downloads, to the file name in the config directory.
+
+    The file is rotated at LOG_FILE_SIZE bytes; returns its path, or None
+    if it cannot be written.
+    """
+    path = os.path.join(get_config_dir(), name)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=LOG_FILE_SIZE, backupCount=LOG_FILE_BACKUPS, encoding="utf-8", delay=True)
+    except OSError:
+        return None
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    log.addHandler(handler)
+    log.setLevel(logging.DEBUG)
+    return path
+
+def build_merge_command(ffmpeg_path, stream_files, output, transcode=()):
+    """Build the ffmpeg invocation that merges separately downloaded streams.
+
+    The video of the first file and the audio of the others are copied into
+    output without re-encoding; a single file is copied whole, into the
+    container of output. Only the kinds of stream in transcode ("v", "a")
+    are encoded anew, with the TRANSCODE_CODECS for output's container.
+    Progress is written to stdout as key=value lines (see
+    parse_merge_progress).
+    """
+    cmd = [ffmpeg_path, "-hide_banner", "-nostdin", "-loglevel", "error", "-y"]
+    for path in stream_files:
+        cmd += ["-i", path]
+    if len(stream_files) == 1:
+        cmd += ["-map", "0"]
+    else:
+        cmd += ["-map", "0:v:0"]
+        for index in range(1, len(stream_files)):
+            cmd += ["-map", f"{index}:a:0"]
+    cmd += ["-c", "copy"]
+    container = os.path.splitext(output)[1][1:].lower()
+    for kind in transcode:
+        cmd += [f"-c:{kind}"] + TRANSCODE_CODECS[kind, container]
+    cmd += ["-progress", "pipe:1", "-nostats", output]
+    return cmd
+
+# Codecs each container holds as they are, by prefix of yt-dlp's vcodec and
+# acodec, most widely playable first; None holds anything
+CONTAINER_CODECS = {
+    "mp4": ("avc1", "avc3", "hvc1", "hev1", "av01", "mp4a"),
+    "m4a": ("mp4a",),
+    "webm": ("vp9", "vp09", "vp8", "av01", "opus", "vorbis"),
+    "mkv": None,
+}
+# ffmpeg encoders for a stream that does not fit its container
+TRANSCODE_CODECS = {
+    ("v", "mp4"): ["libx264", "-preset", "veryfast", "-crf", "20"],
+    ("v", "webm"): ["libvpx-vp9", "-b:v", "0", "-crf", "32", "-row-mt", "1"],
+    ("a", "mp4"): ["aac", "-b:a", "192k"],
+    ("a", "m4a"): ["aac", "-b:a", "192k"],
+    ("a", "webm"): ["libopus", "-b:a", "160k"],
+}
+
+# A preset limits the formats a download may use: the height of the video,
+# the total bitrate (kbit/s, as yt-dlp's tbr), the estimated total size in
+# bytes, audio only, and the container of the file (None: whichever holds
+# the streams without re-encoding)
+FormatPreset = namedtuple("FormatPreset", "label max_height max_tbr max_filesize audio_only container")
+FORMAT_PRESETS = {
+    "best": FormatPreset("Best quality", None, None, None, False, None),
+    "1080p": FormatPreset("Up to 1080p (MP4)", 1080, None, None, False, "mp4"),
+    "720p": FormatPreset("Up to 720p (MP4)", 720, None, None, False, "mp4"),
+    "480p": FormatPreset("Up to 480p (MP4)", 480, None, None, False, "mp4"),
+    "small": FormatPreset("Under 100 MB", None, None, 100 * 1024 ** 2, False, None),
+    "saver": FormatPreset("Data saver (1 Mbit/s)", None, 1000, None, False, None),
+    "audio": FormatPreset("Audio only (M4A)", None, None, None, True, "m4a"),
+}
+DEFAULT_FORMAT_PRESET = "best"
+
+class FormatPlan(namedtuple("FormatPlan", "format_ids height vcodec acodec tbr size container "
+                                          "postprocess transcode")):
+    """The formats a download uses and what becomes of them afterwards.
+
+    postprocess is "none" when the downloaded file is kept as it is,
+    "remux" when ffmpeg only copies the streams into the container, and
+    "transcode" when the streams in transcode ("v", "a") must be encoded
+    anew to fit it. size is the estimated total in bytes, or None.
+    """
+    __slots__ = ()
+
+def codec_fits(codec, container):
+    """True if a stream with yt-dlp's codec name can be copied into container"""
+    allowed = CONTAINER_CODECS.get(container)
+    return not codec or codec == "none" or allowed is None or codec.startswith(allowed)
+
+def estimate_format_size(fmt, duration):
+    """A format's size in bytes, from its bitrate if yt-dlp gives no size; None if unknown"""
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if not size and fmt.get("tbr") and duration:
+        size = int(fmt["tbr"] * 1000 / 8 * duration)
+    return size
+
+def plan_streams(streams, container=None, duration=None):
+    """The FormatPlan for downloading the formats streams (video first) into container"""
+    video = next((fmt for fmt in streams if fmt.get("vcodec") not in (None, "none")), None)
+    audio = next((fmt for fmt in reversed(streams) if fmt.get("acodec") not in (None, "none")), None)
+    vcodec = video.get("vcodec") if video else None
+    acodec = audio.get("acodec") if audio else None
+    if container is None:
+        if len(streams) == 1:
+            container = streams[0].get("ext")
+        else:
+            container = next((name for name in ("mp4", "webm")
+                              if codec_fits(vcodec, name) and codec_fits(acodec, name)), "mkv")
+    transcode = tuple(kind for kind, codec in (("v", vcodec), ("a", acodec))
+                      if not codec_fits(codec, container))
+    if transcode:
+        postprocess = "transcode"
+    elif len(streams) > 1 or streams[0].get("ext") != container:
+        postprocess = "remux"
+    else:
+        postprocess = "none"
+    sizes = [estimate_format_size(fmt, duration) for fmt in streams]
+    tbrs = [fmt.get("tbr") for fmt in streams]
+    return FormatPlan(
+        format_ids=[fmt["format_id"] for fmt in streams],
+        height=video.get("height") if video else None,
+        vcodec=vcodec,
+        acodec=acodec,
+        tbr=sum(tbrs) if all(tbrs) else None,
+        size=sum(sizes) if all(sizes) else None,
+        container=container,
+        postprocess=postprocess,
+        transcode=transcode,
+    )
+
+def plan_formats(formats, preset, duration=None, can_merge=True):
+    """Pick the formats for a download from yt-dlp's format list; None if none fit the preset.
+
+    Of the combinations within the preset's limits, those that need no
+    re-encoding come first, then the highest resolution and frame rate,
+    the best audio, the most widely playable codec for the preset's
+    container, and finally the smallest download. Without can_merge
+    (no ffmpeg), only formats that hold video and audio together are used,
+    and are kept in the container they come in.
+    """
+    def has(fmt, kind):
+        return fmt.get(kind) not in (None, "none")
+
+    audios = [fmt for fmt in formats if has(fmt, "acodec") and not has(fmt, "vcodec")]
+    if preset.audio_only:
+        combinations = [[fmt] for fmt in audios]
+    else:
+        combinations = [[fmt] for fmt in formats if has(fmt, "vcodec") and has(fmt, "acodec")]
+        if can_merge:
+            videos = [fmt for fmt in formats if has(fmt, "vcodec") and not has(fmt, "acodec")]
+            combinations += [[video, audio] for video in videos for audio in audios]
+
+    def fits(plan):
+        if preset.max_height and (plan.height is None or plan.height > preset.max_height):
+            return False
+        if preset.max_tbr and (plan.tbr is None or plan.tbr > preset.max_tbr):
+            return False
+        return not preset.max_filesize or (plan.size is not None and plan.size <= preset.max_filesize)
+
+    def rank(candidate):
+        streams, plan = candidate
+        preferred = CONTAINER_CODECS.get(preset.container) or ()
+        codec = plan.vcodec or plan.acodec or ""
+        playable = next((i for i, prefix in enumerate(preferred) if codec.startswith(prefix)),
+                        len(preferred))
+        return (
+            plan.postprocess != "transcode",
+            plan.height or 0,
+            max(fmt.get("fps") or 0 for fmt in streams),
+            max(fmt.get("abr") or 0 for fmt in streams),
+            -playable,
+            -(plan.size or plan.tbr or 0),
+        )
+
+    container = preset.container if can_merge else None
+    candidates = [(streams, plan_streams(streams, container, duration))
+                  for streams in combinations]
+    candidates = [candidate for candidate in candidates if fits(candidate[1])]
+    if not candidates:
+        return None
+    return max(candidates, key=rank)[1]
+
+def format_selector(preset, separate_streams):
+    """yt-dlp's -f for a preset, for when the format list is not known before the download.
+
+    Returns None for yt-dlp's own choice. Limits that yt-dlp cannot check
+    for a format pass it. With separate_streams the video comes from the
+    video-only formats, so the audio is not downloaded twice; a video that
+    has no separate streams comes as one file.
+    """
+    limits = ""
+    if preset.max_height:
+        limits += f"[height<=?{preset.max_height}]"
+    if preset.max_tbr:
+        limits += f"[tbr<=?{preset.max_tbr}]"
+    if preset.max_filesize:
+        limits += f"[filesize<=?{preset.max_filesize}]"
+    if preset.audio_only:
+        return "ba[acodec^=mp4a]/ba" if preset.container in ("m4a", "mp4") else "ba"
+    if not separate_streams:
+        if preset.container:
+            return f"b{limits}[ext={preset.container}]/b{limits}/b"
+        return f"b{limits}/b" if limits else None
+    video, audio = f"bv{limits}", "ba"
+    if preset.container:
+        # Streams that fit the container come first, so they need no re-encoding
+        codecs = CONTAINER_CODECS.get(preset.container) or ()
+        video = "/".join([f"{video}[vcodec^={codec}]" for codec in codecs[:1]] + [video])
+        audio = "/".join([f"ba[acodec^={codec}]" for codec in codecs if codec in ("mp4a", "opus")]
+                         + [audio])
+    if limits:
+        # A video over the limits rather than none at all, as b{limits}/b does
+        video += "/bv"
+    return f"{video},{audio}/b{limits}/b"
+
+def describe_plan(plan):
+    """E.g. "720p avc1 + mp4a in MP4, about 45.2MiB - remux, no re-encoding" """
+    quality = f"{plan.height}p" if plan.height else "Audio"
+    codecs = " + ".join(codec.split(".")[0] for codec in (plan.vcodec, plan.acodec) if codec)
+    text = f"{quality} {codecs} in {plan.container.upper()}"
+    if plan.size:
+        text += f", about {format_size(plan.size)}"
+    if plan.postprocess == "transcode":
+        kinds = " and ".join("video" if kind == "v" else "audio" for kind in plan.transcode)
+        return text + f" - converted, re-encodes the {kinds}"
+    if plan.postprocess == "remux":
+        return text + " - remux, no re-encoding"
+    return text + " - no post-processing"
+
+def parse_merge_progress(line, duration):
+    """Percentage done from a line of ffmpeg's -progress output, or None"""
+    key, _, value = line.partition("=")
+    if key == "progress" and value == "end":
+        return 100.0
+    if key != "out_time_us" or not duration:
+        return None
+    try:
+        return max(0.0, min(100.0, int(value) / 10000 / duration))
+    except ValueError:
+        return None
+
+VIDEO_URL_RE = re.compile(
+    r'(?:https?://)?(?:www\.)?(?:youtube\.com/watch\?v=|youtu\.be/)([a-zA-Z0-9_-]{11})')
+PLAYLIST_URL_RE = re.compile(r'(?:https?://)?(?:www\.)?youtube\.com/playlist\?list=([a-zA-Z0-9_-]+)')
+
+def validate_url(url):
+    """Basic URL validation"""
+    return bool(VIDEO_URL_RE.search(url) or PLAYLIST_URL_RE.search(url))
+
+def get_video_id(url):
+    """Return the 11 character video ID of a video URL, or None"""
+    match = VIDEO_URL_RE.search(url)
+    return match.group(1) if match else None
+
+def get_playlist_id(url):
+    """Return the list ID of a playlist URL, or None for anything else"""
+    match = PLAYLIST_URL_RE.search(url)
+    return match.group(1) if match else None
+
+def metadata_key(url):
+    """Cache key for a URL: "playlist:<list ID>" or "video:<video ID>" """
+    playlist_id = get_playlist_id(url)
+    if playlist_id:
+        return "playlist:" + playlist_id
+    video_id = get_video_id(url)
+    return "video:" + video_id if video_id else None
+
+def build_playlist_command(yt_dlp_path, url):
+    """Build the yt-dlp invocation that lists a playlist's entries.
+
+    Flat extraction only reads the playlist page itself, so this is a single
+    quick request however long the playlist is.
+    """
+    return [yt_dlp_path, url, "--flat-playlist", "--dump-single-json", "--no-warnings"]
+
+def build_metadata_command(yt_dlp_path, url):
+    """Build the yt-dlp invocation that extracts a video's metadata without downloading it"""
+    return [yt_dlp_path, url, "--dump-single-json", "--no-playlist", "--no-warnings"]
+
+# Format fields kept in the metadata cache
+FORMAT_FIELDS = (
+    "format_id", "ext", "vcodec", "acodec", "width", "height", "fps", "tbr", "vbr", "abr",
+    "filesize", "filesize_approx", "protocol", "format_note",
+)
+
+def summarize_info(info):
+    """Reduce yt-dlp's info JSON to what the metadata cache keeps"""
+    if info.get("_type") == "playlist":
+        entries = []
+        for entry in info.get("entries") or []:
+            if entry and entry.get("id"):
+                entries.append({
+                    "id": entry["id"],
+                    "url": entry.get("url") or f"https://www.youtube.com/watch?v={entry['id']}",
+                    "title": entry.get("title"),
+                    "duration": entry.get("duration"),
+                })
+        return {"id": info.get("id"), "title": info.get("title"), "entries": entries}
+
+    formats = [{field: fmt.get(field) for field in FORMAT_FIELDS if fmt.get(field) is not None}
+               for fmt in info.get("formats") or []]
+    # Size of what yt-dlp would pick by default
+    selected = info.get("requested_formats") or [info]
+    sizes = [fmt.get("filesize") or fmt.get("filesize_approx") for fmt in selected]
+    return {
+        "id": info.get("id"),
+        "title": info.get("title"),
+        "duration": info.get("duration"),
+        "formats": formats,
+        "filesize": sum(sizes) if sizes and all(sizes) else None,
+    }
+
+class MetadataCache:
+    """On-disk SQLite cache of video and playlist metadata, keyed by ID.
+
+    Keys come from metadata_key. Entries expire ttl seconds after they were
+    fetched, and once there are more than max_entries the least recently used
+    ones are evicted. Safe to use from several threads.
+    """
+    
+    def __init__(self, path, ttl=DEFAULT_CACHE_TTL, max_entries=DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                "key TEXT PRIMARY KEY, data TEXT NOT NULL,"
+                "fetched_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS metadata_accessed ON metadata (accessed_at)")
+    
+    def get(self, key):
+        """Return the cached metadata dict for key, or None if missing or expired"""
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT data, fetched_at FROM metadata WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM metadata WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE metadata SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+    
+    def put(self, key, metadata, replace=False):
+        """Store metadata for key.
+
+        Unless replace is set, cached fields that metadata leaves out (or sets
+        to None) are kept.
+        """
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute("SELECT data FROM metadata WHERE key = ?", (key,)).fetchone()
+            if row is not None and not replace:
+                merged = json.loads(row[0])
+                merged.update((k, v) for k, v in metadata.items() if v is not None)
+                metadata = merged
+            self._db.execute(
+                "INSERT OR REPLACE INTO metadata (key, data, fetched_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(metadata), now, now)
+            )
+            self._db.execute(
+                "DELETE FROM metadata WHERE key IN "
+                "(SELECT key FROM metadata ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+    
+    def titles(self):
+        """Map normalize_title(title) -> video ID for all cached videos"""
+        with self._lock:
+            rows = self._db.execute("SELECT key, data FROM metadata WHERE key LIKE 'video:%'").fetchall()
+        titles = {}
+        for key, data in rows:
+            title = json.loads(data).get("title")
+            if title:
+                titles[normalize_title(title)] = key[len("video:"):]
+        return titles
+    
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def open_metadata_cache():
+    """Open the metadata cache in the config directory, or return None if that fails"""
+    try:
+        return MetadataCache(os.path.join(get_config_dir(), "metadata.sqlite3"))
+    except (OSError, sqlite3.Error):
+        return None
+
+# File extensions considered when importing an existing library
+MEDIA_EXTENSIONS = (
+    ".mp4", ".mkv", ".webm", ".mov", ".avi", ".flv",
+    ".m4a", ".mp3", ".opus", ".ogg", ".aac", ".flac", ".wav",
+)
+
+# yt-dlp's "%(title)s [%(id)s].%(ext)s" style file names
+FILENAME_ID_RE = re.compile(r'\[([a-zA-Z0-9_-]{11})\]')
+
+def normalize_title(title):
+    """Reduce a title to lower-case letters and digits.
+
+    yt-dlp replaces characters that aren't allowed in file names, so titles
+    and file names are compared in this form.
+    """
+    return "".join(ch for ch in title.lower() if ch.isalnum())
+
+class DownloadArchive:
+    """Index of finished downloads: video ID -> final path, size, format and completion time.
+
+    Stored in SQLite next to the metadata cache. A video only counts as
+    downloaded while its file still exists, so deleting the file is enough
+    to download it again.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS downloads ("
+                "video_id TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER,"
+                "format TEXT, completed_at REAL NOT NULL)"
+            )
+    
+    def get(self, video_id):
+        """Return the record for a downloaded video whose file still exists, or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT path, size, format, completed_at FROM downloads WHERE video_id = ?",
+                (video_id,)
+            ).fetchone()
+        if row is None or not os.path.isfile(row[0]):
+            return None
+        return {"video_id": video_id, "path": row[0], "size": row[1], "format": row[2],
+                "completed_at": row[3]}
+    
+    def add(self, video_id, path, format_id=None, completed_at=None):
+        """Record a finished download"""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = None
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO downloads (video_id, path, size, format, completed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (video_id, path, size, format_id, completed_at or time.time())
+            )
+    
+    def write_yt_dlp_archive(self, path):
+        """Write the IDs in the format of yt-dlp's --download-archive file and return path.
+
+        Running yt-dlp processes may be reading or appending to the file, so
+        it is written under a temporary name and then replaced whole; what
+        they append is in the database by the time the file is written again.
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT video_id, path FROM downloads").fetchall()
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or None,
+                                         prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with open(fd, "w", encoding="utf-8") as f:
+                for video_id, file_path in rows:
+                    if os.path.isfile(file_path):
+                        f.write(f"youtube {video_id}\n")
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        return path
+    
+    def import_folder(self, folder, cache=None):
+        """Record the videos already present in a library folder; returns how many were added.
+
+        IDs come from "[<id>]" in the file name or a matching .info.json file
+        written by yt-dlp, or else from a title in the metadata cache that
+        matches the file name.
+        """
+        titles = cache.titles() if cache is not None else {}
+        found = {}
+        for directory, _, files in os.walk(folder):
+            names = set(files)
+            for name in files:
+                stem, ext = os.path.splitext(name)
+                if ext.lower() not in MEDIA_EXTENSIONS:
+                    continue
+                video_id = None
+                match = FILENAME_ID_RE.search(stem)
+                if match:
+                    video_id = match.group(1)
+                elif stem + ".info.json" in names:
+                    try:
+                        with open(os.path.join(directory, stem + ".info.json"), encoding="utf-8") as f:
+                            video_id = json.load(f).get("id")
+                    except (OSError, ValueError):
+                        pass
+                if not video_id:
+                    video_id = titles.get(normalize_title(stem))
+                if video_id:
+                    found[video_id] = os.path.join(directory, name)
+        
+        added = 0
+        for video_id, path in found.items():
+            if self.get(video_id) is None:
+                self.add(video_id, path, completed_at=os.path.getmtime(path))
+                added += 1
+        return added
+    
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def open_download_archive():
+    """Open the download archive in the config directory, or return None if that fails"""
+    try:
+        return DownloadArchive(os.path.join(get_config_dir(), "archive.sqlite3"))
+    except (OSError, sqlite3.Error):
+        return None
+
+# The job journal is rewritten once it has this many more lines than live entries
+JOURNAL_COMPACT_LINES = 1000
+
+# Job metrics: percentiles cover the last METRICS_WINDOW finished jobs, jobs
+# per minute the last METRICS_RATE_WINDOW seconds. Each job samples yt-dlp's
+# reported speed at most once per SPEED_SAMPLE_INTERVAL seconds and keeps
+# the last SPEED_SAMPLES samples
+METRICS_WINDOW = 1000
+METRICS_RATE_WINDOW = 10 * 60
+SPEED_SAMPLE_INTERVAL = 1
+SPEED_SAMPLES = 600
+
+# What a job's time is spent on: resolving the URL and preparing the
+# download, yt-dlp's extraction until the download starts, the transfer,
+# post-processing (yt-dlp's own and the merge stage), and moving the file
+# into place
+JOB_PHASES = ("resolve", "extract", "download", "postprocess", "move")
+
+class JobJournal:
+    """Append-only record of the download queue, used to resume it after a crash or restart.
+
+    Each change to a job or playlist appends one JSON line with its full
+    record, keyed by an ID that survives restarts, so replaying the file
+    keeps the last line per key; a "forget" line drops the entry. The file
+    is compacted to one line per entry when opened, which also gets rid of
+    a line torn by a crash, and again whenever it has grown by
+    compact_after lines. Finished downloads are left out when compacting,
+    as the download archive already remembers them.
+
+    write and forget only queue the line: a thread of its own appends the
+    queued lines and fsyncs once for all of them, so callers such as the
+    supervisor's loop never wait for the disk. close writes what is left.
+    """
+    
+    def __init__(self, path, compact_after=JOURNAL_COMPACT_LINES):
+        self.path = path
+        self.compact_after = compact_after
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Signals the writer thread that there are lines to write or the journal is closing
+        self._changed = threading.Condition(self._lock)
+        self._records = {}
+        self._queue = []
+        self._closing = False
+        self._lines = 0
+        self._file = None
+        self._load()
+        self._compact()
+        self._writer = threading.Thread(target=self._write_queued, daemon=True)
+        self._writer.start()
+    
+    def _load(self):
+        try:
+            f = open(self.path, encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("type") == "forget":
+                    self._records.pop(record["key"], None)
+                else:
+                    self._records[record["key"]] = record
+    
+    def records(self):
+        """The last record of every entry, in the order the entries were added"""
+        with self._lock:
+            return list(self._records.values())
+    
+    def write(self, record):
+        """Append a record unless it is the same as the entry's last one"""
+        with self._lock:
+            if self._records.get(record["key"]) == record:
+                return
+            self._records[record["key"]] = record
+            self._queue.append(json.dumps(record) + "\n")
+            self._changed.notify()
+    
+    def forget(self, key):
+        with self._lock:
+            if self._records.pop(key, None) is not None:
+                self._queue.append(json.dumps({"type": "forget", "key": key}) + "\n")
+                self._changed.notify()
+    
+    def _write_queued(self):
+        """Append the queued lines until the journal is closed; runs on the writer thread"""
+        while True:
+            with self._lock:
+                while not self._queue and not self._closing:
+                    self._changed.wait()
+                lines = self._queue
+                self._queue = []
+                compact = self._lines + len(lines) >= len(self._records) + self.compact_after
+            if not lines:
+                return
+            try:
+                self._file.write("".join(lines))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._lines += len(lines)
+                if compact:
+                    self._compact()
+            except OSError as e:
+                log.warning("Could not write the job journal %s: %s", self.path, e)
+    
+    def _compact(self):
+        """Rewrite the file with one line per live entry"""
+        with self._lock:
+            jobs = {key for key, record in self._records.items()
+                    if record["type"] == "job" and record["state"] != JOB_DONE}
+            playlists = {self._records[key]["playlist"] for key in jobs}
+            self._records = {
+                key: record for key, record in self._records.items()
+                if key in jobs or (record["type"] == "playlist"
+                                   and (record["expanding"] or key in playlists))
+            }
+            lines = [json.dumps(record) + "\n" for record in self._records.values()]
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is not None:
+            self._file.close()
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._lines = len(lines)
+    
+    def close(self):
+        """Write the queued lines and close the file"""
+        with self._lock:
+            self._closing = True
+            self._changed.notify()
+        self._writer.join()
+        self._file.close()
+
+def open_job_journal(name="journal.jsonl"):
+    """Open a job journal in the config directory, or return None if that fails"""
+    try:
+        return JobJournal(os.path.join(get_config_dir(), name))
+    except OSError:
+        return None
+
+def percentile(values, fraction):
+    """The value below which the given fraction of values lie, or None if there are none"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+class JobMetrics:
+    """Phase timings, throughput and outcomes of finished jobs.
+
+    Totals count every job since the start; percentiles are taken over the
+    last METRICS_WINDOW jobs. With a path, save() writes the metrics to
+    "<path>.json" and, in Prometheus' text format, to "<path>.prom".
+    """
+    
+    def __init__(self, path=None, window=METRICS_WINDOW):
+        self.path = path
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self.outcomes = {JOB_DONE: 0, "skipped": 0, JOB_FAILED: 0, JOB_CANCELLED: 0}
+        self.phase_totals = {phase: [0, 0.0] for phase in JOB_PHASES}
+        self._phases = {phase: deque(maxlen=window) for phase in JOB_PHASES}
+        self._speeds = deque(maxlen=window)
+        self._completed_at = deque()
+        self.downloaded_bytes = 0
+        self.download_seconds = 0.0
+        self.throttle_restarts = 0
+    
+    def record(self, job):
+        """Add a job that has finished"""
+        outcome = "skipped" if job.already_downloaded and job.state == JOB_DONE else job.state
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            self.throttle_restarts += len(job.throttle_restarts)
+            for phase, seconds in job.phase_times.items():
+                self._phases[phase].append(seconds)
+                self.phase_totals[phase][0] += 1
+                self.phase_totals[phase][1] += seconds
+            if outcome == JOB_DONE:
+                self.downloaded_bytes += job.downloaded_bytes
+                self.download_seconds += job.phase_times.get("download", 0.0)
+                if job.speed_samples:
+                    self._speeds.append(sum(speed for _, speed in job.speed_samples)
+                                        / len(job.speed_samples))
+                self._completed_at.append(time.monotonic())
+    
+    def snapshot(self):
+        """The metrics as a JSON-friendly dict"""
+        now = time.monotonic()
+        with self._lock:
+            while self._completed_at and now - self._completed_at[0] > METRICS_RATE_WINDOW:
+                self._completed_at.popleft()
+            minutes = max(1.0, min(METRICS_RATE_WINDOW, now - self.started)) / 60
+            phases = {}
+            for phase in JOB_PHASES:
+                count, total = self.phase_totals[phase]
+                recent = list(self._phases[phase])
+                phases[phase] = {"count": count, "total": total,
+                                 "p50": percentile(recent, 0.5), "p95": percentile(recent, 0.95)}
+            speeds = list(self._speeds)
+            return {
+                "uptime": now - self.started,
+                "jobs": dict(self.outcomes),
+                "jobs_per_minute": len(self._completed_at) / minutes,
+                "phases": phases,
+                "downloaded_bytes": self.downloaded_bytes,
+                "average_speed": (self.downloaded_bytes / self.download_seconds
+                                  if self.download_seconds else None),
+                "speed_p50": percentile(speeds, 0.5),
+                "speed_p95": percentile(speeds, 0.95),
+                "throttle_restarts": self.throttle_restarts,
+            }
+    
+    @staticmethod
+    def prometheus(snapshot, stages=None):
+        """A snapshot (and stage stats) in Prometheus' text exposition format"""
+        lines = [
+            "# HELP ytdl_jobs_total Finished downloads by outcome.",
+            "# TYPE ytdl_jobs_total counter",
+        ]
+        for outcome, count in snapshot["jobs"].items():
+            lines.append(f'ytdl_jobs_total{{outcome="{outcome}"}} {count}')
+        lines += [
+            "# HELP ytdl_jobs_per_minute Downloads completed per minute, recently.",
+            "# TYPE ytdl_jobs_per_minute gauge",
+            f"ytdl_jobs_per_minute {snapshot['jobs_per_minute']:.6g}",
+            "# HELP ytdl_phase_seconds Time finished downloads spent in each phase.",
+            "# TYPE ytdl_phase_seconds summary",
+        ]
+        for phase, stats in snapshot["phases"].items():
+            for quantile, key in (("0.5", "p50"), ("0.95", "p95")):
+                if stats[key] is not None:
+                    lines.append(f'ytdl_phase_seconds{{phase="{phase}",quantile="{quantile}"}}'
+                                 f' {stats[key]:.6g}')
+            lines.append(f'ytdl_phase_seconds_sum{{phase="{phase}"}} {stats["total"]:.6g}')
+            lines.append(f'ytdl_phase_seconds_count{{phase="{phase}"}} {stats["count"]}')
+        lines += [
+            "# HELP ytdl_downloaded_bytes_total Bytes of completed downloads.",
+            "# TYPE ytdl_downloaded_bytes_total counter",
+            f"ytdl_downloaded_bytes_total {snapshot['downloaded_bytes']}",
+            "# HELP ytdl_throttle_restarts_total Downloads restarted because they were throttled.",
+            "# TYPE ytdl_throttle_restarts_total counter",
+            f"ytdl_throttle_restarts_total {snapshot['throttle_restarts']}",
+        ]
+        if snapshot["average_speed"] is not None:
+            lines += [
+                "# HELP ytdl_download_speed_bytes Average download speed in bytes per second.",
+                "# TYPE ytdl_download_speed_bytes gauge",
+                f"ytdl_download_speed_bytes {snapshot['average_speed']:.6g}",
+            ]
+        if stages:
+            lines += [
+                "# HELP ytdl_stage_jobs Jobs in or waiting for each pipeline stage.",
+                "# TYPE ytdl_stage_jobs gauge",
+            ]
+            for stage, stats in stages.items():
+                for state in ("active", "waiting"):
+                    lines.append(f'ytdl_stage_jobs{{stage="{stage}",state="{state}"}} {stats[state]}')
+            lines += [
+                "# HELP ytdl_stage_workers Worker slots of each pipeline stage.",
+                "# TYPE ytdl_stage_workers gauge",
+            ]
+            for stage, stats in stages.items():
+                lines.append(f'ytdl_stage_workers{{stage="{stage}"}} {stats["workers"]}')
+        return "\n".join(lines) + "\n"
+    
+    def save(self, stages=None):
+        """Rewrite the metrics files, if there is a path; errors are ignored"""
+        if self.path is None:
+            return
+        snapshot = self.snapshot()
+        snapshot["stages"] = stages
+        for suffix, text in ((".json", json.dumps(snapshot, indent=2)),
+                             (".prom", self.prometheus(snapshot, stages))):
+            temp_path = self.path + suffix + ".tmp"
+            try:
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    f.write(text)
+                os.replace(temp_path, self.path + suffix)
+            except OSError:
+                pass
+
+def open_job_metrics(name="metrics"):
+    """Job metrics saved as name.json and name.prom in the config directory"""
+    try:
+        config_dir = get_config_dir()
+        os.makedirs(config_dir, exist_ok=True)
+    except OSError:
+        return JobMetrics()
+    return JobMetrics(os.path.join(config_dir, name))
+
+# Progress phases
+PHASE_DOWNLOAD = "download"
+PHASE_FINISHED = "finished"  # one stream (e.g. the video or the audio) is complete
+PHASE_POSTPROCESS = "postprocess"
+PHASE_ERROR = "error"
+
+class ProgressRecord(namedtuple("ProgressRecord", [
+        "phase", "percent", "downloaded_bytes", "total_bytes", "speed", "eta",
+        "fragment_index", "fragment_count"])):
+    """One progress update for the stream being downloaded.
+
+    Sizes are in bytes, speed in bytes per second and eta in seconds; any
+    field yt-dlp did not report is None.
+    """
+    __slots__ = ()
+
+PROGRESS_PREFIX = PRINT_MARKER + " progress "
+POSTPROCESSOR_PREFIX = PRINT_MARKER + " postprocessor "
+
+SIZE_UNITS = {
+    "B": 1,
+    "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3, "TiB": 1024 ** 4,
+    "KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4,
+}
+
+# Patterns for yt-dlp's human-readable progress lines, which older builds
+# without --progress-template print, e.g.
+#   [download]  45.2% of ~  50.00MiB at    5.00MiB/s ETA 00:01 (frag 12/40)
+#   [download] 100% of   50.00MiB in 00:00:05 at 9.41MiB/s
+LEGACY_PERCENT_RE = re.compile(r'\[download\]\s+(\d+(?:\.\d+)?)%')
+LEGACY_SIZE_RE = re.compile(r'of\s+~?\s*(\d+(?:\.\d+)?)\s*([KMGT]i?B|B)\b')
+LEGACY_SPEED_RE = re.compile(r'at\s+(\d+(?:\.\d+)?)\s*([KMGT]i?B|B)/s')
+LEGACY_ETA_RE = re.compile(r'ETA\s+(\d+(?::\d+)*)')
+LEGACY_FRAG_RE = re.compile(r'\(frag\s+(\d+)/(\d+)\)')
+LEGACY_DONE_RE = re.compile(r'\sin\s+\d+(?::\d+)*')
+
+def _legacy_size(match):
+    unit = SIZE_UNITS.get(match.group(2))
+    return int(float(match.group(1)) * unit) if unit else None
+
+def _parse_legacy_progress(line):
+    """Regex fallback for the human-readable progress lines"""
+    match = LEGACY_PERCENT_RE.match(line)
+    if not match:
+        return None
+    percent = float(match.group(1))
+    rest = line[match.end():]
+
+    total = downloaded = speed = eta = fragment_index = fragment_count = None
+    size_match = LEGACY_SIZE_RE.search(rest)
+    if size_match:
+        total = _legacy_size(size_match)
+        if total is not None:
+            downloaded = int(total * percent / 100)
+    speed_match = LEGACY_SPEED_RE.search(rest)
+    if speed_match:
+        speed = _legacy_size(speed_match)
+    eta_match = LEGACY_ETA_RE.search(rest)
+    if eta_match:
+        eta = 0
+        for part in eta_match.group(1).split(":"):
+            eta = eta * 60 + int(part)
+    frag_match = LEGACY_FRAG_RE.search(rest)
+    if frag_match:
+        fragment_index, fragment_count = int(frag_match.group(1)), int(frag_match.group(2))
+
+    # The summary line for a completed stream says "in <time>" instead of an ETA
+    phase = PHASE_FINISHED if percent >= 100 and LEGACY_DONE_RE.search(rest) else PHASE_DOWNLOAD
+    return ProgressRecord(phase, percent, downloaded, total, speed, eta, fragment_index, fragment_count)
+
+def parse_progress_line(line):
+    """Parse a progress line into a ProgressRecord.
+
+    Understands the JSON lines from our --progress-template and, for older
+    yt-dlp builds, the human-readable "[download]  45.2% of ..." lines.
+    Returns None for any other line.
+    """
+    if line.startswith(PROGRESS_PREFIX):
+        try:
+            progress = json.loads(line[len(PROGRESS_PREFIX):])
+        except ValueError:
+            return None
+        if not isinstance(progress, dict):
+            return None
+        downloaded = progress.get("downloaded_bytes")
+        total = progress.get("total_bytes") or progress.get("total_bytes_estimate")
+        status = progress.get("status")
+        if status == "finished":
+            phase = PHASE_FINISHED
+        elif status == "error":
+            phase = PHASE_ERROR
+        else:
+            phase = PHASE_DOWNLOAD
+        percent = None
+        if downloaded is not None and total:
+            percent = min(100.0, 100.0 * downloaded / total)
+        elif phase == PHASE_FINISHED:
+            percent = 100.0
+        return ProgressRecord(
+            phase, percent, downloaded, total and int(total),
+            progress.get("speed"), progress.get("eta"),
+            progress.get("fragment_index"), progress.get("fragment_count")
+        )
+    if line.startswith(POSTPROCESSOR_PREFIX):
+        return ProgressRecord(PHASE_POSTPROCESS, None, None, None, None, None, None, None)
+    if line.startswith("[download]"):
+        return _parse_legacy_progress(line)
+    return None
+
+def format_size(size):
+    """Human readable size, the way yt-dlp prints it"""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.1f}{unit}" if unit != "B" else f"{size}B"
+        size /= 1024
+    return f"{size:.2f}TiB"
+
+def format_eta(seconds):
+    """Format a number of seconds as [H:]MM:SS"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+def describe_metadata(metadata):
+    """Title, duration, size and available qualities of resolved metadata, for the GUI"""
+    if "entries" in metadata:
+        return f"Playlist: {metadata.get('title') or 'Unknown'} ({len(metadata['entries'])} videos)"
+    parts = [metadata.get("title") or "Unknown title"]
+    if metadata.get("duration"):
+        parts.append(format_eta(metadata["duration"]))
+    if metadata.get("filesize"):
+        parts.append(format_size(metadata["filesize"]))
+    formats = metadata.get("formats") or []
+    heights = sorted({fmt["height"] for fmt in formats
+                      if fmt.get("height") and fmt.get("vcodec") != "none"}, reverse=True)
+    qualities = [f"{height}p" for height in heights]
+    if any(fmt.get("vcodec") == "none" and fmt.get("acodec") not in (None, "none") for fmt in formats):
+        qualities.append("audio only")
+    text = " - ".join(parts)
+    if qualities:
+        text += "\nFormats: " + ", ".join(qualities)
+    return text
+
+def format_stage_stats(stats):
+    """One line on how busy the download and merge stages are (see stage_stats)"""
+    parts = []
+    for name, label in (("download", "Download"), ("postprocess", "Merge")):
+        stage = stats.get(name)
+        if not stage:
+            continue
+        text = f"{label}: {stage['active']}/{stage['workers']} busy, {stage['waiting']} waiting"
+        if stage["completed"]:
+            text += (f", on average {format_eta(stage['wait_time'] / stage['completed'])} queued"
+                     f" + {format_eta(stage['busy_time'] / stage['completed'])}")
+        parts.append(text)
+    return " | ".join(parts)
+
+def format_metrics(snapshot):
+    """Several lines summarising a metrics snapshot, for the statistics window"""
+    jobs = snapshot["jobs"]
+    downloaded = f"Downloaded: {format_size(snapshot['downloaded_bytes'])}"
+    if snapshot["average_speed"]:
+        downloaded += f" at {format_size(snapshot['average_speed'])}/s on average"
+    if snapshot["throttle_restarts"]:
+        downloaded += f", {snapshot['throttle_restarts']} restart(s) after throttling"
+    lines = [
+        f"Finished: {jobs.get(JOB_DONE, 0)} done, {jobs.get('skipped', 0)} already downloaded,"
+        f" {jobs.get(JOB_FAILED, 0)} failed, {jobs.get(JOB_CANCELLED, 0)} cancelled",
+        f"Rate: {snapshot['jobs_per_minute']:.1f} downloads per minute",
+        downloaded,
+        "",
+        f"{'Phase':<12}{'jobs':>6}{'median':>10}{'95%':>10}{'total':>10}",
+    ]
+    for phase, stats in snapshot["phases"].items():
+        p50 = "-" if stats["p50"] is None else f"{stats['p50']:.1f}s"
+        p95 = "-" if stats["p95"] is None else f"{stats['p95']:.1f}s"
+        lines.append(f"{phase:<12}{stats['count']:>6}{p50:>10}{p95:>10}"
+                     f"{format_eta(stats['total']):>10}")
+    if snapshot.get("stages"):
+        lines += ["", format_stage_stats(snapshot["stages"]).replace(" | ", "\n")]
+    return "\n".join(lines)
+
+# Job priorities and their relative share of the bandwidth cap. Playlist
+# entries start at low priority so they do not crowd out single videos
+PRIORITY_WEIGHTS = {"low": 1, "normal": 2, "high": 4}
+DEFAULT_PRIORITY = "normal"
+PLAYLIST_PRIORITY = "low"
+
+# A running download is restarted with a new --limit-rate only if its limit
+# changes by more than this fraction, and at most once per this many seconds
+REBALANCE_THRESHOLD = 0.25
+REBALANCE_MIN_INTERVAL = 30
+# Seconds between checks of the bandwidth shares while downloads run, which
+# picks up time-of-day windows opening and closing
+REBALANCE_CHECK_INTERVAL = 60
+
+# Rates as yt-dlp's --limit-rate takes them, e.g. 500K or 2.5M (bytes per second)
+RATE_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([KMG]?)(?:I?B)?(?:/S)?$')
+RATE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+# A time-of-day window with its own rate, e.g. 09:00-17:00=2M
+WINDOW_RE = re.compile(r'^(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=\s*(.+)$')
+
+def parse_rate(text):
+    """Bytes per second for a rate like "500K" or "2.5M"; None for "unlimited" """
+    text = text.strip()
+    if text.upper() in ("UNLIMITED", "NONE", "OFF"):
+        return None
+    match = RATE_RE.match(text.upper())
+    if not match or float(match.group(1)) <= 0:
+        raise ValueError(f"Not a valid rate: {text!r} (use e.g. 500K or 2M)")
+    return int(float(match.group(1)) * RATE_UNITS[match.group(2)])
+
+def format_rate(rate):
+    return "unlimited" if rate is None else f"{format_size(rate)}/s"
+
+class BandwidthScheduler:
+    """Splits a total download rate cap between the running jobs by priority.
+
+    yt-dlp downloads in its own processes, so bytes cannot be metered here;
+    instead every process gets its share of the cap as --limit-rate, which
+    yt-dlp enforces with its own rate limiter, and the shares add up to the
+    cap. The cap can differ by time of day: windows are (start minute, end
+    minute, rate) and a window may run past midnight. Outside all windows
+    limit applies; None means no cap.
+    """
+    
+    def __init__(self, limit=None, windows=()):
+        self.limit = limit
+        self.windows = list(windows)
+    
+    @classmethod
+    def parse(cls, text):
+        """Build a scheduler from text like "09:00-17:00=2M, 8M"; raises ValueError.
+
+        Items are separated by commas: a plain rate is the cap outside the
+        windows, HH:MM-HH:MM=RATE sets the cap for that time of day. An
+        empty text means no cap at all.
+        """
+        limit = None
+        windows = []
+        for item in text.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            match = WINDOW_RE.match(item)
+            if match is None:
+                limit = parse_rate(item)
+                continue
+            start_hour, start_minute, end_hour, end_minute = map(int, match.groups()[:4])
+            if start_hour > 23 or end_hour > 24 or start_minute > 59 or end_minute > 59:
+                raise ValueError(f"Not a valid time window: {item!r}")
+            windows.append((start_hour * 60 + start_minute, end_hour * 60 + end_minute,
+                            parse_rate(match.group(5))))
+        return cls(limit, windows)
+    
+    def describe(self):
+        """The schedule in the form parse() reads"""
+        items = [f"{start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d}="
+                 + ("unlimited" if rate is None else self._rate_text(rate))
+                 for start, end, rate in self.windows]
+        if self.limit is not None:
+            items.append(self._rate_text(self.limit))
+        return ", ".join(items)
+    
+    @staticmethod
+    def _rate_text(rate):
+        for unit in ("G", "M", "K"):
+            if rate >= RATE_UNITS[unit]:
+                return f"{rate / RATE_UNITS[unit]:g}{unit}"
+        return str(rate)
+    
+    def current_limit(self, now=None):
+        """The cap in effect at now (a time.struct_time, default the local time)"""
+        now = now or time.localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+        for start, end, rate in self.windows:
+            if start <= end:
+                inside = start <= minute < end
+            else:
+                inside = minute >= start or minute < end
+            if inside:
+                return rate
+        return self.limit
+    
+    def split(self, jobs, now=None):
+        """{job: (rate limit in bytes per second or None, fraction of the cap)}"""
+        limit = self.current_limit(now)
+        total = sum(PRIORITY_WEIGHTS[job.priority] for job in jobs)
+        shares = {}
+        for job in jobs:
+            fraction = PRIORITY_WEIGHTS[job.priority] / total
+            shares[job] = (None if limit is None else max(1024, int(limit * fraction)), fraction)
+        return shares
+
+def limit_changed(old, new):
+    """True if a download running at rate limit old should be restarted with new"""
+    if old is None or new is None:
+        return old != new
+    return abs(new - old) > REBALANCE_THRESHOLD * old
+
+# Throttle detection: a download's throughput is averaged over the last
+# THROTTLE_WINDOW seconds. If that falls below THROTTLE_RATIO of its
+# baseline, the best such average of the last THROTTLE_BASELINE_WINDOW
+# seconds, the server is taken to be throttling the connection and the
+# download is restarted on a new one, continuing from its .part file. A job
+# is restarted for this at most THROTTLE_MAX_RESTARTS times, and after the
+# n-th time not again for THROTTLE_BACKOFF * 2 ** (n - 1) seconds
+THROTTLE_WINDOW = 10
+THROTTLE_BASELINE_WINDOW = 5 * 60
+THROTTLE_RATIO = 0.25
+THROTTLE_MAX_RESTARTS = 5
+THROTTLE_BACKOFF = 15
+
+class ThroughputMonitor:
+    """Rolling throughput of a download, from the bytes it has downloaded so far.
+
+    rate() is the average over the last THROTTLE_WINDOW seconds, once the
+    download has run that long, and baseline() the best of those averages
+    within THROTTLE_BASELINE_WINDOW. restart() starts a new measurement for
+    a new process but keeps the baseline to compare it with; reset() also
+    forgets the baseline, e.g. when the download's rate limit has changed.
+    """
+    
+    def __init__(self):
+        self.window = THROTTLE_WINDOW
+        self.baseline_window = THROTTLE_BASELINE_WINDOW
+        # (time, bytes downloaded) and (time, rate over the window)
+        self._samples = deque()
+        self._rates = deque()
+    
+    def add(self, downloaded_bytes, now=None):
+        """Record the bytes downloaded so far"""
+        now = time.monotonic() if now is None else now
+        samples = self._samples
+        if samples and downloaded_bytes < samples[-1][1]:
+            # Counting started over
+            samples.clear()
+        samples.append((now, downloaded_bytes))
+        # Keep one sample from before the window, to measure it from
+        while len(samples) > 2 and samples[1][0] <= now - self.window:
+            samples.popleft()
+        rate = self.rate()
+        if rate is not None and (not self._rates or now - self._rates[-1][0] >= 1):
+            self._rates.append((now, rate))
+        while self._rates and self._rates[0][0] < now - self.baseline_window:
+            self._rates.popleft()
+    
+    def rate(self):
+        """Bytes per second over the last window, or None before the download has run that long"""
+        if len(self._samples) < 2:
+            return None
+        (start, first), (end, last) = self._samples[0], self._samples[-1]
+        if end - start < self.window:
+            return None
+        return (last - first) / (end - start)
+    
+    def baseline(self):
+        """The best rate of the last baseline_window seconds, or None"""
+        return max((rate for _, rate in self._rates), default=None)
+    
+    def restart(self):
+        self._samples.clear()
+    
+    def reset(self):
+        self._samples.clear()
+        self._rates.clear()
+
+class OutputLog:
+    """The last size lines of output of all jobs, oldest first, as (job id, line).
+
+    Lines that drop out are only kept in the log file, if there is one.
+    added counts every line ever added, so a viewer can tell whether it
+    has to redraw.
+    """
+    
+    def __init__(self, size=OUTPUT_LOG_LINES):
+        self._lines = deque(maxlen=size)
+        self.added = 0
+    
+    def add(self, job_id, line):
+        self._lines.append((job_id, line))
+        self.added += 1
+    
+    def lines(self):
+        return list(self._lines)
+
+# Job states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_FINISHING = "finishing"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+class DownloadJob:
+    """State of a single download in the queue"""
+    
+    _ids = itertools.count(1)
+    
+    def __init__(self, url, save_dir, group=None, refresh=False, priority=DEFAULT_PRIORITY):
+        self.id = next(DownloadJob._ids)
+        # Identifies the job in the journal, across restarts
+        self.key = uuid.uuid4().hex
+        self.url = url
+        self.save_dir = save_dir
+        self.group = group
+        self.refresh = refresh
+        self.video_id = get_video_id(url)
+        self.duration = None
+        self.format_id = None
+        # yt-dlp --download-archive file, for playlist entries
+        self.download_archive = None
+        # Set when the archive shows the video was downloaded before
+        self.already_downloaded = False
+        self.priority = priority
+        # --limit-rate of the running process (None for none) and its share of the cap
+        self.rate_limit = None
+        self.bandwidth_share = None
+        # Set while the process is restarted with a new rate limit, or on a
+        # new connection because the download was throttled
+        self.restarting = False
+        # Throughput, for throttle detection, and a record of every restart for
+        # throttling: its time, the baseline, the throttled rate, the rate
+        # after the restart (None until measured) and the -N it was given
+        self.throughput = ThroughputMonitor()
+        # (downloads running, rate limit) while the throughput was measured
+        self.throughput_context = None
+        self.throttle_restarts = []
+        self.throttle_retry_at = 0
+        # yt-dlp's -N for the running process, None for its default
+        self.concurrent_fragments = None
+        # Prefetched video info the running process loads instead of the page
+        self.info_json = None
+        # The FormatPlan of the download, if its format list was known
+        self.plan = None
+        self.started_at = None
+        # Where the download is written before it is moved to save_dir, if elsewhere
+        self.scratch_dir = None
+        # Downloaded with separate_streams; the files are merged afterwards
+        self.separate_streams = False
+        self.stream_files = []
+        # When the job entered each stage and how long it took there (seconds)
+        self.queued_at = time.monotonic()
+        self.download_started_at = None
+        self.download_time = None
+        self.postprocess_queued_at = None
+        self.postprocess_started_at = None
+        self.postprocess_time = None
+        # Seconds spent in each of JOB_PHASES so far, and the phase now running
+        self.phase_times = {}
+        self.phase = None
+        self._phase_started = None
+        # (time, bytes per second) samples of the speed yt-dlp reports
+        self.speed_samples = deque(maxlen=SPEED_SAMPLES)
+        # The last lines of yt-dlp's and ffmpeg's output, and the last error yt-dlp reported
+        self.output = deque(maxlen=JOB_OUTPUT_LINES)
+        self.error_line = None
+        self.state = JOB_QUEUED
+        self.message = "Waiting in queue..."
+        self.progress = 0.0
+        self.process = None
+        self.cancelled = False
+        self.video_title = None
+        self.downloaded_file_path = None
+        self.downloaded_filename = None
+        # Byte counts; a job can download several streams one after another
+        self.downloaded_bytes = 0
+        self.total_bytes = None
+        self.speed = None
+        self.eta = None
+        self.fragment_index = None
+        self.fragment_count = None
+        self._finished_streams_bytes = 0
+        self._stream_bytes = 0
+    
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+    
+    def as_dict(self):
+        """JSON-friendly snapshot of the job"""
+        return {
+            "job": self.id,
+            "url": self.url,
+            "save_dir": self.save_dir,
+            "video_id": self.video_id,
+            "title": self.video_title,
+            "state": self.state,
+            "message": self.message,
+            "progress": round(self.progress, 1),
+            "downloaded_bytes": self.downloaded_bytes,
+            "total_bytes": self.total_bytes,
+            "speed": self.speed,
+            "eta": self.eta,
+            "path": self.downloaded_file_path,
+            "already_downloaded": self.already_downloaded,
+            "priority": self.priority,
+            "rate_limit": self.rate_limit,
+            "bandwidth_share": self.bandwidth_share,
+            "download_time": self.download_time,
+            "postprocess_time": self.postprocess_time,
+            "phase": self.phase,
+            "phase_times": dict(self.phase_times),
+            "plan": self.plan._asdict() if self.plan else None,
+            "throttle_restarts": list(self.throttle_restarts),
+            "output": list(self.output)[-JOB_OUTPUT_TAIL:] if self.finished else [],
+            "playlist": self.group.id if self.group else None,
+        }
+    
+    def journal_record(self):
+        """The job's entry in the JobJournal; progress is left out"""
+        return {
+            "type": "job",
+            "key": self.key,
+            "url": self.url,
+            "save_dir": self.save_dir,
+            "refresh": self.refresh,
+            "priority": self.priority,
+            "playlist": self.group.key if self.group else None,
+            "video_id": self.video_id,
+            "title": self.video_title,
+            "state": self.state,
+            "message": self.message if self.finished else None,
+            "path": self.downloaded_file_path,
+        }
+    
+    def update_from(self, data):
+        """Apply a snapshot made by as_dict, e.g. one received from a daemon"""
+        self.video_id = data["video_id"]
+        self.video_title = data["title"]
+        self.set_state(data["state"], data["message"])
+        self.progress = data["progress"]
+        self.downloaded_bytes = data["downloaded_bytes"]
+        self.total_bytes = data["total_bytes"]
+        self.speed = data["speed"]
+        self.eta = data["eta"]
+        self.downloaded_file_path = data["path"]
+        self.downloaded_filename = os.path.basename(data["path"]) if data["path"] else None
+        self.already_downloaded = data["already_downloaded"]
+        self.priority = data["priority"]
+        self.rate_limit = data["rate_limit"]
+        self.bandwidth_share = data["bandwidth_share"]
+        self.download_time = data["download_time"]
+        self.postprocess_time = data["postprocess_time"]
+        self.phase = data["phase"]
+        self.phase_times = data["phase_times"]
+        self.plan = FormatPlan(**data["plan"]) if data.get("plan") else None
+        self.throttle_restarts = data["throttle_restarts"]
+        self.output = deque(data.get("output") or (), maxlen=JOB_OUTPUT_LINES)
+    
+    def set_state(self, state, message):
+        self.state = state
+        self.message = message
+    
+    def reset(self):
+        """Put a finished job back into its initial state so it can run again"""
+        self.set_state(JOB_QUEUED, "Waiting in queue...")
+        self.progress = 0.0
+        self.cancelled = False
+        self.downloaded_bytes = 0
+        self.total_bytes = None
+        self.speed = None
+        self.eta = None
+        self.fragment_index = None
+        self.fragment_count = None
+        self._finished_streams_bytes = 0
+        self._stream_bytes = 0
+        self.already_downloaded = False
+        self.rate_limit = None
+        self.bandwidth_share = None
+        self.restarting = False
+        self.throughput.reset()
+        self.throughput_context = None
+        self.throttle_restarts = []
+        self.throttle_retry_at = 0
+        self.concurrent_fragments = None
+        self.stream_files = []
+        self.queued_at = time.monotonic()
+        self.download_started_at = None
+        self.download_time = None
+        self.postprocess_queued_at = None
+        self.postprocess_started_at = None
+        self.postprocess_time = None
+        self.phase_times = {}
+        self.phase = None
+        self.speed_samples.clear()
+        self.output = deque(maxlen=JOB_OUTPUT_LINES)
+        self.error_line = None
+    
+    def add_output(self, line):
+        """Keep a line of the job's output, already cut to OUTPUT_LINE_LENGTH"""
+        self.output.append(line)
+        if line.startswith("ERROR:"):
+            self.error_line = line
+    
+    def trim_output(self):
+        """Drop the output of a finished job, apart from the tail of a failed or cancelled one"""
+        if self.state == JOB_DONE:
+            self.output = deque(maxlen=JOB_OUTPUT_LINES)
+        elif len(self.output) > JOB_OUTPUT_TAIL:
+            self.output = deque(list(self.output)[-JOB_OUTPUT_TAIL:], maxlen=JOB_OUTPUT_LINES)
+    
+    def enter_phase(self, phase):
+        """Start timing phase, one of JOB_PHASES, and stop the current one; None only stops it"""
+        now = time.monotonic()
+        if self.phase is not None:
+            self.phase_times[self.phase] = (self.phase_times.get(self.phase, 0.0)
+                                            + now - self._phase_started)
+        self.phase = phase
+        self._phase_started = now
+    
+    def apply_progress(self, record):
+        """Update the job from a ProgressRecord"""
+        if record.phase == PHASE_POSTPROCESS:
+            self.set_state(JOB_FINISHING, "Stand by - finishing up...")
+            return
+        
+        if record.total_bytes:
+            self._stream_bytes = record.total_bytes
+            self.total_bytes = self._finished_streams_bytes + record.total_bytes
+        if record.downloaded_bytes is not None:
+            self.downloaded_bytes = self._finished_streams_bytes + record.downloaded_bytes
+        if record.percent is not None:
+            self.progress = record.percent
+        self.speed = record.speed
+        if record.speed:
+            now = time.monotonic()
+            if not self.speed_samples or now - self.speed_samples[-1][0] >= SPEED_SAMPLE_INTERVAL:
+                self.speed_samples.append((now, record.speed))
+        self.eta = record.eta
+        self.fragment_index = record.fragment_index
+        self.fragment_count = record.fragment_count
+        
+        if record.phase == PHASE_FINISHED:
+            # This stream is complete; yt-dlp may move on to the next one
+            # (e.g. audio after video), whose sizes start from zero again
+            self._finished_streams_bytes += self._stream_bytes
+            self._stream_bytes = 0
+            self.downloaded_bytes = self.total_bytes = self._finished_streams_bytes
+    
+    def progress_text(self):
+        """Status line for a running download"""
+        text = f"Downloading... {self.progress:.1f}%"
+        details = []
+        if self.speed:
+            details.append(f"{format_size(self.speed)}/s")
+        if self.eta is not None:
+            details.append(f"ETA {format_eta(self.eta)}")
+        if self.fragment_count:
+            details.append(f"fragment {self.fragment_index}/{self.fragment_count}")
+        if details:
+            text += " (" + ", ".join(details) + ")"
+        return text
+    
+    def parse_video_info(self, line):
+        """Parse video title and filename from yt-dlp output"""
+        # yt-dlp outputs: [download] Destination: filename.ext
+        if '[download]' in line and 'Destination:' in line:
+            match = re.search(r'Destination:\s*(.+)', line)
+            if match:
+                full_path = match.group(1).strip()
+                if os.path.isabs(full_path):
+                    self.downloaded_file_path = full_path
+                else:
+                    self.downloaded_file_path = os.path.join(self.save_dir, full_path)
+                self.downloaded_filename = os.path.basename(full_path)
+        
+        # yt-dlp outputs: [download] filename.ext has already been downloaded
+        if '[download]' in line and 'has already been downloaded' in line:
+            match = re.search(r'\[download\]\s*(.+?)\s+has already been downloaded', line)
+            if match:
+                filename = match.group(1).strip()
+                self.downloaded_file_path = os.path.join(self.save_dir, filename)
+                self.downloaded_filename = filename
+        
+        # yt-dlp outputs: [Merger] Merging formats into "filename.ext"
+        if '[Merger]' in line or '[ExtractAudio]' in line:
+            match = re.search(r'into\s+"(.+)"', line)
+            if match:
+                full_path = match.group(1).strip()
+                if os.path.isabs(full_path):
+                    self.downloaded_file_path = full_path
+                else:
+                    self.downloaded_file_path = os.path.join(self.save_dir, full_path)
+                self.downloaded_filename = os.path.basename(full_path)
+    
+    def handle_print_line(self, kind, value):
+        """Handle a structured line emitted by one of our --print templates"""
+        if kind == "info" and isinstance(value, dict):
+            if value.get("title"):
+                self.video_title = value["title"]
+            self.video_id = value.get("id") or self.video_id
+            self.duration = value.get("duration")
+            format_id = value.get("format_id")
+            if not self.stream_files or not self.format_id:
+                self.format_id = format_id
+            elif format_id and format_id not in self.format_id.split("+"):
+                # The next of several separately downloaded streams
+                self.format_id += "+" + format_id
+        elif kind == "postprocess":
+            self.set_state(JOB_FINISHING, "Stand by - finishing up...")
+        elif kind == "filepath" and value:
+            self.downloaded_file_path = value
+            self.downloaded_filename = os.path.basename(value)
+            if self.separate_streams and value not in self.stream_files:
+                self.stream_files.append(value)
+
+class PlaylistGroup:
+    """A playlist that has been expanded into one job per entry"""
+    
+    _ids = itertools.count(1)
+    
+    def __init__(self, url, save_dir, refresh=False):
+        self.id = next(PlaylistGroup._ids)
+        self.key = uuid.uuid4().hex
+        self.url = url
+        self.save_dir = save_dir
+        self.refresh = refresh
+        self.title = None
+        self.jobs = []
+        self.expanding = True
+        self.cancelled = False
+        self.message = "Reading playlist..."
+    
+    @property
+    def finished(self):
+        return not self.expanding and all(job.finished for job in self.jobs)
+    
+    @property
+    def failed(self):
+        """True if the playlist could not be read or was cancelled before expanding"""
+        return not self.expanding and not self.jobs and self.message is not None
+    
+    def as_dict(self):
+        """JSON-friendly snapshot of the playlist"""
+        done, total, downloaded, total_bytes = self.totals()
+        return {
+            "playlist": self.id,
+            "url": self.url,
+            "save_dir": self.save_dir,
+            "title": self.title,
+            "expanding": self.expanding,
+            "message": self.message,
+            "done": done,
+            "total": total,
+            "downloaded_bytes": downloaded,
+            "total_bytes": total_bytes,
+        }
+    
+    def journal_record(self):
+        return {
+            "type": "playlist",
+            "key": self.key,
+            "url": self.url,
+            "save_dir": self.save_dir,
+            "refresh": self.refresh,
+            "title": self.title,
+            "expanding": self.expanding,
+        }
+    
+    def update_from(self, data):
+        """Apply a snapshot made by as_dict; the totals follow from the jobs"""
+        self.title = data["title"]
+        self.expanding = data["expanding"]
+        self.message = data["message"]
+    
+    def failed_jobs(self):
+        return [job for job in self.jobs if job.state in (JOB_FAILED, JOB_CANCELLED)]
+    
+    def totals(self):
+        """Overall progress as (entries done, entries total, bytes done, estimated total bytes).
+
+        Entries that have not reported a size yet are assumed to be as large
+        as the average of those that have.
+        """
+        done = sum(1 for job in self.jobs if job.state == JOB_DONE)
+        sized = [job for job in self.jobs if job.total_bytes]
+        downloaded = sum(job.downloaded_bytes for job in sized)
+        total = sum(job.total_bytes for job in sized)
+        if sized:
+            total += total // len(sized) * (len(self.jobs) - len(sized))
+        return done, len(self.jobs), downloaded, total
+
+# Why the supervisor stopped a process
+PROCESS_CANCELLED = "cancelled"
+PROCESS_TIMEOUT = "timeout"
+PROCESS_IDLE = "idle"
+# The download went to a yt_dlp worker, but the package cannot be imported
+PROCESS_UNAVAILABLE = "unavailable"
+
+# Lines end with \n, or with \r where a progress bar redraws itself
+LINE_END_RE = re.compile(rb"\r\n|\r|\n")
+
+def process_group_options():
+    """Popen options that put a child into its own process group"""
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.CREATE_NO_WINDOW}
+    return {"start_new_session": True}
+
+def kill_process_tree(pid, force=False):
+    """Stop a process started with process_group_options() and all of its children.
+
+    On POSIX the whole process group gets SIGTERM, or SIGKILL with force.
+    Windows has no equivalent of SIGTERM for console programs, so the
+    tree is always ended with taskkill /T /F.
+    """
+    try:
+        if sys.platform == "win32":
+            subprocess.run(
+                ["taskkill", "/T", "/F", "/PID", str(pid)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                creationflags=subprocess.CREATE_NO_WINDOW
+            )
+        else:
+            os.killpg(pid, signal.SIGKILL if force else signal.SIGTERM)
+    except OSError:
+        pass
+
+def pidfd_supported():
+    """True if the kernel lets the event loop wait for children with pidfds (Linux 5.3+)"""
+    if not hasattr(asyncio, "PidfdChildWatcher"):
+        return False
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except (AttributeError, OSError):
+        return False
+    return True
+
+class SupervisedProcess:
+    """A child process run by a ProcessSupervisor"""
+    
+    def __init__(self, supervisor, cmd):
+        self.supervisor = supervisor
+        self.cmd = cmd
+        self.pid = None
+        self.returncode = None
+        # PROCESS_CANCELLED, PROCESS_TIMEOUT or PROCESS_IDLE once stopped by the supervisor
+        self.stopped = None
+        self._process = None
+        # Input written before the process was running
+        self._input = []
+    
+    def poll(self):
+        return self.returncode
+    
+    def terminate(self):
+        """Stop the process and its children; safe to call from any thread"""
+        self.supervisor.loop.call_soon_threadsafe(self.supervisor.stop, self, PROCESS_CANCELLED)
+    
+    def write(self, data):
+        """Write bytes to the stdin of a process started with stdin=True; safe from any thread"""
+        self.supervisor.call_soon(self._write, data)
+    
+    def close_stdin(self):
+        """Close the process's stdin once everything written so far is sent"""
+        self.supervisor.call_soon(self._write, None)
+    
+    def _write(self, data):
+        if self._process is None:
+            self._input.append(data)
+            return
+        stdin = self._process.stdin
+        if stdin is None or stdin.is_closing():
+            return
+        if data is None:
+            stdin.close()
+        else:
+            stdin.write(data)
+
+class ProcessSupervisor:
+    """Runs child processes and reads their output on one asyncio event loop.
+
+    One background thread serves every process, however many run at once.
+    Output is read as raw bytes and split into lines as it arrives; each
+    line is handed to on_line before more is read, so a consumer that falls
+    behind makes the child wait on its full pipe rather than letting output
+    pile up in memory. A process that prints nothing for idle_timeout
+    seconds, or runs past its own timeout, is stopped.
+
+    Every child gets its own process group, and stopping it stops the
+    whole group, including the ffmpeg processes yt-dlp starts.
+    Callbacks run on the supervisor's thread and must return quickly.
+    """
+    
+    def __init__(self, idle_timeout=PROCESS_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.loop = None
+        self._thread = None
+        # The SupervisedProcess of each process still being supervised, by its future
+        self._tasks = {}
+        self._lock = threading.Lock()
+    
+    def _ensure_loop(self):
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                if sys.platform != "win32" and sys.version_info < (3, 12) and pidfd_supported():
+                    # Before Python 3.12 asyncio waits for each child on a
+                    # thread of its own; with a pidfd the loop itself waits
+                    watcher = asyncio.PidfdChildWatcher()
+                    watcher.attach_loop(self.loop)
+                    asyncio.set_child_watcher(watcher)
+                self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+                self._thread.start()
+        return self.loop
+    
+    def call_soon(self, callback, *args):
+        """Run callback(*args) on the supervisor's thread; safe to call from any thread"""
+        self._ensure_loop().call_soon_threadsafe(callback, *args)
+    
+    def start(self, cmd, on_line, on_exit, timeout=None, stdin=False, idle=True, on_start=None):
+        """Start cmd in the background and return its SupervisedProcess.
+
+        on_line(text) is called for every line the process writes to stdout
+        or stderr, then on_exit(returncode, error) once it has ended; error
+        is a message if the process could not be run at all. Both run on the
+        supervisor's thread, possibly before start returns; on_start, if
+        given, gets the SupervisedProcess before either of them is called.
+        With stdin, the process reads what SupervisedProcess.write sends it.
+        Without idle, it is never stopped for printing nothing, as a process
+        waiting for input does not.
+        """
+        loop = self._ensure_loop()
+        process = SupervisedProcess(self, cmd)
+        if on_start is not None:
+            on_start(process)
+        future = asyncio.run_coroutine_threadsafe(
+            self._supervise(process, on_line, on_exit, timeout, stdin, idle), loop)
+        with self._lock:
+            self._tasks[future] = process
+        future.add_done_callback(self._forget)
+        return process
+    
+    def _forget(self, future):
+        with self._lock:
+            self._tasks.pop(future, None)
+    
+    def close(self, timeout=KILL_GRACE_PERIOD):
+        """Wait up to timeout seconds for the processes to end, kill what is left and stop the loop.
+
+        Nothing can be started afterwards.
+        """
+        with self._lock:
+            loop, thread = self.loop, self._thread
+            tasks = dict(self._tasks)
+        if loop is None:
+            return
+        _, pending = concurrent.futures.wait(tasks, timeout)
+        for future in pending:
+            if tasks[future].pid is not None:
+                kill_process_tree(tasks[future].pid, force=True)
+        # Killed processes still have to be waited for, which is quick
+        _, pending = concurrent.futures.wait(pending, 1)
+        for future in pending:
+            future.cancel()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+    
+    async def _supervise(self, process, on_line, on_exit, timeout, stdin=False, idle=True):
+        try:
+            child = await asyncio.create_subprocess_exec(
+                *process.cmd,
+                stdin=subprocess.PIPE if stdin else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                **process_group_options()
+            )
+        except OSError as e:
+            on_exit(None, str(e))
+            return
+        process._process = child
+        process.pid = child.pid
+        for data in process._input:
+            process._write(data)
+        process._input = []
+        if process.stopped:
+            # terminate() was called before the process existed
+            self.stop(process, process.stopped)
+        
+        error = None
+        try:
+            await self._read_lines(process, child.stdout, on_line, timeout, idle)
+        except Exception as e:
+            # The consumer failed; there is nobody left to read the output
+            error = str(e)
+            self.stop(process, PROCESS_CANCELLED)
+        process.returncode = await child.wait()
+        on_exit(process.returncode, error)
+    
+    async def _read_lines(self, process, stream, on_line, timeout, idle=True):
+        deadline = time.monotonic() + timeout if timeout else None
+        pending = b""
+        while True:
+            wait, reason = (self.idle_timeout if idle else None), PROCESS_IDLE
+            if deadline is not None and (wait is None or deadline - time.monotonic() < wait):
+                wait, reason = max(0, deadline - time.monotonic()), PROCESS_TIMEOUT
+            try:
+                chunk = await asyncio.wait_for(stream.read(READ_CHUNK_SIZE), wait)
+            except asyncio.TimeoutError:
+                self.stop(process, reason)
+                return
+            if not chunk:
+                break
+            lines = LINE_END_RE.split(pending + chunk)
+            pending = lines.pop()
+            if len(pending) > MAX_LINE_LENGTH:
+                lines.append(pending)
+                pending = b""
+            for line in lines:
+                if line:
+                    on_line(line.decode("utf-8", "replace"))
+        if pending:
+            on_line(pending.decode("utf-8", "replace"))
+    
+    def stop(self, process, reason):
+        """Stop a process tree; runs on the supervisor's loop"""
+        if process.stopped is None:
+            process.stopped = reason
+        child = process._process
+        if child is None or child.returncode is not None:
+            return
+        kill_process_tree(child.pid)
+        # Whatever is still running after the grace period is killed outright
+        self.loop.call_later(KILL_GRACE_PERIOD, kill_process_tree, child.pid, True)
+
+class PrefetchRequest:
+    """A URL's metadata being extracted in the background (see DownloadEngine.prefetch)"""
+    
+    def __init__(self, url, refresh=False):
+        self.url = url
+        self.refresh = refresh
+        self.cancelled = False
+        self.process = None
+        self._lock = threading.Lock()
+    
+    def attach(self, process):
+        """Make process the one cancel() stops; stops it right away if already cancelled"""
+        with self._lock:
+            self.process = process
+            cancelled = self.cancelled
+        if cancelled:
+            kill_process_tree(process.pid, force=True)
+    
+    def cancel(self):
+        """Stop the extraction; on_done will not be called"""
+        with self._lock:
+            self.cancelled = True
+            process = self.process
+        if process is not None and process.poll() is None:
+            kill_process_tree(process.pid, force=True)
+
+# Lines a yt_dlp worker writes about itself rather than for the download
+WORKER_PREFIX = PRINT_MARKER + " worker "
+WORKER_DONE_PREFIX = PRINT_MARKER + " done "
+
+def worker_command():
+    """The command that starts a yt_dlp worker (see run_yt_dlp_worker)"""
+    if getattr(sys, "frozen", False):
+        return [sys.executable, "--yt-dlp-worker"]
+    return [sys.executable, os.path.abspath(__file__), "--yt-dlp-worker"]
+
+class PooledDownload:
+    """A download run by a YtDlpWorkerPool; used like a SupervisedProcess"""
+    
+    def __init__(self, pool, args, on_line, on_exit):
+        self.pool = pool
+        self.args = args
+        self.on_line = on_line
+        self.on_exit = on_exit
+        self.worker = None
+        # The worker's pid once the download has one
+        self.pid = None
+        self.returncode = None
+        self.stopped = None
+    
+    def poll(self):
+        return self.returncode
+    
+    def terminate(self):
+        """Stop the download, and with it its worker; safe to call from any thread"""
+        self.pool.supervisor.call_soon(self.pool.stop, self, PROCESS_CANCELLED)
+
+class PoolWorker:
+    """One yt_dlp worker process of a YtDlpWorkerPool"""
+    
+    def __init__(self):
+        self.process = None
+        self.ready = False
+        self.download = None
+        self.last_output = time.monotonic()
+        # Set when the pool shrinks; the worker exits once it is idle
+        self.retiring = False
+
+class YtDlpWorkerPool:
+    """Long-lived worker processes that download with the yt_dlp Python package.
+
+    A worker is this script run with --yt-dlp-worker (see run_yt_dlp_worker).
+    It imports yt_dlp once and keeps its YoutubeDL instances, and with them
+    their open connections, for the next download, so a download no longer
+    pays for starting an interpreter and loading yt-dlp. Each download gets
+    the arguments the executable would (build_download_command), and the
+    worker reports progress from yt-dlp's progress hooks as the same
+    PRINT_MARKER lines, so the engine reads both backends alike.
+
+    Workers run on the engine's ProcessSupervisor and are started ahead of
+    the first download, up to size of them. Stopping a download stops its
+    worker, the only way to interrupt yt-dlp; a new one takes its place.
+    available is None until a worker has started, then False if yt_dlp could
+    not be imported: downloads then end with stopped set to
+    PROCESS_UNAVAILABLE, for the caller to run the executable instead.
+    Everything but run, resize and start happens on the supervisor's thread.
+    """
+    
+    def __init__(self, supervisor, size=DEFAULT_MAX_WORKERS):
+        self.supervisor = supervisor
+        self.size = max(1, size)
+        self.available = None
+        self.version = None
+        self.error = None
+        self._workers = []
+        self._queue = deque()
+        self._started = False
+        self._closed = False
+    
+    def start(self):
+        """Start the workers now, so that the first downloads find them ready"""
+        self.supervisor.call_soon(self._start)
+    
+    def resize(self, size):
+        """Change the number of workers to keep"""
+        self.supervisor.call_soon(self._resize, max(1, size))
+    
+    def close(self):
+        """Let every worker exit once its download is done, and start no new ones"""
+        self.supervisor.call_soon(self._close)
+    
+    def worker_count(self):
+        """Number of worker processes still running"""
+        return len(self._workers)
+    
+    def run(self, args, on_line, on_exit, on_start=None):
+        """Run a download with yt-dlp's arguments args; returns its PooledDownload.
+
+        on_line, on_exit and on_start are called as for ProcessSupervisor.start.
+        """
+        download = PooledDownload(self, args, on_line, on_exit)
+        if on_start is not None:
+            on_start(download)
+        self.supervisor.call_soon(self._submit, download)
+        return download
+    
+    def stop(self, download, reason):
+        """Stop a download; runs on the supervisor's thread"""
+        if download.stopped is None:
+            download.stopped = reason
+        if download.worker is not None:
+            self.supervisor.stop(download.worker.process, reason)
+        elif download in self._queue:
+            self._queue.remove(download)
+            download.on_exit(None, None)
+    
+    def _start(self):
+        if not self._started:
+            self._started = True
+            self._check_stalls()
+        self._fill()
+    
+    def _resize(self, size):
+        self.size = size
+        self._fill()
+        extra = len(self._workers) - size
+        for worker in self._workers:
+            if extra <= 0:
+                break
+            if worker.download is None and not worker.retiring:
+                worker.retiring = True
+                worker.process.close_stdin()
+                extra -= 1
+    
+    def _close(self):
+        self._closed = True
+        for worker in self._workers:
+            if worker.download is None and not worker.retiring:
+                worker.retiring = True
+                worker.process.close_stdin()
+    
+    def _fill(self):
+        if self.available is False or self._closed:
+            return
+        while sum(1 for worker in self._workers if not worker.retiring) < self.size:
+            self._spawn()
+    
+    def _spawn(self):
+        worker = PoolWorker()
+        worker.process = self.supervisor.start(
+            worker_command(),
+            lambda line: self._on_line(worker, line),
+            lambda returncode, error: self._on_exit(worker, returncode, error),
+            stdin=True,
+            # Idle between downloads; _check_stalls watches the downloads themselves
+            idle=False
+        )
+        self._workers.append(worker)
+    
+    def _submit(self, download):
+        if self.available is False:
+            self._unavailable(download)
+            return
+        if download.stopped is not None:
+            download.on_exit(None, None)
+            return
+        self._queue.append(download)
+        if not self._started:
+            self._start()
+        self._assign()
+    
+    def _assign(self):
+        for worker in self._workers:
+            if not self._queue:
+                return
+            if worker.ready and worker.download is None and not worker.retiring:
+                download = self._queue.popleft()
+                worker.download = download
+                worker.last_output = time.monotonic()
+                download.worker = worker
+                download.pid = worker.process.pid
+                request = json.dumps({"args": download.args}) + "\n"
+                worker.process.write(request.encode("utf-8"))
+    
+    def _on_line(self, worker, line):
+        worker.last_output = time.monotonic()
+        download = worker.download
+        if line.startswith(WORKER_PREFIX):
+            status = json.loads(line[len(WORKER_PREFIX):])
+            if status.get("ready"):
+                worker.ready = True
+                self.available = True
+                self.version = status.get("version")
+                self._assign()
+            else:
+                self.error = status.get("error")
+        elif line.startswith(WORKER_DONE_PREFIX):
+            worker.download = None
+            if download is not None:
+                download.returncode = json.loads(line[len(WORKER_DONE_PREFIX):])["returncode"]
+                download.on_exit(download.returncode, None)
+            if (self._closed or len(self._workers) > self.size) and not worker.retiring:
+                worker.retiring = True
+                worker.process.close_stdin()
+            self._assign()
+        elif download is not None:
+            download.on_line(line)
+    
+    def _on_exit(self, worker, returncode, error):
+        self._workers.remove(worker)
+        download = worker.download
+        if not worker.ready and self.available is not True:
+            # yt_dlp cannot be imported here; nothing the pool runs will work
+            self.available = False
+            if self.error is None:
+                self.error = error or f"yt_dlp worker exited with code {returncode}"
+            while self._queue:
+                self._unavailable(self._queue.popleft())
+        if download is not None:
+            # The worker died with the download, or was stopped to stop it
+            download.stopped = download.stopped or worker.process.stopped
+            download.returncode = returncode
+            download.on_exit(returncode, error)
+        self._fill()
+        self._assign()
+    
+    def _unavailable(self, download):
+        download.stopped = PROCESS_UNAVAILABLE
+        download.on_exit(None, None)
+    
+    def _check_stalls(self):
+        now = time.monotonic()
+        for worker in self._workers:
+            download = worker.download
+            if download is not None and now - worker.last_output > self.supervisor.idle_timeout:
+                self.stop(download, PROCESS_IDLE)
+        self.supervisor.loop.call_later(
+            min(60, self.supervisor.idle_timeout), self._check_stalls)
+
+class DownloadEngine:
+    """Download queue that runs jobs on a bounded pool of workers.
+
+    Jobs wait in order until one of the max_workers slots is free; running
+    downloads are read by a ProcessSupervisor. When ffmpeg is available,
+    video and audio are downloaded as separate files and the job then moves
+    on to a post-processing stage with postprocess_workers slots of its own,
+    where ffmpeg merges them while the next downloads already run.
+    With backend BACKEND_MODULE, downloads run in a YtDlpWorkerPool instead
+    of a yt-dlp process each, as long as the yt_dlp package can be imported.
+    prefetch_dir, if given, keeps the video info prefetch extracts.
+    Downloads use the formats format_preset (see FORMAT_PRESETS) allows.
+    A download whose throughput drops below throttle_ratio of its baseline
+    is restarted (0 turns this off), with -N throttle_fragments if given.
+    With a scratch_dir, downloads and merges happen there and only the
+    finished file is moved to the save directory.
+    on_update is called with the job, from a background thread, whenever
+    its state or progress changes; on_group_update likewise for playlists.
+    """
+    
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, on_update=None, on_group_update=None,
+                 cache=None, archive=None, journal=None, bandwidth=None,
+                 postprocess_workers=POSTPROCESS_WORKERS, metrics=None, backend=DEFAULT_BACKEND,
+                 prefetch_dir=None, format_preset=DEFAULT_FORMAT_PRESET,
+                 throttle_ratio=THROTTLE_RATIO, throttle_fragments=None, scratch_dir=None):
+        self.max_workers = max(1, max_workers)
+        self.postprocess_workers = max(1, postprocess_workers)
+        # Without ffmpeg yt-dlp downloads a single file and there is nothing to merge
+        self.ffmpeg_path = find_ffmpeg()
+        self.on_update = on_update
+        self.on_group_update = on_group_update
+        self.cache = cache
+        self.archive = archive
+        self.journal = journal
+        self.bandwidth = bandwidth or BandwidthScheduler()
+        self.metrics = metrics or JobMetrics()
+        self.prefetch_dir = prefetch_dir
+        self.format_preset = format_preset
+        self.throttle_ratio = throttle_ratio
+        self.throttle_fragments = throttle_fragments
+        self.scratch_dir = scratch_dir
+        # Recent output of all jobs, for the log window
+        self.output = OutputLog()
+        self._last_rebalance = 0
+        # Reads the output of every running download on a single thread
+        self.supervisor = ProcessSupervisor()
+        self.worker_pool = None
+        if backend == BACKEND_MODULE:
+            self.worker_pool = YtDlpWorkerPool(self.supervisor, self.max_workers)
+            self.worker_pool.start()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._running = []
+        self._merge_pending = []
+        self._merging = []
+        self._finished = []
+        self._groups = []
+        # Jobs that have left each stage, and their total time waiting and working in it
+        self._stage_totals = {
+            "download": {"completed": 0, "wait_time": 0.0, "busy_time": 0.0},
+            "postprocess": {"completed": 0, "wait_time": 0.0, "busy_time": 0.0},
+        }
+        # Cleared when yt-dlp turns out to be too old for --progress-template
+        self.progress_template = True
+        # Set by shutdown; nothing starts any more and the journal is left as it was
+        self._stopping = False
+        if journal is None:
+            # No jobs to come back whose partial downloads should be kept
+            self.clean_scratch()
+    
+    def jobs(self):
+        """All known jobs: downloading, merging, waiting to merge, waiting in queue order, finished"""
+        with self._lock:
+            return (self._running + self._merging + self._merge_pending + self._pending
+                    + self._finished)
+    
+    def groups(self):
+        """All known playlists, in the order they were added"""
+        with self._lock:
+            return list(self._groups)
+    
+    def counts(self):
+        """Number of (running, waiting, finished) jobs; running includes merging"""
+        with self._lock:
+            running = len(self._running) + len(self._merging) + len(self._merge_pending)
+            return running, len(self._pending), len(self._finished)
+    
+    def stage_stats(self):
+        """Queue depth and time spent in the download and post-processing stages.
+
+        For each stage: its number of worker slots, the jobs in it ("active")
+        and queued for it ("waiting"), and for the jobs that have left it,
+        their number and the total seconds they spent queued and in it.
+        """
+        with self._lock:
+            stages = {
+                "download": {"workers": self.max_workers, "active": len(self._running),
+                             "waiting": len(self._pending)},
+                "postprocess": {"workers": self.postprocess_workers,
+                                "active": len(self._merging), "waiting": len(self._merge_pending)},
+            }
+            for name, totals in self._stage_totals.items():
+                stages[name].update(totals)
+        return stages
+    
+    def metrics_snapshot(self):
+        """Job metrics (see JobMetrics.snapshot) including the stage stats"""
+        snapshot = self.metrics.snapshot()
+        snapshot["stages"] = self.stage_stats()
+        return snapshot
+    
+    def metrics_text(self):
+        """Job metrics and stage stats in Prometheus' text format"""
+        return JobMetrics.prometheus(self.metrics.snapshot(), self.stage_stats())
+    
+    def add(self, url, save_dir, refresh=False, priority=DEFAULT_PRIORITY):
+        """Queue a download and start it as soon as a worker is free.
+
+        With refresh, cached metadata for the URL is ignored and replaced.
+        """
+        job = DownloadJob(url, save_dir, refresh=refresh, priority=priority)
+        if not refresh:
+            metadata = self.cached_metadata(url)
+            if metadata:
+                job.video_title = metadata.get("title")
+        if self._check_archive(job):
+            with self._lock:
+                self._finished.append(job)
+            self._notify(job)
+            return job
+        with self._lock:
+            self._pending.append(job)
+        self._notify(job)
+        self._dispatch()
+        return job
+    
+    def add_url(self, url, save_dir, refresh=False, priority=None):
+        """Queue a video, or every entry of a playlist URL.
+
+        priority defaults to DEFAULT_PRIORITY for videos and PLAYLIST_PRIORITY
+        for playlist entries.
+        """
+        if get_playlist_id(url):
+            return self.add_playlist(url, save_dir, refresh=refresh,
+                                     priority=priority or PLAYLIST_PRIORITY)
+        return self.add(url, save_dir, refresh=refresh, priority=priority or DEFAULT_PRIORITY)
+    
+    def idle(self):
+        """True when nothing is running, waiting or still being expanded"""
+        with self._lock:
+            return (not self._running and not self._pending
+                    and not self._merging and not self._merge_pending
+                    and not any(group.expanding for group in self._groups))
+    
+    def add_playlist(self, url, save_dir, refresh=False, priority=PLAYLIST_PRIORITY):
+        """Expand a playlist in the background and queue one job per entry"""
+        group = PlaylistGroup(url, save_dir, refresh=refresh)
+        group.priority = priority
+        with self._lock:
+            self._groups.append(group)
+        self._notify_group(group)
+        thread = threading.Thread(target=self._expand_playlist, args=(group,), daemon=True)
+        thread.start()
+        return group
+    
+    def retry(self, job):
+        """Queue a failed or cancelled job again"""
+        with self._lock:
+            if job not in self._finished or job.state == JOB_DONE:
+                return False
+            self._finished.remove(job)
+            job.reset()
+            self._pending.append(job)
+        self._notify(job)
+        self._dispatch()
+        return True
+    
+    def retry_failed(self, group):
+        """Queue all failed or cancelled entries of a playlist again"""
+        group.cancelled = False
+        for job in group.failed_jobs():
+            self.retry(job)
+    
+    def cancel_group(self, group):
+        """Cancel a playlist: stop reading it and cancel all of its entries"""
+        group.cancelled = True
+        for job in list(group.jobs):
+            self.cancel(job)
+        self._notify_group(group)
+    
+    def move(self, job, offset):
+        """Move a waiting job up (negative offset) or down the queue"""
+        with self._lock:
+            if job not in self._pending:
+                return False
+            index = self._pending.index(job)
+            new_index = max(0, min(len(self._pending) - 1, index + offset))
+            self._pending.insert(new_index, self._pending.pop(index))
+        return True
+    
+    def remove(self, job):
+        """Drop a waiting or finished job from the queue"""
+        with self._lock:
+            for jobs in (self._pending, self._finished):
+                if job in jobs:
+                    jobs.remove(job)
+                    break
+            else:
+                return False
+        self._remove_scratch(job)
+        if self.journal is not None:
+            self.journal.forget(job.key)
+        return True
+    
+    def clear_finished(self):
+        """Forget all finished jobs and playlists and return the jobs"""
+        with self._lock:
+            finished, self._finished = self._finished, []
+            cleared = [group for group in self._groups if group.finished]
+            self._groups = [group for group in self._groups if not group.finished]
+        for job in finished:
+            self._remove_scratch(job)
+        if self.journal is not None:
+            for item in finished + cleared:
+                self.journal.forget(item.key)
+        return finished
+    
+    def cancel(self, job):
+        """Cancel a waiting or running job"""
+        process = None
+        with self._lock:
+            if job in self._pending:
+                self._pending.remove(job)
+                self._finished.append(job)
+                job.cancelled = True
+                job.set_state(JOB_CANCELLED, "Download cancelled")
+            elif job in self._merge_pending:
+                # The downloaded streams are left on disk
+                self._merge_pending.remove(job)
+                self._finished.append(job)
+                job.cancelled = True
+                job.set_state(JOB_CANCELLED, "Download cancelled")
+            elif job in self._running or job in self._merging:
+                job.cancelled = True
+                process = job.process
+            else:
+                return
+        if process:
+            try:
+                process.terminate()
+            except OSError:
+                pass
+        self._notify(job)
+    
+    def cancel_all(self):
+        for job in self.jobs():
+            if not job.finished:
+                self.cancel(job)
+    
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
+        """Stop every download and merge, for the app to exit; returns True if all have ended.
+
+        Unlike cancel_all, this leaves the journal and the partial files as
+        they were, so the next start resumes the jobs. Waits up to timeout
+        seconds for the processes to end, then closes the supervisor and
+        the journal.
+        """
+        with self._lock:
+            self._stopping = True
+            jobs = self._running + self._merging
+        for job in jobs:
+            process = job.process
+            if process:
+                try:
+                    process.terminate()
+                except OSError:
+                    pass
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                stopped = not self._running and not self._merging
+            if stopped or time.monotonic() >= deadline:
+                break
+            time.sleep(0.05)
+        # The pool's workers are supervised too
+        self.supervisor.close(max(0, deadline - time.monotonic()))
+        if self.journal is not None:
+            # Writes out the lines still queued
+            self.journal.close()
+        return stopped
+    
+    def set_priority(self, job, priority):
+        """Change a job's priority; running jobs get their new bandwidth share"""
+        job.priority = priority
+        self._notify(job)
+        self._rebalance()
+    
+    def set_format_preset(self, name):
+        """Use one of FORMAT_PRESETS for downloads that start from now on; raises ValueError"""
+        if name not in FORMAT_PRESETS:
+            raise ValueError(f"unknown format preset {name!r}")
+        self.format_preset = name
+    
+    def plan(self, metadata):
+        """The FormatPlan the current preset makes of a video's metadata, or None"""
+        if not metadata or not metadata.get("formats"):
+            return None
+        return plan_formats(metadata["formats"], FORMAT_PRESETS[self.format_preset],
+                            metadata.get("duration"), can_merge=self.ffmpeg_path is not None)
+    
+    def set_bandwidth_schedule(self, text):
+        """Apply a bandwidth schedule such as "09:00-17:00=2M, 8M"; raises ValueError"""
+        self.bandwidth = BandwidthScheduler.parse(text)
+        self._rebalance(force=True)
+    
+    def _rebalance(self, force=False):
+        """Split the bandwidth cap between the downloading jobs again.
+
+        Jobs whose limit changed noticeably are restarted with the new
+        --limit-rate; yt-dlp continues from the .part file. To keep restarts
+        rare, a job is restarted at most every REBALANCE_MIN_INTERVAL
+        seconds unless force is set.
+        """
+        now = time.monotonic()
+        self._last_rebalance = now
+        restart = []
+        with self._lock:
+            downloading = [job for job in self._running if job.state == JOB_RUNNING]
+            for job, (limit, _) in self.bandwidth.split(downloading).items():
+                if (job.process is None or job.restarting or job.cancelled
+                        or not limit_changed(job.rate_limit, limit)):
+                    continue
+                if force or now - job.started_at >= REBALANCE_MIN_INTERVAL:
+                    job.restarting = True
+                    # Its throughput is measured anew under the new limit
+                    job.throughput.reset()
+                    restart.append(job)
+        for job in restart:
+            job.set_state(JOB_RUNNING, "Adjusting speed limit...")
+            self._notify(job)
+            try:
+                job.process.terminate()
+            except (AttributeError, OSError):
+                pass
+    
+    def _check_throttle(self, job):
+        """Restart a download on a new connection if its throughput has collapsed.
+
+        Also logs how fast it went after the last such restart, once known.
+        The baseline is measured anew whenever another download starts or
+        ends or the job's rate limit changes, as its fair rate changes with
+        them, and is never above the rate limit.
+        """
+        with self._lock:
+            downloading = sum(1 for other in self._running if other.state == JOB_RUNNING)
+        context = (downloading, job.rate_limit)
+        if context != job.throughput_context:
+            job.throughput_context = context
+            job.throughput.reset()
+            return
+        rate, baseline = job.throughput.rate(), job.throughput.baseline()
+        if rate is None:
+            return
+        if baseline and job.rate_limit:
+            baseline = min(baseline, job.rate_limit)
+        last = job.throttle_restarts[-1] if job.throttle_restarts else None
+        if last is not None and last["after"] is None:
+            last["after"] = rate
+            log.info("Job %s (%s): %s/s after throttle restart %d (%s/s before it, baseline %s/s)",
+                     job.id, job.video_id, format_size(rate), len(job.throttle_restarts),
+                     format_size(last["throttled"]), format_size(last["baseline"]))
+        if (not self.throttle_ratio or not baseline or rate >= self.throttle_ratio * baseline
+                or job.process is None or job.restarting or job.cancelled
+                or len(job.throttle_restarts) >= THROTTLE_MAX_RESTARTS):
+            return
+        now = time.monotonic()
+        if now < job.throttle_retry_at:
+            return
+        restarts = len(job.throttle_restarts) + 1
+        job.throttle_retry_at = now + THROTTLE_BACKOFF * 2 ** (restarts - 1)
+        if self.throttle_fragments:
+            job.concurrent_fragments = self.throttle_fragments
+        job.throttle_restarts.append({
+            "time": time.time(),
+            "baseline": baseline,
+            "throttled": rate,
+            "after": None,
+            "fragments": job.concurrent_fragments,
+        })
+        log.info("Job %s (%s): throttled to %s/s (baseline %s/s); restarting, %d of %d%s",
+                 job.id, job.video_id, format_size(rate), format_size(baseline), restarts,
+                 THROTTLE_MAX_RESTARTS,
+                 f", -N {job.concurrent_fragments}" if job.concurrent_fragments else "")
+        job.restarting = True
+        job.set_state(JOB_RUNNING, f"Throttled to {format_size(rate)}/s, reconnecting...")
+        try:
+            job.process.terminate()
+        except (AttributeError, OSError):
+            pass
+    
+    def set_max_workers(self, max_workers):
+        """Change the number of parallel downloads; extra jobs start right away"""
+        self.max_workers = max(1, max_workers)
+        if self.worker_pool is not None:
+            self.worker_pool.resize(self.max_workers)
+        self._dispatch()
+    
+    def _notify(self, job):
+        if self.journal is not None and not self._stopping:
+            self.journal.write(job.journal_record())
+        if self.on_update:
+            self.on_update(job)
+        if job.group is not None:
+            self._notify_group(job.group)
+    
+    def _notify_group(self, group):
+        if self.journal is not None and not self._stopping:
+            self.journal.write(group.journal_record())
+        if self.on_group_update:
+            self.on_group_update(group)
+    
+    def resume(self):
+        """Bring back the queue a previous run left behind, as recorded in the journal.
+
+        Unfinished jobs are queued again, and yt-dlp continues them from the
+        .part files they left; failed and cancelled jobs come back finished,
+        ready to be retried. Playlists that were still being read are read
+        again. Returns the number of jobs queued.
+        """
+        if self.journal is None:
+            return 0
+        records = self.journal.records()
+        groups = {}
+        for record in records:
+            if record["type"] != "playlist":
+                continue
+            if record["expanding"]:
+                self.journal.forget(record["key"])
+                self.add_playlist(record["url"], record["save_dir"], refresh=record["refresh"])
+                continue
+            group = PlaylistGroup(record["url"], record["save_dir"], refresh=record["refresh"])
+            group.key = record["key"]
+            group.title = record["title"]
+            group.expanding = False
+            group.message = None
+            groups[group.key] = group
+        
+        pending = []
+        finished = []
+        for record in records:
+            if record["type"] != "job" or record["state"] == JOB_DONE:
+                continue
+            job = DownloadJob(record["url"], record["save_dir"], group=groups.get(record["playlist"]),
+                              refresh=record["refresh"],
+                              priority=record.get("priority", DEFAULT_PRIORITY))
+            job.key = record["key"]
+            job.video_title = record["title"]
+            if record["state"] in FINISHED_STATES:
+                job.set_state(record["state"], record["message"])
+                finished.append(job)
+            else:
+                if record["state"] != JOB_QUEUED:
+                    job.message = "Waiting to resume..."
+                pending.append(job)
+            if job.group is not None:
+                job.group.jobs.append(job)
+        
+        with self._lock:
+            self._groups.extend(group for group in groups.values() if group.jobs)
+            self._pending.extend(pending)
+            self._finished.extend(finished)
+        for job in pending + finished:
+            self._notify(job)
+        self.clean_scratch()
+        self._dispatch()
+        return len(pending)
+    
+    def resolve(self, url, refresh=False):
+        """Return the metadata for a video or playlist URL, or None if it can't be read.
+
+        The metadata cache is used unless refresh is set; otherwise yt-dlp
+        extracts it (flat for playlists) and the cache is updated.
+        """
+        key = metadata_key(url)
+        if self.cache is not None and key and not refresh:
+            metadata = self.cache.get(key)
+            if metadata is not None:
+                return metadata
+        
+        if get_playlist_id(url):
+            cmd = build_playlist_command(find_yt_dlp(), url)
+        else:
+            cmd = build_metadata_command(find_yt_dlp(), url)
+        info = self._extract(cmd)
+        if info is None:
+            return None
+        metadata = summarize_info(info)
+        
+        if self.cache is not None and key:
+            self.cache.put(key, metadata, replace=True)
+        return metadata
+    
+    def _extract(self, cmd, request=None):
+        """Run a yt-dlp metadata command and return the JSON it printed, or None.
+
+        With a PrefetchRequest, cancelling it stops yt-dlp.
+        """
+        try:
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                **process_group_options()
+            )
+        except OSError:
+            return None
+        if request is not None:
+            request.attach(process)
+        try:
+            stdout, _ = process.communicate(timeout=120)
+        except subprocess.TimeoutExpired:
+            kill_process_tree(process.pid, force=True)
+            process.communicate()
+            return None
+        if process.returncode != 0:
+            return None
+        try:
+            return json.loads(stdout)
+        except ValueError:
+            return None
+    
+    def prefetch(self, url, on_done, refresh=False):
+        """Look up a URL's metadata in the background, ahead of its download.
+
+        Meant for a URL that was just entered: on_done(metadata) is called
+        from a background thread with what resolve returns, unless the
+        returned PrefetchRequest is cancelled first. For a video, the full
+        info yt-dlp extracted is also kept in prefetch_dir, and a download
+        of it that starts within PREFETCH_TTL seconds loads it from there
+        instead of extracting the page again.
+        """
+        request = PrefetchRequest(url, refresh)
+        threading.Thread(target=self._prefetch, args=(request, on_done), daemon=True).start()
+        return request
+    
+    def _prefetch(self, request, on_done):
+        url = request.url
+        path = self._info_json_path(get_video_id(url))
+        if get_playlist_id(url) or path is None:
+            # Nothing for a download to load; the metadata cache is all there is
+            metadata = self.resolve(url, refresh=request.refresh)
+        else:
+            metadata = None if request.refresh else self.cached_metadata(url)
+            if metadata is None or self.prefetched_info(get_video_id(url)) is None:
+                metadata = None
+                info = self._extract(build_metadata_command(find_yt_dlp(), url), request)
+                if info is not None:
+                    metadata = summarize_info(info)
+                    self._save_info(path, info)
+                    if self.cache is not None:
+                        self.cache.put(metadata_key(url), metadata, replace=True)
+        if not request.cancelled:
+            on_done(metadata)
+    
+    def _info_json_path(self, video_id):
+        if self.prefetch_dir is None or not video_id:
+            return None
+        return os.path.join(self.prefetch_dir, video_id + ".info.json")
+    
+    def prefetched_info(self, video_id):
+        """Path of the info a prefetch extracted for a video, or None if there is none this recent"""
+        path = self._info_json_path(video_id)
+        try:
+            if path is not None and time.time() - os.path.getmtime(path) < PREFETCH_TTL:
+                return path
+        except OSError:
+            pass
+        return None
+    
+    def _save_info(self, path, info):
+        """Write a prefetched info file, and remove those too old to be used"""
+        try:
+            os.makedirs(self.prefetch_dir, exist_ok=True)
+            now = time.time()
+            for name in os.listdir(self.prefetch_dir):
+                other = os.path.join(self.prefetch_dir, name)
+                if now - os.path.getmtime(other) >= PREFETCH_TTL:
+                    os.remove(other)
+            temp_path = path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(info, f)
+            os.replace(temp_path, path)
+        except OSError:
+            pass
+    
+    def _check_archive(self, job):
+        """Finish a job right away if the archive has its video; returns True if so"""
+        if self.archive is None or not job.video_id:
+            return False
+        record = self.archive.get(job.video_id)
+        if record is None:
+            return False
+        job.already_downloaded = True
+        job.downloaded_file_path = record["path"]
+        job.downloaded_filename = os.path.basename(record["path"])
+        job.format_id = record["format"]
+        job.progress = 100
+        job.downloaded_bytes = job.total_bytes = record["size"] or 0
+        if not job.video_title:
+            job.video_title = os.path.splitext(job.downloaded_filename)[0]
+        job.set_state(JOB_DONE, "Already downloaded")
+        return True
+    
+    def cached_metadata(self, url):
+        """Return cached metadata for a URL without running yt-dlp, or None"""
+        key = metadata_key(url)
+        if self.cache is None or not key:
+            return None
+        return self.cache.get(key)
+    
+    def _expand_playlist(self, group):
+        """List a playlist's entries with flat extraction and queue them"""
+        playlist = self.resolve(group.url, refresh=group.refresh)
+        
+        group.expanding = False
+        if group.cancelled:
+            group.message = "Playlist cancelled"
+            self._notify_group(group)
+            return
+        if not playlist:
+            group.message = "Could not read playlist. Please check the URL and try again."
+            self._notify_group(group)
+            return
+        
+        group.title = playlist.get("title")
+        download_archive = None
+        if self.archive is not None:
+            # Let yt-dlp skip entries we already have, too
+            try:
+                download_archive = self.archive.write_yt_dlp_archive(
+                    os.path.join(os.path.dirname(self.archive.path), "archive.txt"))
+            except OSError:
+                pass
+        jobs = []
+        for entry in playlist.get("entries") or []:
+            job = DownloadJob(entry["url"], group.save_dir, group=group, refresh=group.refresh,
+                              priority=group.priority)
+            job.video_title = entry.get("title")
+            job.download_archive = download_archive
+            jobs.append(job)
+        group.jobs = jobs
+        group.message = None
+        with self._lock:
+            for job in jobs:
+                if self._check_archive(job):
+                    self._finished.append(job)
+                else:
+                    self._pending.append(job)
+        for job in jobs:
+            self._notify(job)
+        self._notify_group(group)
+        self._dispatch()
+    
+    def _dispatch(self):
+        """Start waiting jobs while there are free worker slots"""
+        started = []
+        with self._lock:
+            while (self._pending and len(self._running) < self.max_workers
+                   and not self._stopping):
+                job = self._pending.pop(0)
+                self._running.append(job)
+                started.append(job)
+        for job in started:
+            try:
+                running = self._start(job)
+            except Exception as e:
+                job.set_state(JOB_FAILED, f"An error occurred: {str(e)}")
+                running = False
+            if not running:
+                self._finish(job)
+    
+    def _scratch_path(self, job):
+        """The job's directory in the scratch directory, or None without one"""
+        if self.scratch_dir is None:
+            return None
+        return os.path.join(self.scratch_dir, job.key)
+    
+    def _remove_scratch(self, job):
+        path = self._scratch_path(job)
+        if path is not None:
+            shutil.rmtree(path, ignore_errors=True)
+    
+    def clean_scratch(self):
+        """Remove what downloads that are no longer known left in the scratch directory"""
+        if self.scratch_dir is None:
+            return 0
+        return clean_scratch_dir(self.scratch_dir, {job.key for job in self.jobs()})
+    
+    def _check_disk_space(self, job):
+        """Why the job's download would not fit on disk, or None if it fits or its size is unknown"""
+        size = job.plan.size if job.plan else None
+        if not size:
+            metadata = self.cached_metadata(job.url)
+            size = metadata.get("filesize") if metadata else None
+        if not size:
+            return None
+        # Merging needs room for the streams and the merged file at once
+        working = size * 2 if job.separate_streams else size
+        needed = {}
+        if job.scratch_dir:
+            needed[self.scratch_dir] = working
+            needed[job.save_dir] = size
+        else:
+            needed[job.save_dir] = working
+        # Directories on the same disk need room for both
+        disks = {}
+        for directory, amount in needed.items():
+            try:
+                device = os.stat(directory).st_dev
+                free = shutil.disk_usage(directory).free
+            except OSError:
+                continue
+            disk = disks.setdefault(device, [directory, free, 0])
+            disk[2] += amount
+        for directory, free, amount in disks.values():
+            if free < amount + DISK_SPACE_MARGIN:
+                return (f"Not enough disk space in {directory}: about {format_size(amount)}"
+                        f" needed, {format_size(free)} free")
+        return None
+    
+    def _finish(self, job):
+        """Move a job that has ended to the finished list and start the next one"""
+        job.process = None
+        if job.state == JOB_CANCELLED:
+            self._remove_scratch(job)
+        job.enter_phase(None)
+        self._end_download(job)
+        job.trim_output()
+        with self._lock:
+            self._running.remove(job)
+            self._finished.append(job)
+        self._record_metrics(job)
+        self._notify(job)
+        self._dispatch()
+        self._rebalance()
+    
+    def _start(self, job):
+        """Start the yt-dlp process for a job; returns False if the job ended without one.
+
+        The process's output is read by the supervisor, whose thread calls
+        on_line for every line and on_exit when the process has ended.
+        """
+        if self._stopping:
+            # A restart after shutdown stopped the process; the journal still
+            # has the job for the next start
+            return False
+        job.enter_phase("resolve")
+        # Another job may have downloaded the same video in the meantime
+        if self._check_archive(job):
+            return False
+        
+        job.set_state(JOB_RUNNING, "Starting download...")
+        self._notify(job)
+        
+        save_dir = job.save_dir
+        if not os.path.exists(save_dir):
+            try:
+                os.makedirs(save_dir, exist_ok=True)
+            except Exception as e:
+                job.set_state(JOB_FAILED, f"Cannot create save directory: {str(e)}")
+                return False
+        job.scratch_dir = self._scratch_path(job)
+        if job.scratch_dir is not None:
+            try:
+                os.makedirs(os.path.join(job.scratch_dir, "temp"), exist_ok=True)
+            except OSError as e:
+                job.set_state(JOB_FAILED, f"Cannot create scratch directory: {str(e)}")
+                return False
+        
+        # Get path to yt-dlp.exe; a worker pool that has yt_dlp does without it
+        yt_dlp_path = find_yt_dlp()
+        pool = self.worker_pool
+        if pool is not None and pool.available is False:
+            pool = None
+        
+        if pool is None and not os.path.exists(yt_dlp_path):
+            job.set_state(JOB_FAILED, f"yt-dlp.exe not found at: {yt_dlp_path}")
+            return False
+        
+        # Prepare command - a single invocation reports the title, id and
+        # final file path alongside the download itself
+        progress_template = self.progress_template
+        with self._lock:
+            downloading = [other for other in self._running if other.state == JOB_RUNNING]
+        job.rate_limit, job.bandwidth_share = self.bandwidth.split(downloading)[job]
+        if job.rate_limit is None:
+            job.bandwidth_share = None
+        job.separate_streams = self.ffmpeg_path is not None
+        # A video looked up when it was pasted needs no second extraction
+        job.info_json = None if job.refresh else self.prefetched_info(job.video_id)
+        # With its format list known, the formats are picked here; otherwise
+        # yt-dlp picks them within the preset's limits
+        job.plan = None if job.refresh else self.plan(self.cached_metadata(job.url))
+        if job.plan is not None:
+            format_spec = ("," if job.separate_streams else "+").join(job.plan.format_ids)
+            job.message = f"Starting download: {describe_plan(job.plan)}"
+        else:
+            format_spec = format_selector(FORMAT_PRESETS[self.format_preset], job.separate_streams)
+        shortfall = self._check_disk_space(job)
+        if shortfall is not None:
+            job.set_state(JOB_FAILED, shortfall)
+            return False
+        if job.scratch_dir is not None:
+            # Partial files stay on the scratch disk until complete
+            cmd = build_download_command(yt_dlp_path, job.url, job.scratch_dir, progress_template,
+                                         job.download_archive, job.rate_limit,
+                                         job.separate_streams, job.info_json, format_spec,
+                                         job.concurrent_fragments,
+                                         os.path.join(job.scratch_dir, "temp"))
+        else:
+            cmd = build_download_command(yt_dlp_path, job.url, save_dir, progress_template,
+                                         job.download_archive, job.rate_limit,
+                                         job.separate_streams, job.info_json, format_spec,
+                                         job.concurrent_fragments)
+        
+        if job.cancelled:
+            job.set_state(JOB_CANCELLED, "Download cancelled")
+            return False
+        
+        progress_reached_100 = False
+        template_unsupported = False
+        # Set once the before_dl --print line arrives, i.e. a download starts
+        info_printed = False
+        # Set by on_start, before the supervisor can call on_line or on_exit
+        process = None
+        
+        def on_start(started):
+            nonlocal process
+            process = started
+            job.process = started
+        
+        def on_line(line):
+            nonlocal progress_reached_100, template_unsupported, info_printed
+            if job.cancelled:
+                return
+            
+            line = line.strip()
+            if not line:
+                return
+            
+            if time.monotonic() - self._last_rebalance >= REBALANCE_CHECK_INTERVAL:
+                self._rebalance()
+            
+            # Update progress
+            record = parse_progress_line(line)
+            if record is not None:
+                if record.phase == PHASE_POSTPROCESS:
+                    job.enter_phase("move" if "MoveFiles" in line else "postprocess")
+                elif job.phase != "download":
+                    job.enter_phase("download")
+                job.apply_progress(record)
+                if record.phase == PHASE_DOWNLOAD:
+                    job.throughput.add(job.downloaded_bytes)
+                    self._check_throttle(job)
+                if record.phase == PHASE_POSTPROCESS:
+                    progress_reached_100 = True
+                elif job.restarting:
+                    # Keep the message saying why it restarts
+                    pass
+                elif job.progress >= 100:
+                    progress_reached_100 = True
+                    # Check if process is still running (merging/processing)
+                    if process.poll() is None:
+                        job.set_state(JOB_FINISHING, "Stand by - finishing up...")
+                    else:
+                        job.set_state(JOB_RUNNING, job.progress_text())
+                else:
+                    job.set_state(JOB_RUNNING, job.progress_text())
+                self._notify(job)
+                return
+            
+            self._record_output(job, line)
+            printed = parse_print_line(line)
+            if printed is not None:
+                if printed[0] == "info":
+                    # Extraction is over; the download starts
+                    info_printed = True
+                    job.enter_phase("download")
+                elif printed[0] == "postprocess" and job.phase != "move":
+                    job.enter_phase("postprocess")
+                elif printed[0] == "filepath":
+                    job.enter_phase(None)
+                job.handle_print_line(*printed)
+                if printed[0] == "info" and self.cache is not None and job.video_id:
+                    # Remember what the download extracted for the next time this video is added
+                    self.cache.put(
+                        "video:" + job.video_id,
+                        {"id": job.video_id, "title": job.video_title, "duration": job.duration},
+                        replace=job.refresh
+                    )
+                self._notify(job)
+                return
+            
+            if "no such option: --progress-template" in line:
+                template_unsupported = True
+            
+            # Parse video info (title, filename)
+            job.parse_video_info(line)
+            
+            # If we hit 100% and process is still running, show finishing message
+            if progress_reached_100 and process.poll() is None:
+                if '[Merger]' in line or '[ExtractAudio]' in line or 'Merging' in line:
+                    job.enter_phase("postprocess")
+                    job.set_state(JOB_FINISHING, "Stand by - finishing up...")
+                elif '[download]' not in line.lower():
+                    job.set_state(JOB_FINISHING, "Stand by - finishing up...")
+            elif '[download]' in line.lower():
+                # Update label with current status
+                job.message = line[:60] + "..." if len(line) > 60 else line
+            self._notify(job)
+        
+        def on_exit(returncode, error):
+            job.enter_phase(None)
+            if returncode == 0 and job.download_archive and not info_printed:
+                # yt-dlp found the video in the archive and skipped it; --print
+                # implies --quiet, so it does not say so
+                job.already_downloaded = True
+            try:
+                if job.restarting and not job.cancelled:
+                    # Stopped for a new rate limit or a new connection; continue
+                    # from the .part file
+                    job.restarting = False
+                    job.process = None
+                    if self._start(job):
+                        return
+                elif process.stopped == PROCESS_UNAVAILABLE and not job.cancelled:
+                    # The worker pool cannot import yt_dlp; run the executable
+                    job.process = None
+                    if self._start(job):
+                        return
+                elif template_unsupported and progress_template and not job.cancelled:
+                    # Older yt-dlp builds reject --progress-template; run again and
+                    # parse the human-readable progress lines instead
+                    self.progress_template = False
+                    job.process = None
+                    if self._start(job):
+                        return
+                elif (job.info_json and returncode not in (0, None) and process.stopped is None
+                        and not job.cancelled):
+                    # The prefetched stream URLs may have expired; extract the page after all
+                    try:
+                        os.remove(job.info_json)
+                    except OSError:
+                        pass
+                    job.process = None
+                    if self._start(job):
+                        return
+                elif self._complete(job, returncode, error, process.stopped):
+                    # The streams are on disk; free the download slot while they are merged
+                    self._queue_postprocess(job)
+                    return
+            except Exception as e:
+                job.set_state(JOB_FAILED, f"An error occurred: {str(e)}")
+            self._finish(job)
+        
+        job.enter_phase("extract")
+        job.started_at = time.monotonic()
+        if job.download_started_at is None:
+            job.download_started_at = job.started_at
+        job.restarting = False
+        job.throughput.restart()
+        if pool is not None:
+            # The worker gets yt-dlp's arguments without the executable
+            pool.run(cmd[1:], on_line, on_exit, on_start=on_start)
+        else:
+            self.supervisor.start(cmd, on_line, on_exit, on_start=on_start)
+        self._rebalance()
+        return True
+    
+    def _complete(self, job, returncode, error, stopped):
+        """Set the final state of a job whose process has ended.
+
+        Returns True if, instead, its streams still need to be merged.
+        """
+        if job.cancelled:
+            job.set_state(JOB_CANCELLED, "Download cancelled")
+        elif error is not None:
+            job.set_state(JOB_FAILED, f"An error occurred: {error}")
+        elif stopped == PROCESS_IDLE:
+            job.set_state(JOB_FAILED, "Download stalled: no output from yt-dlp for "
+                          f"{format_eta(self.supervisor.idle_timeout)}")
+        elif returncode == 0:
+            job.progress = 100
+            if job.already_downloaded and self._check_archive(job):
+                # yt-dlp skipped it because of --download-archive
+                return False
+            if self._needs_merge(job):
+                return True
+            if job.scratch_dir and (job.stream_files or job.downloaded_file_path):
+                # The file still has to leave the scratch directory
+                return True
+            if job.stream_files:
+                # A single stream; nothing to merge, it only needs its final name
+                path = merged_output_path(job.stream_files)
+                if path != job.stream_files[0]:
+                    path = link_unused_name(job.stream_files[0], os.path.dirname(path),
+                                            os.path.basename(path))
+                job.downloaded_file_path = path
+                job.downloaded_filename = os.path.basename(path)
+            self._mark_done(job)
+        elif job.error_line:
+            job.set_state(JOB_FAILED, "Download failed: " + job.error_line[len("ERROR:"):].strip())
+        else:
+            job.set_state(JOB_FAILED, "Download failed. Please check the URL and try again.")
+        return False
+    
+    def _needs_merge(self, job):
+        """True if ffmpeg has to merge the job's streams, or convert its single stream"""
+        if len(job.stream_files) > 1:
+            return True
+        # A single stream that needs another container
+        return bool(job.stream_files and job.plan is not None and job.plan.postprocess != "none"
+                    and self.ffmpeg_path)
+    
+    def _mark_done(self, job):
+        """Record a job whose file is complete in the archive and mark it done"""
+        # If yt-dlp never reported a title, fall back to the filename
+        if not job.video_title and job.downloaded_filename:
+            job.video_title = os.path.splitext(job.downloaded_filename)[0]
+        if self.archive is not None and job.video_id and job.downloaded_file_path:
+            self.archive.add(job.video_id, job.downloaded_file_path, job.format_id)
+        job.set_state(JOB_DONE, "Download completed successfully!")
+    
+    def _record_stage(self, stage, wait_time, busy_time):
+        with self._lock:
+            totals = self._stage_totals[stage]
+            totals["completed"] += 1
+            totals["wait_time"] += wait_time
+            totals["busy_time"] += busy_time
+    
+    def _record_metrics(self, job):
+        self.metrics.record(job)
+        self.metrics.save(self.stage_stats())
+    
+    def _record_output(self, job, line):
+        """Keep a line of a job's output for the job, the log window and the log file"""
+        line = line[:OUTPUT_LINE_LENGTH]
+        job.add_output(line)
+        self.output.add(job.id, line)
+        output_log.debug("#%d %s", job.id, line)
+    
+    def _end_download(self, job):
+        """Record the time a job spent queued for and in the download stage"""
+        if job.download_started_at is None or job.download_time is not None:
+            return
+        job.download_time = time.monotonic() - job.download_started_at
+        self._record_stage("download", job.download_started_at - job.queued_at, job.download_time)
+    
+    def _queue_postprocess(self, job):
+        """Hand a downloaded job over to the post-processing stage and start the next download"""
+        job.process = None
+        self._end_download(job)
+        job.postprocess_queued_at = time.monotonic()
+        job.set_state(JOB_FINISHING, "Waiting to merge...")
+        with self._lock:
+            self._running.remove(job)
+            self._merge_pending.append(job)
+        self._notify(job)
+        self._dispatch()
+        self._rebalance()
+        self._dispatch_postprocess()
+    
+    def _dispatch_postprocess(self):
+        """Start waiting merges while there are free post-processing slots"""
+        started = []
+        with self._lock:
+            while (self._merge_pending and len(self._merging) < self.postprocess_workers
+                   and not self._stopping):
+                job = self._merge_pending.pop(0)
+                self._merging.append(job)
+                started.append(job)
+        for job in started:
+            try:
+                running = self._start_merge(job)
+            except Exception as e:
+                job.set_state(JOB_FAILED, f"An error occurred: {str(e)}")
+                running = False
+            if not running:
+                self._finish_postprocess(job)
+    
+    def _finish_postprocess(self, job):
+        """Move a job that has left the post-processing stage to the finished list"""
+        job.process = None
+        if job.state == JOB_CANCELLED:
+            self._remove_scratch(job)
+        if job.postprocess_started_at is not None:
+            job.postprocess_time = time.monotonic() - job.postprocess_started_at
+            self._record_stage("postprocess", job.postprocess_started_at - job.postprocess_queued_at,
+                               job.postprocess_time)
+        job.enter_phase(None)
+        job.trim_output()
+        with self._lock:
+            self._merging.remove(job)
+            self._finished.append(job)
+        self._record_metrics(job)
+        self._notify(job)
+        self._dispatch_postprocess()
+    
+    def _start_merge(self, job):
+        """Start ffmpeg to merge a job's streams; returns False if the job ended without it"""
+        if job.cancelled:
+            job.set_state(JOB_CANCELLED, "Download cancelled")
+            return False
+        
+        if not self._needs_merge(job):
+            # Nothing to merge; the file only has to leave the scratch directory
+            path, name = job.downloaded_file_path, None
+            if job.stream_files:
+                # A single stream, which gets its final name on the way out
+                path = job.stream_files[0]
+                name = os.path.basename(merged_output_path(job.stream_files))
+            job.postprocess_started_at = time.monotonic()
+            self._move_into_place(job, path, name)
+            return True
+        
+        plan = job.plan
+        output = merged_output_path(job.stream_files, plan.container if plan else None)
+        base, ext = os.path.splitext(output)
+        # Merges of videos with the same title may run at the same time
+        temp_output = f"{base}.{job.key}.temp{ext}"
+        cmd = build_merge_command(self.ffmpeg_path, job.stream_files, temp_output,
+                                  plan.transcode if plan else ())
+        action = "Converting" if plan and plan.postprocess == "transcode" else "Merging"
+        errors = []
+        
+        def on_line(line):
+            line = line.strip()
+            if job.cancelled or not line:
+                return
+            if not MERGE_PROGRESS_RE.match(line):
+                # With -loglevel error, anything else ffmpeg prints is a problem
+                errors.append(line)
+                self._record_output(job, line)
+                return
+            percent = parse_merge_progress(line, job.duration)
+            if percent is not None:
+                job.progress = percent
+                job.set_state(JOB_FINISHING, f"{action}... {percent:.0f}%")
+                self._notify(job)
+        
+        def on_exit(returncode, error):
+            try:
+                if job.cancelled:
+                    job.set_state(JOB_CANCELLED, "Download cancelled")
+                elif error is not None:
+                    job.set_state(JOB_FAILED, f"An error occurred: {error}")
+                elif returncode == 0 and os.path.exists(temp_output):
+                    job.enter_phase("move")
+                    for path in job.stream_files:
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                    job.progress = 100
+                    if job.scratch_dir:
+                        self._move_into_place(job, temp_output, os.path.basename(output))
+                        return
+                    path = link_unused_name(temp_output, os.path.dirname(output),
+                                            os.path.basename(output))
+                    job.downloaded_file_path = path
+                    job.downloaded_filename = os.path.basename(path)
+                    self._mark_done(job)
+                else:
+                    detail = errors[-1] if errors else f"ffmpeg exited with code {returncode}"
+                    job.set_state(JOB_FAILED, f"{action} failed: {detail}")
+            except Exception as e:
+                job.set_state(JOB_FAILED, f"An error occurred: {str(e)}")
+            if job.state != JOB_DONE:
+                try:
+                    os.remove(temp_output)
+                except OSError:
+                    pass
+            self._finish_postprocess(job)
+        
+        job.postprocess_started_at = time.monotonic()
+        job.enter_phase("postprocess")
+        job.progress = 0.0
+        job.set_state(JOB_FINISHING, f"{action}...")
+        self._notify(job)
+        self.supervisor.start(cmd, on_line, on_exit,
+                              on_start=lambda process: setattr(job, "process", process))
+        return True
+    
+    def _move_into_place(self, job, path, name=None):
+        """Move a job's finished file from its scratch directory to its save directory, as name if given.
+
+        Copying to another disk can take a while, so this runs on a thread
+        of its own, which then ends the job's post-processing.
+        """
+        job.enter_phase("move")
+        job.set_state(JOB_FINISHING, f"Moving to {job.save_dir}...")
+        self._notify(job)
+        
+        def move():
+            try:
+                cancelled = job.cancelled
+                if not cancelled:
+                    final_path = move_into_place(path, job.save_dir, name)
+                    cancelled = job.cancelled
+                    if cancelled:
+                        # Cancelled while the file was being copied
+                        os.remove(final_path)
+                if cancelled:
+                    job.set_state(JOB_CANCELLED, "Download cancelled")
+                else:
+                    job.downloaded_file_path = final_path
+                    job.downloaded_filename = os.path.basename(final_path)
+                    self._remove_scratch(job)
+                    self._mark_done(job)
+            except OSError as e:
+                job.set_state(JOB_FAILED, f"Could not move the file to {job.save_dir}: {str(e)}")
+            self._finish_postprocess(job)
+        
+        threading.Thread(target=move, daemon=True).start()
+
+class BatchRunner:
+    """Runs a list of URLs without the GUI and reports progress as JSON lines.
+
+    Every line written to out is one JSON object with an "event" field:
+    "job" and "playlist" whenever a download or playlist changes (progress
+    at most every BATCH_PROGRESS_INTERVAL seconds per job), "error" for
+    URLs that are not valid, and a final "summary".
+    """
+    
+    def __init__(self, save_dir, max_workers=DEFAULT_MAX_WORKERS, refresh=False, out=None,
+                 cache=None, archive=None, bandwidth=None, backend=DEFAULT_BACKEND,
+                 format_preset=DEFAULT_FORMAT_PRESET, throttle_ratio=THROTTLE_RATIO,
+                 throttle_fragments=None, scratch_dir=None):
+        self.save_dir = save_dir
+        self.refresh = refresh
+        self.out = out or sys.stdout
+        self.engine = DownloadEngine(
+            max_workers=max_workers,
+            on_update=self.on_job_update,
+            on_group_update=self.on_group_update,
+            cache=cache,
+            archive=archive,
+            bandwidth=bandwidth,
+            backend=backend,
+            format_preset=format_preset,
+            throttle_ratio=throttle_ratio,
+            throttle_fragments=throttle_fragments,
+            scratch_dir=scratch_dir
+        )
+        self._write_lock = threading.Lock()
+        self._last_report = {}
+        self._changed = threading.Event()
+        self.invalid = []
+    
+    def write(self, record):
+        with self._write_lock:
+            self.out.write(json.dumps(record) + "\n")
+            self.out.flush()
+    
+    def due(self, key, state):
+        """True if an update should be written: new state, or enough time since the last one"""
+        now = time.monotonic()
+        last = self._last_report.get(key)
+        if last and last[0] == state and now - last[1] < BATCH_PROGRESS_INTERVAL:
+            return False
+        self._last_report[key] = (state, now)
+        return True
+    
+    def on_job_update(self, job):
+        if self.due(("job", job.id), job.state):
+            self.write(dict(job.as_dict(), event="job"))
+        self._changed.set()
+    
+    def on_group_update(self, group):
+        done, total = group.totals()[:2]
+        if self.due(("playlist", group.id), (group.expanding, done, total)):
+            self.write(dict(group.as_dict(), event="playlist"))
+        self._changed.set()
+    
+    def run(self, urls):
+        """Download every URL and return the process exit code"""
+        for url in urls:
+            if validate_url(url):
+                self.engine.add_url(url, self.save_dir, refresh=self.refresh)
+            else:
+                self.invalid.append(url)
+                self.write({"event": "error", "url": url, "message": "Not a valid YouTube URL"})
+        try:
+            while True:
+                self._changed.clear()
+                if self.engine.idle():
+                    break
+                self._changed.wait(0.5)
+        except KeyboardInterrupt:
+            self.engine.cancel_all()
+            while not self.engine.idle():
+                time.sleep(0.1)
+            self.write(self.summary())
+            return 130
+        summary = self.summary()
+        self.write(summary)
+        return 0 if summary["failed"] == 0 else 1
+    
+    def summary(self):
+        jobs = self.engine.jobs()
+        failed_playlists = [group for group in self.engine.groups() if group.failed]
+        failed = [job for job in jobs if job.state in (JOB_FAILED, JOB_CANCELLED)]
+        return {
+            "event": "summary",
+            "done": sum(1 for job in jobs if job.state == JOB_DONE),
+            "skipped": sum(1 for job in jobs if job.already_downloaded),
+            "failed": len(failed) + len(failed_playlists) + len(self.invalid),
+            "failed_urls": ([job.url for job in failed] + [group.url for group in failed_playlists]
+                            + self.invalid),
+            "stages": self.engine.stage_stats(),
+            "metrics": self.engine.metrics.snapshot(),
+        }
+
+def read_batch_file(path):
+    """URLs from a batch file ("-" for stdin): whitespace separated, # starts a comment"""
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    urls = []
+    for line in lines:
+        urls.extend(line.split("#", 1)[0].split())
+    return urls
+
+def read_daemon_token(create=False):
+    """Return the daemon's API token from the config directory, or None if there is none.
+
+    With create, a new one is written (readable by the user only) if it
+    does not exist yet.
+    """
+    path = os.path.join(get_config_dir(), DAEMON_TOKEN_FILE)
+    try:
+        with open(path, encoding="utf-8") as f:
+            token = f.read().strip()
+        if token:
+            return token
+    except OSError:
+        pass
+    if not create:
+        return None
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token + "\n")
+    return token
+
+class ApiError(Exception):
+    """An error answered to an API client with the given HTTP status"""
+    
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+HTTP_REASONS = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    415: "Unsupported Media Type",
+    431: "Request Header Fields Too Large",
+}
+
+class JobServer:
+    """Local HTTP API in front of a DownloadEngine (daemon mode).
+
+    Requests and responses are JSON:
+        GET    /jobs                      all jobs and playlists, in queue order
+        POST   /jobs                      {"url" or "urls", "save_dir", "refresh", "priority"}
+        GET    /jobs/<id>                 one job
+        DELETE /jobs/<id>                 cancel a job, or forget it once finished
+        POST   /jobs/<id>/<action>        cancel, retry, remove, move ({"offset"})
+                                          or priority ({"priority"})
+        POST   /playlists/<id>/<action>   cancel, or retry its failed entries
+        POST   /cancel-all                cancel everything
+        POST   /clear                     forget finished jobs and playlists
+        POST   /settings                  {"max_workers", "limit_rate", "format_preset"}
+        GET    /stats                     queue depth and times of the download and merge stages
+        GET    /metrics                   job metrics in Prometheus' text format
+        GET    /metrics.json              job metrics as JSON
+        GET    /events                    Server-Sent Events: a snapshot, then changes
+
+    Connections are served by a single asyncio loop, so clients and event
+    subscribers cost no threads; only running downloads have one. Changes
+    reported by the engine's worker threads are coalesced like the GUI's
+    and sent to every subscriber at most refresh_rate times per second.
+
+    So that web pages the user visits cannot use the API, request bodies
+    must be application/json, requests from a browser (with an Origin
+    header) must come from the API's own address, and the Host header must
+    name it. With a token, POST and DELETE requests also need it as
+    "Authorization: Bearer <token>". Downloads can only be saved in save_dir
+    or below it.
+    """
+    
+    def __init__(self, engine, save_dir, host=DEFAULT_DAEMON_HOST, port=DEFAULT_DAEMON_PORT,
+                 refresh_rate=DEFAULT_REFRESH_RATE, token=None):
+        self.engine = engine
+        self.engine.on_update = self.on_job_update
+        self.engine.on_group_update = self.on_group_update
+        self.save_dir = save_dir
+        self.token = token
+        self.host = host
+        self.port = port
+        self.refresh_rate = refresh_rate
+        self._dirty_lock = threading.Lock()
+        self._dirty = {}
+        self._subscribers = set()
+        self._order = None
+        self._settings = None
+        self._stats = None
+    
+    def on_job_update(self, job):
+        """Called by the engine, on a worker thread, whenever a job changes"""
+        with self._dirty_lock:
+            self._dirty[("job", job.id)] = job
+    
+    def on_group_update(self, group):
+        with self._dirty_lock:
+            self._dirty[("playlist", group.id)] = group
+    
+    def run(self, on_ready=None):
+        """Serve until interrupted; the caller shuts the engine down"""
+        # Not asyncio.run: making this the main thread's event loop would
+        # move the child watcher to it from the supervisor's loop, which then
+        # never learns that its children have exited once this loop is closed
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.serve(on_ready))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+    
+    async def serve(self, on_ready=None):
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port,
+                                            limit=MAX_REQUEST_LINE)
+        # With port 0 the system picks a free port
+        self.port = server.sockets[0].getsockname()[1]
+        if on_ready:
+            on_ready(self)
+        broadcaster = asyncio.ensure_future(self.broadcast())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            broadcaster.cancel()
+    
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+    
+    @staticmethod
+    def event(kind, data):
+        return f"event: {kind}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+    
+    def snapshot_events(self):
+        """Everything a new subscriber needs to know, as one chunk"""
+        chunks = [self.event("playlist", group.as_dict()) for group in self.engine.groups()]
+        jobs = self.engine.jobs()
+        chunks.extend(self.event("job", job.as_dict()) for job in jobs)
+        chunks.append(self.event("order", {"jobs": [job.id for job in jobs]}))
+        chunks.append(self.event("settings", self.settings()))
+        chunks.append(self.event("stats", self.engine.stage_stats()))
+        return b"".join(chunks)
+    
+    def queue_events(self):
+        """Events for a changed queue order, settings or stage stats since the last call"""
+        chunks = []
+        order = [job.id for job in self.engine.jobs()]
+        if order != self._order:
+            self._order = order
+            chunks.append(self.event("order", {"jobs": order}))
+        settings = self.settings()
+        if settings != self._settings:
+            self._settings = settings
+            chunks.append(self.event("settings", settings))
+        stats = self.engine.stage_stats()
+        if stats != self._stats:
+            self._stats = stats
+            chunks.append(self.event("stats", stats))
+        return chunks
+    
+    async def broadcast(self):
+        """Send coalesced changes to all subscribers, refresh_rate times per second"""
+        last_sent = time.monotonic()
+        while True:
+            await asyncio.sleep(1.0 / self.refresh_rate)
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, {}
+            chunks = [self.event(kind, item.as_dict()) for (kind, _), item in dirty.items()]
+            chunks.extend(self.queue_events())
+            if chunks:
+                self.send(b"".join(chunks))
+            elif time.monotonic() - last_sent >= EVENT_KEEPALIVE:
+                self.send(b": keepalive\n\n")
+            else:
+                continue
+            last_sent = time.monotonic()
+    
+    def send(self, data):
+        for writer in list(self._subscribers):
+            if (writer.transport.is_closing()
+                    or writer.transport.get_write_buffer_size() > MAX_SUBSCRIBER_BACKLOG):
+                self._subscribers.discard(writer)
+                writer.close()
+            else:
+                writer.write(data)
+    
+    async def stream_events(self, reader, writer):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        writer.write(self.snapshot_events())
+        self._subscribers.add(writer)
+        try:
+            # Subscribers send nothing more; end of input means they went away.
+            # Anything they do send is thrown away, a chunk at a time
+            while await reader.read(READ_CHUNK_SIZE):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self._subscribers.discard(writer)
+            writer.close()
+    
+    async def handle_connection(self, reader, writer):
+        try:
+            try:
+                method, path, body = await self.read_request(reader)
+                if method == "GET" and path == "/events":
+                    await self.stream_events(reader, writer)
+                    return
+                status, payload = self.dispatch(method, path, body)
+            except ApiError as e:
+                status, payload = e.status, {"error": str(e)}
+            await self.respond(writer, status, payload)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    
+    async def respond(self, writer, status, payload):
+        if isinstance(payload, str):
+            # Prometheus' text format
+            body = payload.encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = json.dumps(payload).encode("utf-8")
+            content_type = "application/json"
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    
+    @staticmethod
+    async def read_line(reader, status, message):
+        """Read a line of the request head; one longer than MAX_REQUEST_LINE is answered with status"""
+        try:
+            return (await reader.readline()).decode("latin-1")
+        except (ValueError, asyncio.LimitOverrunError):
+            raise ApiError(status, message)
+    
+    def host_names(self):
+        """Names the API may be reached by, or None if it listens on every address"""
+        if self.host in ("", "0.0.0.0", "::"):
+            return None
+        if self.host in ("127.0.0.1", "::1", "localhost"):
+            return {"localhost", "127.0.0.1", "::1"}
+        return {self.host.lower()}
+    
+    def is_own_address(self, netloc):
+        """Whether a host[:port] names this server; without a port it is HTTP's 80"""
+        address = urllib.parse.urlsplit("//" + netloc)
+        try:
+            port = address.port or 80
+        except ValueError:
+            return False
+        names = self.host_names()
+        return (names is None or address.hostname in names) and port == self.port
+    
+    def check_request(self, method, headers):
+        """Refuse requests that may come from a web page rather than an API client"""
+        # A page on a host name rebound to this address still sends that name
+        if self.host_names() is not None and not self.is_own_address(headers.get("host", "")):
+            raise ApiError(403, "Unknown Host")
+        origin = headers.get("origin")
+        if origin is not None:
+            origin = urllib.parse.urlsplit(origin)
+            if origin.scheme != "http" or not self.is_own_address(origin.netloc):
+                raise ApiError(403, "Requests from web pages are not allowed")
+        if self.token is not None and method in ("POST", "DELETE"):
+            scheme, _, token = headers.get("authorization", "").partition(" ")
+            if scheme.lower() != "bearer" or not secrets.compare_digest(token.strip(), self.token):
+                raise ApiError(401, f"Missing or wrong token; see {DAEMON_TOKEN_FILE} in the config folder")
+    
+    async def read_request(self, reader):
+        """Return (method, path, JSON body or None) of the next request"""
+        request_line = (await self.read_line(reader, 400, "Request line too long")).split()
+        if len(request_line) != 3:
+            raise ApiError(400, "Malformed request line")
+        method, target = request_line[0].upper(), request_line[1]
+        headers = {}
+        for count in itertools.count():
+            line = (await self.read_line(reader, 431, "Header line too long")).strip()
+            if not line:
+                break
+            if count >= MAX_REQUEST_HEADERS:
+                raise ApiError(431, "Too many headers")
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        self.check_request(method, headers)
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise ApiError(400, "Invalid Content-Length")
+        if length > MAX_REQUEST_BODY:
+            raise ApiError(413, "Request body too large")
+        body = None
+        if length:
+            content_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+            if content_type != "application/json":
+                raise ApiError(415, "Request body must be application/json")
+            try:
+                body = json.loads(await reader.readexactly(length))
+            except ValueError:
+                raise ApiError(400, "Request body is not valid JSON")
+        path = urllib.parse.urlsplit(target).path.rstrip("/") or "/"
+        return method, path, body
+    
+    def dispatch(self, method, path, body):
+        """Handle a request and return (status, payload)"""
+        parts = path.strip("/").split("/")
+        body = body if isinstance(body, dict) else {}
+        if parts == ["jobs"]:
+            if method == "GET":
+                return 200, self.listing()
+            if method == "POST":
+                return 201, self.submit(body)
+        elif parts[0] == "jobs" and len(parts) in (2, 3):
+            job = self.find_job(parts[1])
+            if len(parts) == 2 and method == "GET":
+                return 200, job.as_dict()
+            if len(parts) == 2 and method == "DELETE":
+                return 200, self.job_action(job, "remove" if job.finished else "cancel", body)
+            if len(parts) == 3 and method == "POST":
+                return 200, self.job_action(job, parts[2], body)
+        elif parts[0] == "playlists" and len(parts) == 3:
+            if method == "POST":
+                return 200, self.playlist_action(self.find_group(parts[1]), parts[2])
+        elif parts == ["cancel-all"]:
+            if method == "POST":
+                self.engine.cancel_all()
+                return 200, {}
+        elif parts == ["clear"]:
+            if method == "POST":
+                return 200, self.clear_finished()
+        elif parts == ["settings"]:
+            if method == "POST":
+                return 200, self.update_settings(body)
+        elif parts == ["stats"]:
+            if method == "GET":
+                return 200, self.engine.stage_stats()
+        elif parts == ["metrics"]:
+            if method == "GET":
+                return 200, self.engine.metrics_text()
+        elif parts == ["metrics.json"]:
+            if method == "GET":
+                return 200, self.engine.metrics_snapshot()
+        else:
+            raise ApiError(404, f"Not found: {path}")
+        raise ApiError(405, f"{method} is not supported for {path}")
+    
+    def settings(self):
+        return {
+            "max_workers": self.engine.max_workers,
+            "limit_rate": self.engine.bandwidth.describe(),
+            "format_preset": self.engine.format_preset,
+        }
+    
+    def update_settings(self, body):
+        if "max_workers" in body:
+            max_workers = body["max_workers"]
+            # bool is an int too, but true is not a number of workers
+            if not isinstance(max_workers, int) or isinstance(max_workers, bool) or max_workers < 1:
+                raise ApiError(400, '"max_workers" must be a positive integer')
+            self.engine.set_max_workers(max_workers)
+        if "limit_rate" in body:
+            try:
+                self.engine.set_bandwidth_schedule(str(body["limit_rate"] or ""))
+            except ValueError as e:
+                raise ApiError(400, str(e))
+        if "format_preset" in body:
+            try:
+                self.engine.set_format_preset(body["format_preset"])
+            except ValueError as e:
+                raise ApiError(400, str(e))
+        return self.settings()
+    
+    def listing(self):
+        return {
+            "jobs": [job.as_dict() for job in self.engine.jobs()],
+            "playlists": [group.as_dict() for group in self.engine.groups()],
+            "settings": self.settings(),
+        }
+    
+    def find_job(self, job_id):
+        for job in self.engine.jobs():
+            if str(job.id) == job_id:
+                return job
+        raise ApiError(404, f"No job {job_id}")
+    
+    def find_group(self, group_id):
+        for group in self.engine.groups():
+            if str(group.id) == group_id:
+                return group
+        raise ApiError(404, f"No playlist {group_id}")
+    
+    def submit(self, body):
+        urls = body.get("urls") if "urls" in body else [body.get("url")]
+        if not isinstance(urls, list) or not urls:
+            raise ApiError(400, 'Give a "url" or a list of "urls"')
+        invalid = [url for url in urls if not isinstance(url, str) or not validate_url(url)]
+        if invalid:
+            raise ApiError(400, f"Not a valid YouTube URL: {', '.join(map(str, invalid))}")
+        save_dir = self.check_save_dir(body.get("save_dir"))
+        refresh = bool(body.get("refresh"))
+        priority = self.check_priority(body.get("priority"))
+        result = {"jobs": [], "playlists": []}
+        for url in urls:
+            item = self.engine.add_url(url, save_dir, refresh=refresh, priority=priority)
+            if isinstance(item, PlaylistGroup):
+                result["playlists"].append(item.as_dict())
+            else:
+                result["jobs"].append(item.as_dict())
+        return result
+    
+    def check_save_dir(self, save_dir):
+        """The directory to save in: save_dir, relative to the server's, which it must be inside"""
+        root = os.path.realpath(self.save_dir)
+        if not save_dir:
+            return self.save_dir
+        if not isinstance(save_dir, str):
+            raise ApiError(400, '"save_dir" must be a string')
+        path = os.path.realpath(os.path.join(root, os.path.expanduser(save_dir)))
+        if os.path.commonpath([root, path]) != root:
+            raise ApiError(403, f'"save_dir" must be inside {root}')
+        return path
+    
+    @staticmethod
+    def check_priority(priority):
+        if priority is not None and priority not in PRIORITY_WEIGHTS:
+            raise ApiError(400, f'"priority" must be one of: {", ".join(PRIORITY_WEIGHTS)}')
+        return priority
+    
+    def job_action(self, job, action, body):
+        if action == "cancel":
+            self.engine.cancel(job)
+        elif action == "priority":
+            priority = self.check_priority(body.get("priority"))
+            if priority is None:
+                raise ApiError(400, 'Give a "priority"')
+            self.engine.set_priority(job, priority)
+        elif action == "retry":
+            if not self.engine.retry(job):
+                raise ApiError(409, "Only failed or cancelled jobs can be retried")
+        elif action == "move":
+            offset = body.get("offset")
+            if not isinstance(offset, int):
+                raise ApiError(400, '"offset" must be an integer')
+            if not self.engine.move(job, offset):
+                raise ApiError(409, "Only waiting jobs can be moved")
+        elif action == "remove":
+            # Like the GUI's Remove button, a waiting job is cancelled first
+            if job.state == JOB_QUEUED:
+                self.engine.cancel(job)
+            if not self.engine.remove(job):
+                raise ApiError(409, "Cancel the job before removing it")
+            self.send(self.event("removed", {"jobs": [job.id], "playlists": []}))
+        else:
+            raise ApiError(404, f"Unknown action: {action}")
+        return job.as_dict()
+    
+    def playlist_action(self, group, action):
+        if action == "cancel":
+            self.engine.cancel_group(group)
+        elif action == "retry":
+            self.engine.retry_failed(group)
+        else:
+            raise ApiError(404, f"Unknown action: {action}")
+        return group.as_dict()
+    
+    def clear_finished(self):
+        groups = self.engine.groups()
+        jobs = self.engine.clear_finished()
+        remaining = self.engine.groups()
+        removed = {
+            "jobs": [job.id for job in jobs],
+            "playlists": [group.id for group in groups if group not in remaining],
+        }
+        self.send(self.event("removed", removed))
+        return removed
+
+class RemoteEngine:
+    """Client for a daemon's JobServer, usable by the GUI in place of a DownloadEngine.
+
+    Jobs and playlists are mirrored from the daemon's event stream, which is
+    read on one background thread; on_update and on_group_update are called
+    from that thread, just as a local engine calls them from its workers.
+    Commands are sent as HTTP requests and their effects arrive as events.
+    A request may take until its timeout when the daemon is slow or gone,
+    so the GUI hands its commands to submit, which sends them in order on
+    a thread of their own.
+    """
+    
+    # Only available in the daemon's own process; finished jobs bring the
+    # tail of their output along
+    cache = None
+    archive = None
+    output = None
+    
+    def __init__(self, url, on_update=None, on_group_update=None, token=None):
+        self.url = url.rstrip("/")
+        # A daemon on this machine wrote its token to the same config folder
+        self.token = token or read_daemon_token()
+        self.on_update = on_update
+        self.on_group_update = on_group_update
+        self.max_workers = DEFAULT_MAX_WORKERS
+        self.bandwidth = BandwidthScheduler()
+        self.format_preset = DEFAULT_FORMAT_PRESET
+        self._stats = {}
+        self.connected = threading.Event()
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._groups = {}
+        self._order = []
+        # (command, on_done) waiting to be sent; the first one is being sent
+        self._commands = deque()
+        self._commands_changed = threading.Condition()
+        threading.Thread(target=self._listen, daemon=True).start()
+        threading.Thread(target=self._send_commands, daemon=True).start()
+    
+    def submit(self, command, on_done=None):
+        """Run command() on the command thread, after the commands submitted before it.
+
+        on_done, if given, is then called on that thread with (result, error);
+        error is the ValueError the command raised, or None.
+        """
+        with self._commands_changed:
+            self._commands.append((command, on_done))
+            self._commands_changed.notify_all()
+    
+    def _send_commands(self):
+        while True:
+            with self._commands_changed:
+                while not self._commands:
+                    self._commands_changed.wait()
+                command, on_done = self._commands[0]
+            try:
+                result, error = command(), None
+            except ValueError as e:
+                result, error = None, e
+            with self._commands_changed:
+                self._commands.popleft()
+                self._commands_changed.notify_all()
+            if on_done is not None:
+                on_done(result, error)
+    
+    def request(self, method, path, payload=None):
+        """Send a command; returns the JSON response, or None if it failed"""
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        request = urllib.request.Request(self.url + path, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return json.loads(response.read())
+        except (OSError, ValueError):
+            return None
+    
+    def _listen(self):
+        while True:
+            try:
+                with urllib.request.urlopen(self.url + "/events",
+                                            timeout=EVENT_KEEPALIVE * 2) as response:
+                    self.connected.set()
+                    kind = None
+                    for raw in response:
+                        line = raw.decode("utf-8").rstrip("\r\n")
+                        if line.startswith("event:"):
+                            kind = line[6:].strip()
+                        elif line.startswith("data:") and kind:
+                            self._apply(kind, json.loads(line[5:]))
+                        elif not line:
+                            kind = None
+            except (OSError, ValueError):
+                pass
+            self.connected.clear()
+            time.sleep(DAEMON_RECONNECT_DELAY)
+    
+    def _apply(self, kind, data):
+        if kind == "job":
+            with self._lock:
+                job = self._jobs.get(data["job"])
+                if job is None:
+                    job = DownloadJob(data["url"], data["save_dir"])
+                    job.id = data["job"]
+                    self._jobs[job.id] = job
+                    group = self._groups.get(data["playlist"])
+                    if group is not None:
+                        job.group = group
+                        group.jobs.append(job)
+            job.update_from(data)
+            if self.on_update:
+                self.on_update(job)
+            if job.group is not None and self.on_group_update:
+                self.on_group_update(job.group)
+        elif kind == "playlist":
+            with self._lock:
+                group = self._groups.get(data["playlist"])
+                if group is None:
+                    group = PlaylistGroup(data["url"], data["save_dir"])
+                    group.id = data["playlist"]
+                    self._groups[group.id] = group
+            group.update_from(data)
+            if self.on_group_update:
+                self.on_group_update(group)
+        elif kind == "order":
+            with self._lock:
+                self._order = data["jobs"]
+        elif kind == "settings":
+            self.max_workers = data["max_workers"]
+            self.bandwidth = BandwidthScheduler.parse(data["limit_rate"])
+            self.format_preset = data["format_preset"]
+        elif kind == "stats":
+            self._stats = data
+        elif kind == "removed":
+            with self._lock:
+                for job_id in data["jobs"]:
+                    self._jobs.pop(job_id, None)
+                for group_id in data["playlists"]:
+                    self._groups.pop(group_id, None)
+    
+    def jobs(self):
+        """All known jobs in the daemon's queue order"""
+        with self._lock:
+            ordered = [self._jobs[job_id] for job_id in self._order if job_id in self._jobs]
+            known = set(self._order)
+            return ordered + [job for job_id, job in self._jobs.items() if job_id not in known]
+    
+    def groups(self):
+        with self._lock:
+            return list(self._groups.values())
+    
+    def counts(self):
+        """Number of (running, waiting, finished) jobs"""
+        jobs = self.jobs()
+        running = sum(1 for job in jobs if job.state in (JOB_RUNNING, JOB_FINISHING))
+        waiting = sum(1 for job in jobs if job.state == JOB_QUEUED)
+        return running, waiting, len(jobs) - running - waiting
+    
+    def stage_stats(self):
+        """The daemon's stage stats, as of its last event"""
+        return self._stats
+    
+    def metrics_snapshot(self):
+        """The daemon's job metrics, or None if it cannot be reached"""
+        return self.request("GET", "/metrics.json")
+    
+    def prefetch(self, url, on_done, refresh=False):
+        """The daemon extracts what it downloads itself; there is nothing to look up ahead"""
+        return None
+    
+    def add_url(self, url, save_dir, refresh=False, priority=None):
+        return self.request("POST", "/jobs", {"url": url, "save_dir": save_dir, "refresh": refresh,
+                                              "priority": priority})
+    
+    def set_priority(self, job, priority):
+        self.request("POST", f"/jobs/{job.id}/priority", {"priority": priority})
+    
+    def set_format_preset(self, name):
+        """Use another format preset in the daemon; raises ValueError if it is unknown"""
+        if name not in FORMAT_PRESETS:
+            raise ValueError(f"unknown format preset {name!r}")
+        settings = self.request("POST", "/settings", {"format_preset": name})
+        if settings is None:
+            raise ValueError("the daemon did not accept it")
+        self.format_preset = settings["format_preset"]
+    
+    def plan(self, metadata):
+        """Formats are planned by the daemon"""
+        return None
+    
+    def set_bandwidth_schedule(self, text):
+        """Apply a bandwidth schedule in the daemon; raises ValueError if it is invalid"""
+        BandwidthScheduler.parse(text)
+        settings = self.request("POST", "/settings", {"limit_rate": text})
+        if settings is None:
+            raise ValueError("the daemon did not accept it")
+        self.bandwidth = BandwidthScheduler.parse(settings["limit_rate"])
+    
+    def retry(self, job):
+        return self.request("POST", f"/jobs/{job.id}/retry") is not None
+    
+    def retry_failed(self, group):
+        self.request("POST", f"/playlists/{group.id}/retry")
+    
+    def cancel_group(self, group):
+        self.request("POST", f"/playlists/{group.id}/cancel")
+    
+    def move(self, job, offset):
+        if self.request("POST", f"/jobs/{job.id}/move", {"offset": offset}) is None:
+            return False
+        # Pick up the new order right away rather than on the next event
+        listing = self.request("GET", "/jobs")
+        if listing is not None:
+            with self._lock:
+                self._order = [item["job"] for item in listing["jobs"]]
+        return True
+    
+    def remove(self, job):
+        if self.request("POST", f"/jobs/{job.id}/remove") is None:
+            return False
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        return True
+    
+    def clear_finished(self):
+        """Forget all finished jobs and playlists and return the jobs"""
+        with self._lock:
+            known = dict(self._jobs)
+        removed = self.request("POST", "/clear")
+        if removed is None:
+            return []
+        # The "removed" event may have arrived before the response
+        jobs = [known[job_id] for job_id in removed["jobs"] if job_id in known]
+        with self._lock:
+            for job_id in removed["jobs"]:
+                self._jobs.pop(job_id, None)
+            for group_id in removed["playlists"]:
+                self._groups.pop(group_id, None)
+        return jobs
+    
+    def cancel(self, job):
+        self.request("POST", f"/jobs/{job.id}/cancel")
+    
+    def cancel_all(self):
+        self.request("POST", "/cancel-all")
+    
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
+        """The downloads go on in the daemon; waits up to timeout seconds for the commands still queued"""
+        with self._commands_changed:
+            return self._commands_changed.wait_for(lambda: not self._commands, timeout)
+    
+    def set_max_workers(self, max_workers):
+        response = self.request("POST", "/settings", {"max_workers": max(1, max_workers)})
+        if response is not None:
+            self.max_workers = response["max_workers"]
+
+class UIUpdateChannel:
+    """Hands updates from worker threads to the Tk main loop.
+
+    Workers push the job or playlist that changed; only Tk's own thread
+    touches widgets. Updates are drained on a root.after timer at most
+    refresh_rate times per second, and pushing the same key again before the
+    next drain just replaces the queued update. Because jobs carry their own
+    state, the drain always shows the newest state, and the number of redraws
+    does not depend on how much output yt-dlp produces.
+    """
+    
+    def __init__(self, root, handler, refresh_rate=DEFAULT_REFRESH_RATE):
+        self.root = root
+        self.handler = handler
+        self.interval = max(1, int(1000 / refresh_rate))
+        self._lock = threading.Lock()
+        self._pending = {}
+    
+    def push(self, key, item):
+        """Queue an update; safe to call from any thread"""
+        with self._lock:
+            self._pending[key] = item
+    
+    def discard(self, key):
+        """Drop a queued update, e.g. for a row that has just been removed"""
+        with self._lock:
+            self._pending.pop(key, None)
+    
+    def start(self):
+        self.root.after(self.interval, self._drain)
+    
+    def _drain(self):
+        with self._lock:
+            items, self._pending = list(self._pending.values()), {}
+        try:
+            if items:
+                self.handler(items)
+        finally:
+            self.root.after(self.interval, self._drain)
+
+# Status label colours for each job state
+STATE_COLORS = {
+    JOB_QUEUED: "gray",
+    JOB_RUNNING: "blue",
+    JOB_FINISHING: "orange",
+    JOB_DONE: "green",
+    JOB_FAILED: "red",
+    JOB_CANCELLED: "orange",
+}
+
+class JobRow:
+    """Progress row for one job in the queue list"""
+    
+    def __init__(self, app, parent, job):
+        self.app = app
+        self.job = job
+        self.state = None
+        
+        self.frame = tk.Frame(parent, bd=1, relief=tk.GROOVE)
+        
+        top_row = tk.Frame(self.frame)
+        top_row.pack(fill="x", padx=5, pady=(5, 0))
+        
+        self.title_label = tk.Label(top_row, text=job.url, font=("Arial", 10, "bold"), anchor="w")
+        self.title_label.pack(side="left", fill="x", expand=True)
+        
+        self.action_btn = tk.Button(
+            top_row,
+            text="Remove",
+            command=lambda: app.on_row_action(self),
+            font=("Arial", 8),
+            width=7
+        )
+        self.action_btn.pack(side="right", padx=(2, 0))
+        
+        # Shown for failed or cancelled jobs
+        self.retry_btn = tk.Button(
+            top_row,
+            text="Retry",
+            command=lambda: app.retry_job(self.job),
+            font=("Arial", 8),
+            width=7
+        )
+        
+        self.down_btn = tk.Button(
+            top_row,
+            text="▼",
+            command=lambda: app.move_job(self.job, 1),
+            font=("Arial", 8),
+            width=2
+        )
+        self.down_btn.pack(side="right", padx=(2, 0))
+        
+        self.up_btn = tk.Button(
+            top_row,
+            text="▲",
+            command=lambda: app.move_job(self.job, -1),
+            font=("Arial", 8),
+            width=2
+        )
+        self.up_btn.pack(side="right", padx=(2, 0))
+        
+        self.priority_btn = tk.Button(
+            top_row,
+            text=job.priority.capitalize(),
+            command=lambda: app.set_job_priority(self.job),
+            font=("Arial", 8),
+            width=6
+        )
+        self.priority_btn.pack(side="right", padx=(2, 0))
+        
+        self.log_btn = tk.Button(
+            top_row,
+            text="Log",
+            command=lambda: app.show_log(self.job),
+            font=("Arial", 8),
+            width=4
+        )
+        self.log_btn.pack(side="right", padx=(2, 0))
+        
+        # Clickable folder icon, shown once the file is on disk
+        self.folder_link = tk.Label(
+            top_row,
+            text="📁",
+            font=("Arial", 12),
+            fg="#1976d2",
+            cursor="hand2"
+        )
+        self.folder_link.bind("<Button-1>", lambda e: app.open_file_location(
+            os.path.dirname(self.job.downloaded_file_path)))
+        
+        self.status_label = tk.Label(self.frame, text=job.message, font=("Arial", 9), fg="gray", anchor="w")
+        self.status_label.pack(fill="x", padx=5)
+        
+        progress_row = tk.Frame(self.frame)
+        progress_row.pack(fill="x", padx=5, pady=(2, 5))
+        
+        # The job's share of the speed limit, while one applies
+        self.share_label = tk.Label(progress_row, font=("Arial", 8), fg="gray", width=22, anchor="e")
+        self.share_label.pack(side="right")
+        
+        self.progress_bar = ttk.Progressbar(progress_row, mode='determinate')
+        self.progress_bar.pack(side="left", fill="x", expand=True)
+        
+        self.update()
+    
+    def update(self):
+        """Refresh the row from the job state; returns True if the state changed"""
+        job = self.job
+        self.title_label.config(text=job.video_title or job.url)
+        self.status_label.config(text=job.message, fg=STATE_COLORS[job.state])
+        self.progress_bar['value'] = job.progress
+        self.priority_btn.config(text=job.priority.capitalize())
+        if job.rate_limit and job.state == JOB_RUNNING:
+            share = f" ({job.bandwidth_share:.0%})" if job.bandwidth_share else ""
+            self.share_label.config(text=f"max {format_rate(job.rate_limit)}{share}")
+        else:
+            self.share_label.config(text="")
+        
+        if job.state == self.state:
+            return False
+        self.state = job.state
+        
+        waiting = job.state == JOB_QUEUED
+        self.up_btn.config(state="normal" if waiting else "disabled")
+        self.down_btn.config(state="normal" if waiting else "disabled")
+        self.priority_btn.config(state="disabled" if job.finished else "normal")
+        if waiting:
+            self.action_btn.config(text="Remove")
+        elif job.finished:
+            self.action_btn.config(text="Clear")
+        else:
+            self.action_btn.config(text="Cancel")
+        
+        if job.state in (JOB_FAILED, JOB_CANCELLED):
+            self.retry_btn.pack(side="right", padx=(2, 0), before=self.action_btn)
+        else:
+            self.retry_btn.pack_forget()
+        
+        if job.state == JOB_DONE and job.downloaded_file_path:
+            self.folder_link.pack(side="right", padx=(2, 5))
+        else:
+            self.folder_link.pack_forget()
+        return True
+
+class PlaylistRow:
+    """Overall progress row for a playlist; its entries have their own rows"""
+    
+    def __init__(self, app, parent, group):
+        self.app = app
+        self.group = group
+        
+        self.frame = tk.Frame(parent, bd=2, relief=tk.RIDGE, bg="#e3f2fd")
+        
+        top_row = tk.Frame(self.frame, bg="#e3f2fd")
+        top_row.pack(fill="x", padx=5, pady=(5, 0))
+        
+        self.title_label = tk.Label(
+            top_row,
+            text=f"Playlist: {group.url}",
+            font=("Arial", 10, "bold"),
+            bg="#e3f2fd",
+            anchor="w"
+        )
+        self.title_label.pack(side="left", fill="x", expand=True)
+        
+        self.action_btn = tk.Button(
+            top_row,
+            text="Cancel",
+            command=lambda: app.on_playlist_action(self),
+            font=("Arial", 8),
+            width=7
+        )
+        self.action_btn.pack(side="right", padx=(2, 0))
+        
+        self.retry_btn = tk.Button(
+            top_row,
+            text="Retry Failed",
+            command=lambda: app.retry_playlist(self.group),
+            font=("Arial", 8)
+        )
+        
+        self.status_label = tk.Label(self.frame, text=group.message, font=("Arial", 9), bg="#e3f2fd", anchor="w")
+        self.status_label.pack(fill="x", padx=5)
+        
+        self.progress_bar = ttk.Progressbar(self.frame, mode='determinate')
+        self.progress_bar.pack(fill="x", padx=5, pady=(2, 5))
+        
+        self.update()
+    
+    def update(self):
+        """Refresh the row from the playlist's overall progress"""
+        group = self.group
+        if group.title:
+            self.title_label.config(text=f"Playlist: {group.title}")
+        
+        done, total, downloaded, total_bytes = group.totals()
+        failed = len(group.failed_jobs())
+        if group.message:
+            text = group.message
+        else:
+            text = f"{done} of {total} videos downloaded"
+            if failed:
+                text += f", {failed} failed"
+            if total_bytes:
+                text += f" - {format_size(downloaded)} of ~{format_size(total_bytes)}"
+        if group.expanding:
+            color = "blue"
+        elif group.finished:
+            color = "red" if failed or not total else "green"
+        else:
+            color = "blue"
+        self.status_label.config(text=text, fg=color)
+        
+        if total_bytes:
+            self.progress_bar['value'] = 100.0 * downloaded / total_bytes
+        elif total:
+            self.progress_bar['value'] = 100.0 * done / total
+        
+        self.action_btn.config(text="Clear" if group.finished else "Cancel")
+        if failed:
+            self.retry_btn.pack(side="right", padx=(2, 0), before=self.action_btn)
+        else:
+            self.retry_btn.pack_forget()
+
+class LogView:
+    """Scrollable list of text lines on a canvas that only draws the lines on screen.
+
+    lines() returns the entries to show and is called again by refresh();
+    format_line turns an entry into its text and is only called for the
+    visible ones, so a long log takes no longer to draw than a short one.
+    The view follows new lines at the end unless it is scrolled up.
+    """
+    
+    def __init__(self, parent, lines, format_line=str, font=("Courier", 9)):
+        self.lines = lines
+        self.format_line = format_line
+        self.font = font
+        self.line_height = tkfont.Font(root=parent, font=font).metrics("linespace")
+        self.entries = []
+        # Index of the first visible entry, and whether to stay at the end
+        self.top = 0
+        self.follow = True
+        # One canvas text item per visible row, reused as the view scrolls
+        self.items = []
+        
+        self.frame = tk.Frame(parent)
+        self.scrollbar = tk.Scrollbar(self.frame, orient="vertical", command=self.on_scroll)
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas = tk.Canvas(self.frame, bg="white", highlightthickness=0)
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.canvas.bind("<Configure>", lambda e: self.draw())
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.canvas.bind(sequence, self.on_wheel)
+    
+    def rows(self):
+        """Number of lines that fit on the canvas"""
+        return max(1, self.canvas.winfo_height() // self.line_height)
+    
+    def refresh(self):
+        self.entries = self.lines()
+        self.draw()
+    
+    def draw(self):
+        rows = self.rows()
+        total = len(self.entries)
+        if self.follow:
+            self.top = total - rows
+        self.top = max(0, min(self.top, total - rows))
+        while len(self.items) < rows:
+            self.items.append(self.canvas.create_text(
+                4, len(self.items) * self.line_height, anchor="nw", font=self.font))
+        for row, item in enumerate(self.items):
+            index = self.top + row
+            text = self.format_line(self.entries[index]) if row < rows and index < total else ""
+            self.canvas.itemconfig(item, text=text)
+        if total > rows:
+            self.scrollbar.set(self.top / total, (self.top + rows) / total)
+        else:
+            self.scrollbar.set(0, 1)
+    
+    def scroll_to(self, top):
+        self.top = top
+        self.follow = top + self.rows() >= len(self.entries)
+        self.draw()
+    
+    def on_scroll(self, action, amount, unit=None):
+        """Scrollbar command: ("moveto", fraction) or ("scroll", count, "units" or "pages")"""
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * len(self.entries)))
+        elif action == "scroll":
+            step = self.rows() if unit == "pages" else 1
+            self.scroll_to(self.top + int(amount) * step)
+    
+    def on_wheel(self, event):
+        up = event.num == 4 or event.delta > 0
+        self.scroll_to(self.top + (-3 if up else 3))
+
+class LogWindow:
+    """Window with the recent output of all downloads, or of one job, refreshed while it is open"""
+    
+    def __init__(self, app, job=None):
+        self.app = app
+        self.job = job
+        self.closed = False
+        self.seen = None
+        self.window = tk.Toplevel(app.root)
+        self.window.title(f"Log - {job.video_title or job.url}" if job else "Download Log")
+        self.window.geometry("760x400")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        if job is None:
+            self.view = LogView(self.window, app.engine.output.lines,
+                                lambda entry: f"#{entry[0]} {entry[1]}")
+        else:
+            self.view = LogView(self.window, lambda: list(job.output))
+        self.view.frame.pack(fill="both", expand=True)
+        self.refresh()
+    
+    def refresh(self):
+        """Redraw if there is new output; the lines are read from the engine in this process"""
+        if self.closed:
+            return
+        output = self.app.engine.output
+        seen = output.added if output is not None else None
+        if self.job is not None:
+            # A finished job's output is trimmed, or comes from the daemon
+            seen = (seen, id(self.job.output), self.job.state)
+        if seen != self.seen:
+            self.seen = seen
+            self.view.refresh()
+        self.window.after(LOG_REFRESH_INTERVAL, self.refresh)
+    
+    def close(self):
+        self.closed = True
+        self.app.log_windows.pop(self.job.id if self.job else None, None)
+        self.window.destroy()
+
+class StatsWindow:
+    """Window with the job metrics, refreshed while it is open"""
+    
+    def __init__(self, app):
+        self.app = app
+        self.closed = False
+        self.window = tk.Toplevel(app.root)
+        self.window.title("Download Statistics")
+        self.window.resizable(False, False)
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.label = tk.Label(
+            self.window,
+            text="Loading...",
+            font=("Courier", 9),
+            justify="left",
+            anchor="nw",
+            padx=10,
+            pady=10
+        )
+        self.label.pack(fill="both", expand=True)
+        self.refresh()
+    
+    def refresh(self):
+        """Fetch the metrics off the main loop; a daemon may take a moment to answer"""
+        def fetch():
+            snapshot = self.app.engine.metrics_snapshot()
+            self.app.updates.push(("stats",), lambda: self.show(snapshot))
+        
+        threading.Thread(target=fetch, daemon=True).start()
+    
+    def show(self, snapshot):
+        if self.closed:
+            return
+        self.label.config(text=format_metrics(snapshot) if snapshot
+                          else "The daemon cannot be reached.")
+        self.window.after(STATS_REFRESH_INTERVAL, self.refresh)
+    
+    def close(self):
+        self.closed = True
+        self.window.destroy()
 
 class YouTubeDownloader:
-    def __init__(self, root):
+    def __init__(self, root, refresh_rate=DEFAULT_REFRESH_RATE, daemon_url=None,
+                 backend=DEFAULT_BACKEND, format_preset=DEFAULT_FORMAT_PRESET,
+                 throttle_ratio=THROTTLE_RATIO, throttle_fragments=None, scratch_dir=None):
         self.root = root
-        self.root.title("YouTube Downloader")
-        self.root.geometry("800x550")
+        self.root.title(f"YouTube Downloader - {daemon_url}" if daemon_url else "YouTube Downloader")
+        self.root.geometry("800x650")
         self.root.resizable(True, True)
-        self.root.minsize(800, 550)
+        self.root.minsize(800, 600)
         
         # Variables
-        self.download_process = None
-        self.is_downloading = False
         self.save_path = tk.StringVar(value=os.path.join(os.path.expanduser("~"), "Downloads"))
-        self.downloaded_file_path = None
-        self.video_title = None
-        self.downloaded_filename = None
+        self.max_workers = tk.StringVar(value=str(DEFAULT_MAX_WORKERS))
+        self.refresh_metadata = tk.BooleanVar(value=False)
+        self.speed_limit = tk.StringVar(value="")
+        self.format_preset = tk.StringVar(value=FORMAT_PRESETS[format_preset].label)
+        self.job_rows = {}
+        self.playlist_rows = {}
+        self.stats_window = None
+        # Open log windows by job id; None for the one with all downloads
+        self.log_windows = {}
+        # Lookup of the URL in the entry, started before Download is clicked
+        self.prefetch_request = None
+        self.prefetch_url = None
+        self.prefetch_timer = None
+        self.prefetch_metadata = None
+        # Keys for the results of engine commands handed to the Tk main loop
+        self.command_ids = itertools.count()
+        
+        # Engine callbacks run on worker threads; widgets are only updated
+        # from the channel's timer on the Tk main loop
+        self.updates = UIUpdateChannel(root, self.apply_updates, refresh_rate)
+        if daemon_url:
+            # Downloads run in the daemon; this window only shows and steers them
+            self.engine = RemoteEngine(
+                daemon_url,
+                on_update=self.on_job_update,
+                on_group_update=self.on_group_update
+            )
+        else:
+            open_log_file("downloader.log")
+            self.engine = DownloadEngine(
+                max_workers=DEFAULT_MAX_WORKERS,
+                on_update=self.on_job_update,
+                on_group_update=self.on_group_update,
+                cache=open_metadata_cache(),
+                archive=open_download_archive(),
+                journal=open_job_journal(),
+                metrics=open_job_metrics(),
+                backend=backend,
+                prefetch_dir=os.path.join(get_config_dir(), "prefetch"),
+                format_preset=format_preset,
+                throttle_ratio=throttle_ratio,
+                throttle_fragments=throttle_fragments,
+                scratch_dir=scratch_dir
+            )
         
         # Create UI
         self.create_widgets()
+        self.updates.start()
         
+        # Pick up where the last session left off
+        if isinstance(self.engine, DownloadEngine):
+            self.engine.resume()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+    
+    def on_close(self):
+        """Stop the downloads before the window goes; they resume on the next start"""
+        self.engine.shutdown()
+        self.root.destroy()
+    
     def create_widgets(self):
         # Title
         title_label = tk.Label(
@@ -71,9 +5144,33 @@ class YouTubeDownloader:
         url_frame = tk.Frame(self.root)
         url_frame.pack(pady=10, padx=20, fill="x")
         
-        tk.Label(url_frame, text="YouTube URL:", font=("Arial", 10)).pack(anchor="w")
+        url_header = tk.Frame(url_frame)
+        url_header.pack(fill="x")
+        tk.Label(url_header, text="YouTube URL(s):", font=("Arial", 10)).pack(side="left")
+        tk.Checkbutton(
+            url_header,
+            text="Refresh video info (ignore cache)",
+            variable=self.refresh_metadata,
+            font=("Arial", 9)
+        ).pack(side="right")
+        preset_menu = tk.OptionMenu(
+            url_header,
+            self.format_preset,
+            *(preset.label for preset in FORMAT_PRESETS.values()),
+            command=lambda label: self.on_format_preset_changed()
+        )
+        preset_menu.config(font=("Arial", 9))
+        preset_menu.pack(side="right", padx=(0, 10))
+        tk.Label(url_header, text="Quality:", font=("Arial", 9)).pack(side="right")
         self.url_entry = tk.Entry(url_frame, font=("Arial", 10), width=50)
         self.url_entry.pack(fill="x", pady=(5, 0))
+        self.url_entry.bind("<Return>", lambda e: self.start_download())
+        # Look the URL up as soon as it is pasted or typed
+        self.url_entry.bind("<KeyRelease>", self.schedule_prefetch)
+        self.url_entry.bind("<<Paste>>", self.schedule_prefetch)
+        self.prefetch_label = tk.Label(url_frame, text="", font=("Arial", 9), fg="gray",
+                                       anchor="w", justify="left")
+        self.prefetch_label.pack(fill="x")
         
         # Save Location Frame
         save_frame = tk.Frame(self.root)
@@ -95,28 +5192,9 @@ class YouTubeDownloader:
         )
         browse_btn.pack(side="right", padx=(5, 0))
         
-        # Progress Bar Frame
-        progress_frame = tk.Frame(self.root)
-        progress_frame.pack(pady=10, padx=20, fill="x")
-        
-        self.progress_label = tk.Label(
-            progress_frame, 
-            text="Ready to download", 
-            font=("Arial", 9),
-            fg="gray"
-        )
-        self.progress_label.pack(anchor="w")
-        
-        self.progress_bar = ttk.Progressbar(
-            progress_frame, 
-            mode='determinate',
-            length=760
-        )
-        self.progress_bar.pack(fill="x", pady=(5, 0))
-        
         # Button Frame
         button_frame = tk.Frame(self.root)
-        button_frame.pack(pady=20)
+        button_frame.pack(pady=10)
         
         self.download_btn = tk.Button(
             button_frame,
@@ -132,7 +5210,7 @@ class YouTubeDownloader:
         
         self.cancel_btn = tk.Button(
             button_frame,
-            text="Cancel",
+            text="Cancel All",
             command=self.cancel_download,
             font=("Arial", 12, "bold"),
             bg="#f44336",
@@ -145,263 +5223,443 @@ class YouTubeDownloader:
         
         # Success Message Frame (initially hidden)
         self.success_frame = tk.Frame(self.root, bg="#e8f5e9", relief=tk.RAISED, bd=2)
-        self.success_frame.pack(pady=20, padx=20, fill="x", after=button_frame)
+        self.success_frame.pack(pady=10, padx=20, fill="x", after=button_frame)
         self.success_frame.pack_forget()  # Hide initially
+        self.button_frame = button_frame
+        
+        # Queue Frame
+        queue_frame = tk.Frame(self.root)
+        queue_frame.pack(pady=(0, 10), padx=20, fill="both", expand=True)
+        
+        queue_header = tk.Frame(queue_frame)
+        queue_header.pack(fill="x")
+        
+        self.progress_label = tk.Label(
+            queue_header,
+            text="Ready to download", 
+            font=("Arial", 9),
+            fg="gray"
+        )
+        self.progress_label.pack(side="left")
+        
+        self.stage_label = tk.Label(
+            queue_frame,
+            text="",
+            font=("Arial", 8),
+            fg="gray",
+            anchor="w"
+        )
+        self.stage_label.pack(fill="x")
+        
+        clear_btn = tk.Button(
+            queue_header,
+            text="Clear Finished",
+            command=self.clear_finished,
+            font=("Arial", 9)
+        )
+        clear_btn.pack(side="right")
+        
+        import_btn = tk.Button(
+            queue_header,
+            text="Import Library...",
+            command=self.import_library,
+            font=("Arial", 9)
+        )
+        import_btn.pack(side="right", padx=(0, 5))
+        
+        stats_btn = tk.Button(
+            queue_header,
+            text="Stats...",
+            command=self.show_stats,
+            font=("Arial", 9)
+        )
+        stats_btn.pack(side="right", padx=(0, 5))
+        
+        log_btn = tk.Button(
+            queue_header,
+            text="Log...",
+            command=self.show_log,
+            font=("Arial", 9)
+        )
+        log_btn.pack(side="right", padx=(0, 5))
+        
+        workers_spinbox = tk.Spinbox(
+            queue_header,
+            from_=1,
+            to=16,
+            width=3,
+            textvariable=self.max_workers,
+            command=self.on_workers_changed,
+            font=("Arial", 9)
+        )
+        workers_spinbox.pack(side="right", padx=(5, 15))
+        workers_spinbox.bind("<Return>", lambda e: self.on_workers_changed())
+        workers_spinbox.bind("<FocusOut>", lambda e: self.on_workers_changed())
+        tk.Label(queue_header, text="Parallel downloads:", font=("Arial", 9)).pack(side="right")
+        
+        # Total bandwidth cap, shared between running downloads by priority
+        limit_row = tk.Frame(queue_frame)
+        limit_row.pack(fill="x", pady=(3, 0))
+        tk.Label(limit_row, text="Speed limit:", font=("Arial", 9)).pack(side="left")
+        limit_entry = tk.Entry(limit_row, textvariable=self.speed_limit, width=30, font=("Arial", 9))
+        limit_entry.pack(side="left", padx=5)
+        limit_entry.bind("<Return>", lambda e: self.on_speed_limit_changed())
+        limit_entry.bind("<FocusOut>", lambda e: self.on_speed_limit_changed())
+        tk.Label(
+            limit_row,
+            text="e.g. 2M, or 09:00-17:00=1M, 8M (empty = no limit)",
+            font=("Arial", 8),
+            fg="gray"
+        ).pack(side="left")
+        
+        # Scrollable list of job rows
+        list_frame = tk.Frame(queue_frame, relief=tk.SUNKEN, bd=1)
+        list_frame.pack(fill="both", expand=True, pady=(5, 0))
         
+        self.queue_canvas = tk.Canvas(list_frame, highlightthickness=0)
+        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.queue_canvas.yview)
+        self.queue_canvas.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side="right", fill="y")
+        self.queue_canvas.pack(side="left", fill="both", expand=True)
+        
+        self.jobs_frame = tk.Frame(self.queue_canvas)
+        jobs_window = self.queue_canvas.create_window((0, 0), window=self.jobs_frame, anchor="nw")
+        self.jobs_frame.bind(
+            "<Configure>",
+            lambda e: self.queue_canvas.configure(scrollregion=self.queue_canvas.bbox("all"))
+        )
+        self.queue_canvas.bind(
+            "<Configure>",
+            lambda e: self.queue_canvas.itemconfigure(jobs_window, width=e.width)
+        )
+    
     def browse_folder(self):
         folder = filedialog.askdirectory(initialdir=self.save_path.get())
         if folder:
             self.save_path.set(folder)
     
-    def validate_url(self, url):
-        """Basic URL validation"""
-        youtube_patterns = [
-            r'(?:https?://)?(?:www\.)?(?:youtube\.com/watch\?v=|youtu\.be/)([a-zA-Z0-9_-]{11})',
-            r'(?:https?://)?(?:www\.)?youtube\.com/playlist\?list=([a-zA-Z0-9_-]+)',
-        ]
-        for pattern in youtube_patterns:
-            if re.search(pattern, url):
-                return True
-        return False
-    
-    def parse_progress(self, line):
-        """Parse yt-dlp progress output"""
-        # Look for percentage in the output
-        # yt-dlp outputs like: [download]  45.2% of   50.00MiB at  5.00MiB/s ETA 00:01
-        match = re.search(r'(\d+\.?\d*)%', line)
-        if match:
-            try:
-                return float(match.group(1))
-            except:
-                return None
-        
-        # Also check for [download] lines with file size info
-        if '[download]' in line.lower():
-            # Try to extract any percentage
-            match = re.search(r'(\d+\.?\d*)%', line)
-            if match:
-                try:
-                    return float(match.group(1))
-                except:
-                    return None
-        return None
-    
-    def parse_video_info(self, line):
-        """Parse video title and filename from yt-dlp output"""
-        # yt-dlp outputs: [download] Destination: filename.ext
-        if '[download]' in line and 'Destination:' in line:
-            match = re.search(r'Destination:\s*(.+)', line)
-            if match:
-                full_path = match.group(1).strip()
-                if os.path.isabs(full_path):
-                    self.downloaded_file_path = full_path
-                else:
-                    self.downloaded_file_path = os.path.join(self.save_path.get(), full_path)
-                self.downloaded_filename = os.path.basename(full_path)
-        
-        # yt-dlp outputs: [download] filename.ext has already been downloaded
-        if '[download]' in line and 'has already been downloaded' in line:
-            match = re.search(r'\[download\]\s*(.+?)\s+has already been downloaded', line)
-            if match:
-                filename = match.group(1).strip()
-                self.downloaded_file_path = os.path.join(self.save_path.get(), filename)
-                self.downloaded_filename = filename
-        
-        # yt-dlp outputs: [Merger] Merging formats into "filename.ext"
-        if '[Merger]' in line or '[ExtractAudio]' in line:
-            match = re.search(r'into\s+"(.+)"', line)
-            if match:
-                full_path = match.group(1).strip()
-                if os.path.isabs(full_path):
-                    self.downloaded_file_path = full_path
-                else:
-                    self.downloaded_file_path = os.path.join(self.save_path.get(), full_path)
-                self.downloaded_filename = os.path.basename(full_path)
-    
-    def download_video(self):
-        """Download video in a separate thread"""
-        url = self.url_entry.get().strip()
+    def start_download(self):
+        """Add the entered URL(s) to the download queue"""
+        urls = self.url_entry.get().split()
         
-        if not url:
+        if not urls:
             messagebox.showerror("Error", "Please enter a YouTube URL")
-            self.reset_ui()
             return
         
-        if not self.validate_url(url):
-            messagebox.showerror("Error", "Please enter a valid YouTube URL")
-            self.reset_ui()
+        invalid = [url for url in urls if not validate_url(url)]
+        if invalid:
+            messagebox.showerror("Error", "Please enter a valid YouTube URL:\n" + "\n".join(invalid))
             return
         
+        # Hide success frame if visible
+        self.success_frame.pack_forget()
+        
         save_dir = self.save_path.get()
-        if not os.path.exists(save_dir):
-            try:
-                os.makedirs(save_dir)
-            except Exception as e:
-                messagebox.showerror("Error", f"Cannot create save directory: {str(e)}")
-                self.reset_ui()
-                return
+        refresh = self.refresh_metadata.get()
+        # A lookup still running is no use now; the download extracts the page itself
+        self.cancel_prefetch()
+        for url in urls:
+            # Every entry of a playlist becomes its own job
+            self.run_command(lambda url=url: self.engine.add_url(url, save_dir, refresh=refresh))
+        self.url_entry.delete(0, tk.END)
+    
+    def run_command(self, command, on_done=None):
+        """Run an engine command, then on_done(result, error) on Tk's thread.
+
+        A daemon's commands go to the remote engine's command thread, as the
+        window would hang while a slow daemon answers; a local engine's run
+        right away. error is the ValueError the command raised, or None.
+        """
+        if isinstance(self.engine, RemoteEngine):
+            def done(result, error):
+                if on_done is not None:
+                    self.updates.push(("command", next(self.command_ids)),
+                                      lambda: on_done(result, error))
+            self.engine.submit(command, done)
+            return
+        try:
+            result, error = command(), None
+        except ValueError as e:
+            result, error = None, e
+        if on_done is not None:
+            on_done(result, error)
+    
+    def schedule_prefetch(self, event=None):
+        """Look up the entered URL once the entry has not changed for PREFETCH_DELAY ms"""
+        if self.prefetch_timer is not None:
+            self.root.after_cancel(self.prefetch_timer)
+        self.prefetch_timer = self.root.after(PREFETCH_DELAY, self.prefetch_entry)
+    
+    def prefetch_entry(self):
+        """Start looking up the URL in the entry, if it holds a single valid one"""
+        self.prefetch_timer = None
+        urls = self.url_entry.get().split()
+        url = urls[0] if len(urls) == 1 and validate_url(urls[0]) else None
+        if url == self.prefetch_url:
+            return
+        self.cancel_prefetch()
+        if url is None:
+            return
         
-        # Get path to yt-dlp.exe
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        yt_dlp_path = os.path.join(script_dir, "yt-dlp.exe")
+        def done(metadata):
+            self.updates.push(("prefetch",), lambda: self.show_prefetch(url, metadata))
         
-        if not os.path.exists(yt_dlp_path):
-            messagebox.showerror("Error", f"yt-dlp.exe not found at: {yt_dlp_path}")
-            self.reset_ui()
+        self.prefetch_request = self.engine.prefetch(url, done, refresh=self.refresh_metadata.get())
+        if self.prefetch_request is not None:
+            self.prefetch_url = url
+            self.prefetch_label.config(text="Looking up video info...", fg="gray")
+    
+    def cancel_prefetch(self):
+        if self.prefetch_request is not None:
+            self.prefetch_request.cancel()
+        self.prefetch_request = None
+        self.prefetch_url = None
+        self.prefetch_metadata = None
+        self.prefetch_label.config(text="")
+    
+    def show_prefetch(self, url, metadata):
+        """Show what a lookup found, unless the entry has moved on to another URL"""
+        if url != self.prefetch_url:
+            return
+        self.prefetch_request = None
+        self.prefetch_metadata = metadata
+        if metadata is None:
+            self.prefetch_label.config(text="Could not read video info.", fg="red")
+            return
+        text = describe_metadata(metadata)
+        plan = self.engine.plan(metadata)
+        if plan is not None:
+            text += f"\nDownloads {describe_plan(plan)}"
+        self.prefetch_label.config(text=text, fg="black")
+    
+    def import_library(self):
+        """Add the videos in an existing folder to the download archive"""
+        if self.engine.archive is None:
+            messagebox.showerror("Error", "The download archive is not available.")
+            return
+        folder = filedialog.askdirectory(initialdir=self.save_path.get())
+        if not folder:
             return
+        self.progress_label.config(text=f"Scanning {folder}...", fg="blue")
         
-        # Get video title first
-        try:
-            title_cmd = [yt_dlp_path, url, "--get-title", "--no-warnings"]
-            title_result = subprocess.run(
-                title_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0,
-                timeout=10
-            )
-            if title_result.returncode == 0 and title_result.stdout.strip():
-                self.video_title = title_result.stdout.strip()
-        except:
-            pass  # If we can't get title, we'll try to parse it from download output
-        
-        # Prepare command
-        output_template = os.path.join(save_dir, "%(title)s.%(ext)s")
-        cmd = [
-            yt_dlp_path,
-            url,
-            "-o", output_template,
-            "--newline",  # Force newline output for progress parsing
-            "--progress",  # Show progress
-        ]
+        def scan():
+            try:
+                count = self.engine.archive.import_folder(folder, self.engine.cache)
+                message = f"Added {count} video(s) from {folder} to the download archive."
+            except OSError as e:
+                message = f"Could not scan {folder}: {str(e)}"
+            
+            def report():
+                self.update_summary()
+                messagebox.showinfo("Import Library", message)
+            self.updates.push(("import", folder), report)
         
-        try:
-            self.download_process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                bufsize=1,
-                creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+        threading.Thread(target=scan, daemon=True).start()
+    
+    def show_stats(self):
+        """Open the statistics window, or bring it to the front"""
+        if self.stats_window is not None and not self.stats_window.closed:
+            self.stats_window.window.lift()
+            return
+        self.stats_window = StatsWindow(self)
+    
+    def show_log(self, job=None):
+        """Open the log window of all downloads, or of one job, or bring it to the front"""
+        if job is None and self.engine.output is None:
+            messagebox.showinfo(
+                "Download Log",
+                "The daemon writes the output of its downloads to daemon.log in its configuration folder."
             )
-            
-            progress_reached_100 = False
-            # Read output line by line
-            for line in iter(self.download_process.stdout.readline, ''):
-                if not self.is_downloading:
-                    break
-                
-                line = line.strip()
-                if line:
-                    # Parse video info (title, filename)
-                    self.parse_video_info(line)
-                    
-                    # Update progress bar
-                    progress = self.parse_progress(line)
-                    if progress is not None:
-                        self.progress_bar['value'] = progress
-                        if progress >= 100:
-                            progress_reached_100 = True
-                            # Check if process is still running (merging/processing)
-                            if self.download_process.poll() is None:
-                                self.progress_label.config(text="Stand by - finishing up...", fg="orange")
-                            else:
-                                self.progress_label.config(text=f"Downloading... {progress:.1f}%")
-                        else:
-                            self.progress_label.config(text=f"Downloading... {progress:.1f}%")
-                    else:
-                        # If we hit 100% and process is still running, show finishing message
-                        if progress_reached_100 and self.download_process.poll() is None:
-                            if '[Merger]' in line or '[ExtractAudio]' in line or 'Merging' in line:
-                                self.progress_label.config(text="Stand by - finishing up...", fg="orange")
-                            elif '[download]' not in line.lower():
-                                self.progress_label.config(text="Stand by - finishing up...", fg="orange")
-                        else:
-                            # Update label with current status
-                            if '[download]' in line.lower():
-                                self.progress_label.config(text=line[:60] + "..." if len(line) > 60 else line)
-                    
-                    self.root.update_idletasks()
-            
-            # Wait for process to complete
-            self.download_process.wait()
-            
-            if self.is_downloading:
-                if self.download_process.returncode == 0:
-                    self.progress_bar['value'] = 100
-                    self.progress_label.config(text="Download completed successfully!", fg="green")
-                    
-                    # If we don't have the file path yet, try to find it
-                    if not self.downloaded_file_path:
-                        # Try to find the most recently created file in the save directory
-                        try:
-                            files = [os.path.join(save_dir, f) for f in os.listdir(save_dir) 
-                                    if os.path.isfile(os.path.join(save_dir, f))]
-                            if files:
-                                # Get the most recently modified file
-                                self.downloaded_file_path = max(files, key=os.path.getmtime)
-                                self.downloaded_filename = os.path.basename(self.downloaded_file_path)
-                                # If we don't have a title yet, try to extract it from filename (remove extension)
-                                if not self.video_title and self.downloaded_filename:
-                                    self.video_title = os.path.splitext(self.downloaded_filename)[0]
-                        except:
-                            pass
-                    
-                    # Reset UI state but keep success message visible
-                    self.is_downloading = False
-                    self.download_process = None
-                    self.download_btn.config(state="normal")
-                    self.cancel_btn.config(state="disabled")
-                    
-                    # Show success message in the UI (on main thread)
-                    self.root.after(0, self.show_success_message)
-                else:
-                    self.progress_label.config(text="Download failed", fg="red")
-                    messagebox.showerror("Error", "Download failed. Please check the URL and try again.")
-                    self.reset_ui()
-            
-        except Exception as e:
-            if self.is_downloading:
-                messagebox.showerror("Error", f"An error occurred: {str(e)}")
-                self.progress_label.config(text="Error occurred", fg="red")
-                self.reset_ui()
-            else:
-                self.reset_ui()
+            return
+        key = job.id if job else None
+        if key in self.log_windows:
+            self.log_windows[key].window.lift()
+            return
+        self.log_windows[key] = LogWindow(self, job)
     
-    def start_download(self):
-        """Start download in a separate thread"""
-        if self.is_downloading:
+    def cancel_download(self):
+        """Cancel all running and waiting downloads"""
+        running, waiting, _ = self.engine.counts()
+        if running or waiting:
+            self.run_command(self.engine.cancel_all)
+            messagebox.showinfo("Cancelled", "Downloads have been cancelled.")
+    
+    def on_workers_changed(self):
+        """Apply a new number of parallel downloads"""
+        try:
+            max_workers = int(self.max_workers.get())
+        except ValueError:
+            self.max_workers.set(str(self.engine.max_workers))
+            return
+        self.run_command(lambda: self.engine.set_max_workers(max_workers))
+    
+    def on_speed_limit_changed(self):
+        """Apply the bandwidth schedule typed into the speed limit field"""
+        text = self.speed_limit.get()
+        if text.strip() == self.engine.bandwidth.describe():
             return
         
-        # Hide success frame if visible
-        self.success_frame.pack_forget()
+        def done(result, error):
+            if error is not None:
+                messagebox.showerror("Error", f"Invalid speed limit: {str(error)}")
+                self.speed_limit.set(self.engine.bandwidth.describe())
         
-        # Reset download info
-        self.downloaded_file_path = None
-        self.video_title = None
-        self.downloaded_filename = None
+        self.run_command(lambda: self.engine.set_bandwidth_schedule(text), done)
+    
+    def on_format_preset_changed(self):
+        """Use the picked quality for downloads started from now on"""
+        label = self.format_preset.get()
+        name = next(name for name, preset in FORMAT_PRESETS.items() if preset.label == label)
         
-        self.is_downloading = True
-        self.download_btn.config(state="disabled")
-        self.cancel_btn.config(state="normal")
-        self.progress_bar['value'] = 0
-        self.progress_label.config(text="Starting download...", fg="blue")
+        def done(result, error):
+            if error is not None:
+                messagebox.showerror("Error", f"Could not change the quality: {str(error)}")
+                self.format_preset.set(FORMAT_PRESETS[self.engine.format_preset].label)
+                return
+            # Show the new plan for the video already looked up
+            if self.prefetch_metadata is not None:
+                self.show_prefetch(self.prefetch_url, self.prefetch_metadata)
         
-        # Start download in separate thread
-        thread = threading.Thread(target=self.download_video, daemon=True)
-        thread.start()
+        self.run_command(lambda: self.engine.set_format_preset(name), done)
     
-    def cancel_download(self):
-        """Cancel the current download"""
-        if self.download_process and self.is_downloading:
-            self.download_process.terminate()
-            self.is_downloading = False
-            self.progress_label.config(text="Download cancelled", fg="orange")
-            messagebox.showinfo("Cancelled", "Download has been cancelled.")
-            self.reset_ui()
-    
-    def show_success_message(self):
+    def set_job_priority(self, job):
+        """Move a job to the next priority: low, normal, high, then low again"""
+        priorities = list(PRIORITY_WEIGHTS)
+        priority = priorities[(priorities.index(job.priority) + 1) % len(priorities)]
+        self.run_command(lambda: self.engine.set_priority(job, priority))
+    
+    def on_row_action(self, row):
+        """Remove, cancel or clear a job depending on its state"""
+        job = row.job
+        if job.state == JOB_QUEUED or job.finished:
+            if job.state == JOB_QUEUED:
+                self.run_command(lambda: self.engine.cancel(job))
+            self.run_command(lambda: self.engine.remove(job))
+            self.remove_row(job)
+        else:
+            self.run_command(lambda: self.engine.cancel(job))
+    
+    def retry_job(self, job):
+        self.run_command(lambda: self.engine.retry(job))
+    
+    def on_playlist_action(self, row):
+        """Cancel a playlist that is still running, or clear a finished one"""
+        group = row.group
+        if not group.finished:
+            self.run_command(lambda: self.engine.cancel_group(group))
+            return
+        for job in group.jobs:
+            self.run_command(lambda job=job: self.engine.remove(job))
+            self.remove_row(job)
+        row.frame.destroy()
+        del self.playlist_rows[group.id]
+    
+    def retry_playlist(self, group):
+        self.run_command(lambda: self.engine.retry_failed(group))
+    
+    def move_job(self, job, offset):
+        def done(moved, error):
+            if moved:
+                self.layout_rows()
+        
+        self.run_command(lambda: self.engine.move(job, offset), done)
+    
+    def clear_finished(self):
+        def done(jobs, error):
+            for job in jobs:
+                self.remove_row(job)
+            groups = self.engine.groups()
+            for group_id, row in list(self.playlist_rows.items()):
+                if row.group not in groups:
+                    row.frame.destroy()
+                    del self.playlist_rows[group_id]
+        
+        self.run_command(self.engine.clear_finished, done)
+    
+    def remove_row(self, job):
+        self.updates.discard(("job", job.id))
+        row = self.job_rows.pop(job.id, None)
+        if row:
+            row.frame.destroy()
+        self.update_summary()
+    
+    def on_job_update(self, job):
+        """Called by the engine, on a worker thread, whenever a job changes"""
+        self.updates.push(("job", job.id), job)
+    
+    def on_group_update(self, group):
+        """Called by the engine, on a worker thread, whenever a playlist changes"""
+        self.updates.push(("group", group.id), group)
+    
+    def apply_updates(self, items):
+        """Redraw the jobs and playlists that changed since the last refresh"""
+        relayout = False
+        finished_job = None
+        for item in items:
+            if callable(item):
+                # Work handed over from a background thread
+                item()
+                continue
+            if isinstance(item, PlaylistGroup):
+                row = self.playlist_rows.get(item.id)
+                if row is None:
+                    self.playlist_rows[item.id] = PlaylistRow(self, self.jobs_frame, item)
+                    relayout = True
+                else:
+                    row.update()
+                continue
+            
+            row = self.job_rows.get(item.id)
+            if row is None:
+                self.job_rows[item.id] = JobRow(self, self.jobs_frame, item)
+                changed = True
+            else:
+                changed = row.update()
+            if changed:
+                relayout = True
+                if item.state == JOB_DONE:
+                    finished_job = item
+        
+        if relayout:
+            self.layout_rows()
+            self.update_summary()
+        if finished_job is not None:
+            self.show_success_message(finished_job)
+    
+    def layout_rows(self):
+        """Pack the playlist rows, then the job rows in queue order"""
+        playlist_rows = [self.playlist_rows[group.id] for group in self.engine.groups()
+                         if group.id in self.playlist_rows]
+        job_rows = [self.job_rows[job.id] for job in self.engine.jobs() if job.id in self.job_rows]
+        for row in playlist_rows + job_rows:
+            row.frame.pack_forget()
+        for row in playlist_rows:
+            row.frame.pack(fill="x", pady=2, padx=2)
+        for row in job_rows:
+            # Indent playlist entries under the playlists
+            row.frame.pack(fill="x", pady=2, padx=(20 if row.job.group else 2, 2))
+    
+    def update_summary(self):
+        """Show queue totals above the job list"""
+        running, waiting, finished = self.engine.counts()
+        if running or waiting:
+            self.progress_label.config(
+                text=f"Downloading {running}, waiting {waiting}, finished {finished}",
+                fg="blue"
+            )
+            self.cancel_btn.config(state="normal")
+        else:
+            self.progress_label.config(
+                text="Ready to download" if not finished else f"Finished {finished}",
+                fg="gray"
+            )
+            self.cancel_btn.config(state="disabled")
+        # Which side is the bottleneck: downloads or merges
+        stats = self.engine.stage_stats()
+        busy = running or waiting or any(stage["completed"] for stage in stats.values())
+        self.stage_label.config(text=format_stage_stats(stats) if busy else "")
+    
+    def show_success_message(self, job):
         """Display success message with video details"""
         # Clear any existing widgets in success frame
         for widget in self.success_frame.winfo_children():
@@ -410,7 +5668,8 @@ class YouTubeDownloader:
         # Success title
         success_title = tk.Label(
             self.success_frame,
-            text="Your video downloaded successfully!",
+            text="You already have this video!" if job.already_downloaded
+            else "Your video downloaded successfully!",
             font=("Arial", 12, "bold"),
             bg="#e8f5e9",
             fg="#2e7d32"
@@ -422,10 +5681,10 @@ class YouTubeDownloader:
         details_frame.pack(fill="x", padx=10, pady=5)
         
         # Title
-        if self.video_title:
+        if job.video_title:
             title_label = tk.Label(
                 details_frame,
-                text=f"Title: {self.video_title}",
+                text=f"Title: {job.video_title}",
                 font=("Arial", 10),
                 bg="#e8f5e9",
                 anchor="w"
@@ -443,10 +5702,10 @@ class YouTubeDownloader:
             title_label.pack(anchor="w", pady=2)
         
         # Filename
-        if self.downloaded_filename:
+        if job.downloaded_filename:
             filename_label = tk.Label(
                 details_frame,
-                text=f"Filename: {self.downloaded_filename}",
+                text=f"Filename: {job.downloaded_filename}",
                 font=("Arial", 10),
                 bg="#e8f5e9",
                 anchor="w"
@@ -467,8 +5726,8 @@ class YouTubeDownloader:
         location_row = tk.Frame(details_frame, bg="#e8f5e9")
         location_row.pack(anchor="w", pady=2, fill="x")
         
-        if self.downloaded_file_path:
-            location_path = os.path.dirname(self.downloaded_file_path)
+        if job.downloaded_file_path:
+            location_path = os.path.dirname(job.downloaded_file_path)
             
             # Clickable folder icon/link (to the left of "Location:")
             folder_link = tk.Label(
@@ -496,7 +5755,7 @@ class YouTubeDownloader:
         else:
             location_label = tk.Label(
                 location_row,
-                text=f"Location: {self.save_path.get()}",
+                text=f"Location: {job.save_dir}",
                 font=("Arial", 10),
                 bg="#e8f5e9",
                 anchor="w",
@@ -506,7 +5765,7 @@ class YouTubeDownloader:
             location_label.pack(side="left", fill="x", expand=True)
         
         # Show the success frame
-        self.success_frame.pack(pady=20, padx=20, fill="x")
+        self.success_frame.pack(pady=10, padx=20, fill="x", after=self.button_frame)
         self.root.update_idletasks()
     
     def open_file_location(self, path):
@@ -519,30 +5778,228 @@ class YouTubeDownloader:
                 subprocess.run(['xdg-open', path] if sys.platform == "linux" else ['open', path])
         except Exception as e:
             messagebox.showerror("Error", f"Could not open file location: {str(e)}")
-    
-    def reset_ui(self):
-        """Reset UI to initial state"""
-        self.is_downloading = False
-        self.download_process = None
-        self.download_btn.config(state="normal")
-        self.cancel_btn.config(state="disabled")
-        if self.progress_bar['value'] != 100:
-            self.progress_bar['value'] = 0
-            self.progress_label.config(text="Ready to download", fg="gray")
-        
-        # Hide success frame
-        self.success_frame.pack_forget()
-        
-        # Reset download info
-        self.downloaded_file_path = None
-        self.video_title = None
-        self.downloaded_filename = None
 
-def main():
+def run_yt_dlp_worker():
+    """Download with the yt_dlp package, one request per line on stdin (--yt-dlp-worker).
+
+    A request is a JSON object whose "args" are the arguments the yt-dlp
+    executable would get. The YoutubeDL for them is kept for the next
+    request with the same options, so its connections are reused. Progress
+    comes from yt-dlp's hooks, as the lines --progress-template would print,
+    and every request ends with a WORKER_DONE_PREFIX line and its exit code.
+    Runs until stdin is closed; see YtDlpWorkerPool.
+    """
+    sys.stdout.reconfigure(line_buffering=True)
+    try:
+        import yt_dlp
+    except ImportError as e:
+        print(WORKER_PREFIX + json.dumps({"ready": False, "error": str(e)}))
+        return 3
+    print(WORKER_PREFIX + json.dumps({"ready": True, "version": yt_dlp.version.__version__}))
+
+    fields = PROGRESS_FIELDS.split(",")
+    last_progress = 0
+
+    def progress_hook(status):
+        nonlocal last_progress
+        # The hook runs for every block downloaded; nobody redraws that often
+        now = time.monotonic()
+        if status.get("status") == "downloading" and now - last_progress < 1 / DEFAULT_REFRESH_RATE:
+            return
+        last_progress = now
+        progress = {field: status.get(field) for field in fields}
+        print(PROGRESS_PREFIX + json.dumps(progress, default=str))
+
+    def postprocessor_hook(status):
+        progress = {"status": status.get("status"), "postprocessor": status.get("postprocessor")}
+        print(POSTPROCESSOR_PREFIX + json.dumps(progress))
+
+    # YoutubeDL instances by their arguments without the URLs, least recently used first
+    instances = {}
+    for request in sys.stdin:
+        returncode = 1
+        try:
+            args = json.loads(request)["args"]
+            options = yt_dlp.parse_options(args)
+            # A prefetched info file (--load-info-json) takes the place of the URL
+            info_file = options.options.load_info_filename
+            key = json.dumps([arg for arg in args if arg not in options.urls and arg != info_file])
+            ydl = instances.pop(key, None)
+            if ydl is None:
+                ydl = yt_dlp.YoutubeDL(dict(
+                    options.ydl_opts,
+                    noprogress=True,
+                    progress_hooks=[progress_hook],
+                    postprocessor_hooks=[postprocessor_hook]
+                ))
+            instances[key] = ydl
+            while len(instances) > WORKER_INSTANCES:
+                instances.pop(next(iter(instances))).close()
+            # download() returns the instance's error code, which yt-dlp sets on
+            # any error and never clears; an earlier job's failure is not this one's
+            ydl._download_retcode = 0
+            if info_file:
+                returncode = ydl.download_with_info_file(info_file)
+            else:
+                returncode = ydl.download(options.urls)
+        except SystemExit as e:
+            # Invalid arguments; yt-dlp has printed why
+            returncode = e.code if isinstance(e.code, int) else 2
+        except yt_dlp.utils.DownloadError:
+            # yt-dlp has reported the error itself
+            pass
+        except Exception as e:
+            print(f"ERROR: {str(e)}")
+        print(WORKER_DONE_PREFIX + json.dumps({"returncode": returncode}))
+    for ydl in instances.values():
+        ydl.close()
+    return 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Download YouTube videos with yt-dlp. Without --batch or URLs the GUI starts."
+    )
+    parser.add_argument("urls", nargs="*", help="URLs to download without the GUI")
+    parser.add_argument("--batch", metavar="FILE",
+                        help='download the URLs listed in FILE ("-" reads standard input)')
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_MAX_WORKERS,
+                        help=f"parallel downloads (default {DEFAULT_MAX_WORKERS})")
+    parser.add_argument("-o", "--output", default=os.path.join(os.path.expanduser("~"), "Downloads"),
+                        help="save location (default ~/Downloads)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="ignore cached video info")
+    parser.add_argument("--limit-rate", metavar="SCHEDULE", default="",
+                        help='total speed limit shared by all downloads, e.g. "2M" or '
+                             '"09:00-17:00=1M, 8M" (batch and daemon mode)')
+    parser.add_argument("--daemon", action="store_true",
+                        help="run without the GUI and serve a local HTTP API for submitting downloads")
+    parser.add_argument("--host", default=DEFAULT_DAEMON_HOST,
+                        help=f"daemon address (default {DEFAULT_DAEMON_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_DAEMON_PORT,
+                        help=f"daemon port (default {DEFAULT_DAEMON_PORT})")
+    parser.add_argument("--connect", metavar="URL", nargs="?",
+                        const=f"http://{DEFAULT_DAEMON_HOST}:{DEFAULT_DAEMON_PORT}",
+                        help="open the GUI as a client of a running daemon")
+    parser.add_argument("--backend", choices=(BACKEND_EXECUTABLE, BACKEND_MODULE),
+                        default=DEFAULT_BACKEND,
+                        help="run yt-dlp.exe for every download, or download in worker processes "
+                             "that load the yt_dlp Python package once; falls back to the "
+                             f"executable if it is not installed (default {DEFAULT_BACKEND})")
+    parser.add_argument("--preset", choices=list(FORMAT_PRESETS), default=DEFAULT_FORMAT_PRESET,
+                        help="quality and container of the downloads: "
+                             + ", ".join(f"{name} ({preset.label})"
+                                         for name, preset in FORMAT_PRESETS.items())
+                             + f" (default {DEFAULT_FORMAT_PRESET})")
+    parser.add_argument("--throttle-ratio", type=float, default=THROTTLE_RATIO, metavar="RATIO",
+                        help="restart a download on a new connection when its speed over "
+                             f"{THROTTLE_WINDOW} seconds falls below this fraction of its best "
+                             f"(default {THROTTLE_RATIO}; 0 turns it off)")
+    parser.add_argument("--throttle-fragments", type=int, metavar="N",
+                        help="download fragments N at a time (yt-dlp's -N) after such a restart")
+    parser.add_argument("--scratch-dir", metavar="DIR",
+                        help="download and merge in DIR, e.g. on a fast local disk, and only move "
+                             "finished files to the save location")
+    parser.add_argument("--yt-dlp-worker", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def bandwidth_from_args(args):
+    """The BandwidthScheduler for --limit-rate, or None (after printing why) if it is invalid"""
+    try:
+        return BandwidthScheduler.parse(args.limit_rate)
+    except ValueError as e:
+        print(f"Invalid --limit-rate: {str(e)}", file=sys.stderr)
+        return None
+
+def run_batch(args):
+    bandwidth = bandwidth_from_args(args)
+    if bandwidth is None:
+        return 2
+    urls = list(args.urls)
+    if args.batch:
+        try:
+            urls.extend(read_batch_file(args.batch))
+        except OSError as e:
+            print(f"Could not read {args.batch}: {str(e)}", file=sys.stderr)
+            return 2
+    runner = BatchRunner(
+        args.output,
+        max_workers=args.jobs,
+        refresh=args.refresh,
+        cache=open_metadata_cache(),
+        archive=open_download_archive(),
+        bandwidth=bandwidth,
+        backend=args.backend,
+        format_preset=args.preset,
+        throttle_ratio=args.throttle_ratio,
+        throttle_fragments=args.throttle_fragments,
+        scratch_dir=args.scratch_dir
+    )
+    return runner.run(urls)
+
+def run_daemon(args):
+    bandwidth = bandwidth_from_args(args)
+    if bandwidth is None:
+        return 2
+    engine = DownloadEngine(
+        max_workers=args.jobs,
+        cache=open_metadata_cache(),
+        archive=open_download_archive(),
+        # Separate from the GUI's journal, so both can run at once
+        journal=open_job_journal("daemon-journal.jsonl"),
+        metrics=open_job_metrics("daemon-metrics"),
+        bandwidth=bandwidth,
+        backend=args.backend,
+        format_preset=args.preset,
+        throttle_ratio=args.throttle_ratio,
+        throttle_fragments=args.throttle_fragments,
+        scratch_dir=args.scratch_dir
+    )
+    try:
+        token = read_daemon_token(create=True)
+    except OSError as e:
+        print(f"Could not write the API token: {str(e)}", file=sys.stderr)
+        return 2
+    server = JobServer(engine, args.output, host=args.host, port=args.port, token=token)
+    engine.resume()
+
+    def ready(server):
+        print(json.dumps({"event": "listening", "url": server.url}), flush=True)
+
+    try:
+        server.run(on_ready=ready)
+    except OSError as e:
+        print(f"Could not listen on {args.host}:{args.port}: {str(e)}", file=sys.stderr)
+        return 2
+    finally:
+        engine.shutdown()
+    return 0
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.yt_dlp_worker:
+        return run_yt_dlp_worker()
+    if args.daemon or args.batch or args.urls:
+        # Without the GUI, notable events are written to stderr; the output of
+        # the downloads only to the log file
+        handler = logging.StreamHandler()
+        handler.setLevel(logging.INFO)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+    if args.daemon:
+        open_log_file("daemon.log")
+        return run_daemon(args)
+    if args.batch or args.urls:
+        return run_batch(args)
+
+    load_tk()
     root = tk.Tk()
-    app = YouTubeDownloader(root)
+    app = YouTubeDownloader(root, daemon_url=args.connect, backend=args.backend,
+                            format_preset=args.preset, throttle_ratio=args.throttle_ratio,
+                            throttle_fragments=args.throttle_fragments,
+                            scratch_dir=args.scratch_dir)
     root.mainloop()
+    return 0
 
 if __name__ == "__main__":
-    main()
-
+    sys.exit(main())